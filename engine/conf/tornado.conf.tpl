@@ -1,5 +1,8 @@
 {
-    "container_manager_ports" : (8889,8890),
+    # container manager ports: commands, requests with responses, notifications (launch progress and configuration changes)
+    "container_manager_ports" : (8889,8890,8891),
+    # container manager message framing version. set to 0 while rolling out to instances running older versions.
+    "async_msg_version": 1,
     "websocket_protocol" : "wss",
     # debug:10, info:20, warning:30, error:40
     "jbox_log_level": 10,
@@ -7,6 +10,8 @@
 
     # Number of disks available to be mounted to images
     "numdisksmax" : 30,
+    # Number of config folders to keep unpacked from the user home image, ready to be used at login
+    "numdisksprepared" : 5,
     # Maximum number of hops through the load balancer till the installation is declared overloaded
     "numhopmax": 10,
     # Max size of user home. Default 500MB. User home is backed up within 10 minutes of the container stopping.
@@ -15,6 +20,38 @@
     # Number of seconds to reserve a disk when setting it up for a user.
     "disk_reserve_secs": 180,
 
+    # Seconds between full reconciliations of the in-memory container inventory with docker.
+    # Docker events keep the inventory current in between.
+    "container_inventory_reconcile_secs": 60,
+
+    # Worker threads of the container manager, per class of commands.
+    # Free workers pick up requests first, then session launches, cleanups and other maintenance tasks, in that order.
+    "jboxd_workers": { "respond": 1, "launch": 10, "cleanup": 4, "maintenance": 2 },
+
+    # Journal of commands received by the container manager, replayed if lost in a restart. None disables it.
+    "jboxd_journal": "/jboxengine/data/db/jboxd_journal.db",
+
+    # Performance counters of the instance are sampled every sample_secs, and the latest samples are published
+    # every publish_secs. The last `history` samples are kept in memory.
+    "perf_counters": { "sample_secs": 10, "publish_secs": 60, "history": 360 },
+
+    # Used by the predictive scaler plugin (juliabox.plugins.scaler_predictive), which sizes the cluster from
+    # load history by hour of week. Machines are added when demand now or forecast within lead_hours needs them at
+    # scale_up_at_load. One machine is removed at a time when demand now and forecast within hold_hours fits in fewer
+    # at scale_down_at_load.
+    "predictive_scaler": {
+        "scale_up_at_load": 70,
+        "scale_down_at_load": 40,
+        "lead_hours": 1,
+        "hold_hours": 2,
+        "max_step": 4,
+        "sample_secs": 300
+    },
+
+    # Metrics are queued and published to the monitoring service in the background, in batches every flush_secs.
+    # Failed writes are retried with backoff. At most max_queued points are held while the service is unavailable.
+    "metrics_publisher": { "flush_secs": 10, "max_queued": 1000, "retries": 3, "backoff_secs": 1 },
+
     # Installation specific session key. Used for encryption and signing. 
     "sesskey" : "$$SESSKEY",
     
@@ -54,6 +91,11 @@
         "cpu_limit" : 128,
         # Number of active containers to allow per instance
         "numlocalmax" : 30,
+        # Number of containers to keep pre-created, with blank disks and services started, for faster logins.
+        # 0 disables the pool.
+        "pool_size" : 0,
+        # Load percent (of numlocalmax or memory) beyond which the pool is drained
+        "pool_max_load" : 80,
         # Seconds to wait before clearing an inactive session, for example, when the user closes the browser window
         "inactivity_timeout" : 300,
         # Upper time limit for a user session before it is auto-deleted. 0 means never expire
@@ -92,6 +134,11 @@
     	"scale_up_at_load": 70,
     	"scale_up_policy": "addinstance",
 
+        # Placement decisions use a view of the cluster refreshed in the background every cluster_view_refresh_secs.
+        # The cloud is queried directly if the view is older than cluster_view_max_stale_secs.
+        "cluster_view_refresh_secs": 10,
+        "cluster_view_max_stale_secs": 60,
+
     	# Configure names for tables and buckets
 	    "backup_bucket": "juliabox-userbackup",
         "status_bucket": "juliabox-status",
@@ -133,6 +180,24 @@ Welcome to JuliaBox. We hope you will like it and also share with your friends.
     "db": {
         # default connect string for sqlite database
         "connect_str": "/jboxengine/data/db/juliabox.db",
+        # seconds dynamic configuration values are cached for, before being read again. 0 to disable the cache.
+        # "dynconfig_cache_secs": 60,
+        # number of records read from the database at a time in scans
+        # "scan_page_size": 1000,
+        # sqlite: use WAL journaling, and the sync mode to use with it (normal or full)
+        # "sqlite_wal": True,
+        # "sqlite_synchronous": "normal",
+        # sqlite: seconds to gather writes in, to be committed together. None to commit each write as it is made.
+        # "sqlite_group_commit_secs": 0.005,
+        # sqlite: seconds to wait for a lock held by another process, and number of prepared statements to keep
+        # "sqlite_busy_timeout_secs": 10,
+        # "sqlite_statement_cache": 200,
+        # cloudsql: maximum pooled connections, seconds to wait for one, seconds after which an idle connection is
+        # pinged, and seconds after which a connection is replaced
+        # "pool_size": 10,
+        # "pool_timeout_secs": 10,
+        # "pool_ping_secs": 60,
+        # "pool_max_lifetime_secs": 3600,
         # table name mappings
         # "tables" : {
         # }
@@ -7,7 +7,7 @@ import pytz
 import docker.utils
 from docker.utils import Ulimit
 
-from juliabox.jbox_container import BaseContainer
+from juliabox.jbox_container import BaseContainer, ContainerInventory
 from juliabox.jbox_util import JBoxCfg
 from juliabox.jbox_tasks import JBoxAsyncJob
 from juliabox.cloud import Compute
@@ -40,7 +40,7 @@ class APIContainer(BaseContainer):
 
     @staticmethod
     def configure():
-        BaseContainer.DCKR = JBoxCfg.dckr
+        BaseContainer.configure()
         APIContainer.DCKR_IMAGE = JBoxCfg.get('api.docker_image')
         APIContainer.MEM_LIMIT = JBoxCfg.get('api.mem_limit')
 
@@ -112,6 +112,7 @@ class APIContainer(BaseContainer):
                                                      hostname='juliabox',
                                                      name=container_name)
         dockid = jsonobj["Id"]
+        ContainerInventory.update(dockid)
         cont = APIContainer(dockid)
         APIContainer.log_info("Created " + cont.debug_str())
         cont.start()
@@ -240,15 +241,8 @@ class APIContainer(BaseContainer):
 
     @staticmethod
     def get_by_name(name):
-        if not name.startswith("/"):
-            nname = "/" + unicode(name)
-        else:
-            nname = unicode(name)
-
-        for c in APIContainer.DCKR.containers(all=True):
-            if ('Names' in c) and (c['Names'] is not None) and (c['Names'][0] == nname):
-                return APIContainer(c['Id'])
-        return None
+        cid = ContainerInventory.get_id_by_name(name)
+        return APIContainer(cid) if cid is not None else None
 
     @staticmethod
     def register_api_container(api_name, cname):
@@ -1,3 +1,4 @@
 __author__ = 'tan'
 
-from compute import JBPluginCloud, Compute
\ No newline at end of file
+from compute import JBPluginCloud, Compute, ClusterView
+from metrics_publisher import MetricsPublisher
@@ -1,8 +1,10 @@
 __author__ = 'tan'
 
+import time
 import socket
 import fcntl
 import struct
+import threading
 from juliabox.jbox_util import LoggerMixin, JBoxPluginType, JBoxCfg
 import random
 
@@ -50,7 +52,18 @@ class JBPluginCloud(LoggerMixin):
         - `should_accept_session(is_leader)`: Whether the instance can accept more load.
         - `get_redirect_instance_id()`: If the current instance is not ready to accept further load, a suggestion on which instance to load instead.
         - `get_image_recentness(instance=None)`: Whether the application image running on the instance is the latest.
+        - `get_image_recentness_all()`: Image recentness of all instances in the cluster, as a dict of instance: recentness.
         - `get_available_instances()`: Returns a list of instance props when using fixed size cluster.
+    - `JBPluginCloud.JBP_SCALER`, `JBPluginCloud.JBP_SCALER_PREDICTIVE`:
+        Decides the cluster size, used by compute plugins in place of load thresholds.
+        - `configure()`: Read and store configuration from JBoxCfg.
+        - `get_name()`: Name of the scaler, used in logs.
+        - `machines_to_add(ctx)`: Number of machines to add, or remove if negative, given `avg_load`,
+          `num_active_machines` and `is_leader` in `ctx`. Must not change shared state, as it is called by all
+          processes of all instances.
+        - `sample(ctx)` (`JBP_SCALER_PREDICTIVE` only): Add a sample of cluster load, given `avg_load` and
+          `num_active_machines` in `ctx`, to the history forecasts are made from. Called by the container manager
+          of the cluster leader only, on every housekeeping run.
     """
 
     JBP_BUCKETSTORE = "cloud.bucketstore"
@@ -78,6 +91,7 @@ class JBPluginCloud(LoggerMixin):
     JBP_MONITORING_GOOGLE_V3 = "cloud.monitoring.google.v3"
 
     JBP_SCALER = "cloud.scaler"
+    JBP_SCALER_PREDICTIVE = "cloud.scaler.predictive"
 
     __metaclass__ = JBoxPluginType
 
@@ -96,6 +110,7 @@ class Compute(LoggerMixin):
         plugin.configure()
         Compute.impl = plugin
         Compute.SCALE = JBoxCfg.get('cloud_host.scale_down')
+        ClusterView.configure()
 
     @staticmethod
     def get_install_id():
@@ -155,10 +170,16 @@ class Compute(LoggerMixin):
 
     @staticmethod
     def get_cluster_stats(stat_name, namespace=None):
+        if (stat_name == 'Load') and (namespace is None):
+            cluster_load = ClusterView.get_cluster_load()
+            if cluster_load is not None:
+                return cluster_load
         return Compute.impl.get_cluster_stats(stat_name, namespace)
 
     @staticmethod
     def get_cluster_average_stats(stat_name, namespace=None, results=None):
+        if results is None:
+            results = Compute.get_cluster_stats(stat_name, namespace)
         return Compute.impl.get_cluster_average_stats(stat_name, namespace, results)
 
     @staticmethod
@@ -185,24 +206,41 @@ class Compute(LoggerMixin):
                 return random.choice(available_nodes)
             else:
                 return None
-        return Compute.impl.get_redirect_instance_id()
+        return ClusterView.get_redirect_instance_id()
 
     @staticmethod
     def should_accept_session(is_leader):
-        self_instance_id = Compute.get_instance_id()
-        self_load = Compute.get_instance_stats(self_instance_id, 'Load')
         if not Compute.SCALE:
+            self_load = Compute.get_instance_stats(Compute.get_instance_id(), 'Load')
             accept = self_load < 100
             Compute.log_debug("cluster size is fixed. accept: %r", accept)
             return accept
-        return Compute.impl.should_accept_session(is_leader)
+        return ClusterView.should_accept_session(is_leader)
 
     @staticmethod
     def get_image_recentness(instance=None):
         if not Compute.SCALE:
             Compute.log_debug("ignoring image recentness as cluster size is fixed")
             return 0
-        return Compute.impl.get_image_recentness(instance)
+        return ClusterView.get_image_recentness(instance)
+
+    @staticmethod
+    def sample_cluster_load():
+        """ Adds a sample of cluster load to the history of the predictive scaler, if one is configured.
+        To be called on the cluster leader only.
+        """
+        scaler = JBPluginCloud.jbox_get_plugin(JBPluginCloud.JBP_SCALER_PREDICTIVE)
+        if (scaler is None) or (not Compute.SCALE):
+            return
+        # as seen by the compute plugins: machines running older images are not counted
+        cluster_load = Compute.get_cluster_stats('Load') or {}
+        recentness = Compute.impl.get_image_recentness_all()
+        cluster_load = dict((k, v) for (k, v) in cluster_load.iteritems()
+                            if (recentness.get(k, 0) >= 0) and (v is not None))
+        if len(cluster_load) == 0:
+            return
+        avg_load = Compute.get_cluster_average_stats('Load', results=cluster_load)
+        scaler.sample({'avg_load': avg_load, 'num_active_machines': len(cluster_load)})
 
     @staticmethod
     def register_instance_dns():
@@ -217,3 +255,150 @@ class Compute(LoggerMixin):
         if plugin is None:
             return
         plugin.delete_cname(Compute.get_alias_hostname())
+
+
+class ClusterView(LoggerMixin):
+    """ View of the cluster from this instance, used for placement decisions on the login path.
+
+    Holds the load and image recentness of every instance in the cluster, whether this instance accepts sessions,
+    and the instance to redirect sessions to otherwise. A background thread refreshes the view from the compute plugin
+    every `REFRESH_INTERVAL` seconds, which makes placement decisions in-memory lookups. Lookups go to the compute
+    plugin when the view is older than `MAX_STALENESS` seconds, or has not been started.
+
+    Whether an instance accepts sessions depends on whether it is the cluster leader. Answers are kept for the values
+    of `is_leader` seen in lookups.
+
+    The local IP of an instance is looked up once, when it is first seen, for requests to its container manager.
+    """
+    REFRESH_INTERVAL = 10
+    MAX_STALENESS = 60
+
+    LOCK = threading.Lock()
+    THREAD = None
+    REFRESHED = 0
+    # instance -> {'load': load, 'image_recentness': recentness, 'accept': load < 100 and not on an older image,
+    #              'local_ip': local IP, None if it could not be looked up}
+    INSTANCES = {}
+    # is_leader -> whether this instance accepts sessions
+    ACCEPT = {}
+    REDIRECT_INSTANCE = None
+
+    @staticmethod
+    def configure():
+        ClusterView.REFRESH_INTERVAL = JBoxCfg.get('cloud_host.cluster_view_refresh_secs',
+                                                   ClusterView.REFRESH_INTERVAL)
+        ClusterView.MAX_STALENESS = JBoxCfg.get('cloud_host.cluster_view_max_stale_secs', ClusterView.MAX_STALENESS)
+
+    @staticmethod
+    def start():
+        """ Takes the first snapshot and starts the refresher thread. Not required when the cluster size is fixed. """
+        if (not Compute.SCALE) or (ClusterView.THREAD is not None):
+            return
+        try:
+            ClusterView.refresh()
+        except:
+            ClusterView.log_exception("Exception refreshing cluster view")
+        ClusterView.THREAD = threading.Thread(target=ClusterView._refresh_periodically, name='cluster_view')
+        ClusterView.THREAD.daemon = True
+        ClusterView.THREAD.start()
+
+    @staticmethod
+    def _refresh_periodically():
+        while True:
+            time.sleep(ClusterView.REFRESH_INTERVAL)
+            try:
+                ClusterView.refresh()
+            except:
+                ClusterView.log_exception("Exception refreshing cluster view")
+
+    @staticmethod
+    def refresh():
+        impl = Compute.impl
+        with ClusterView.LOCK:
+            leader_flags = ClusterView.ACCEPT.keys()
+            local_ips = dict((inst, info['local_ip']) for (inst, info) in ClusterView.INSTANCES.iteritems()
+                             if info['local_ip'] is not None)
+
+        cluster_load = impl.get_cluster_stats('Load') or {}
+        recentness = impl.get_image_recentness_all()
+        instances = {}
+        for inst in set(cluster_load.keys() + recentness.keys()):
+            load = cluster_load.get(inst)
+            inst_recentness = recentness.get(inst, 0)
+            if inst not in local_ips:
+                try:
+                    local_ips[inst] = impl.get_instance_local_ip(inst)
+                except:
+                    ClusterView.log_exception("Exception looking up local ip of %s", inst)
+            instances[inst] = {
+                'load': load,
+                'image_recentness': inst_recentness,
+                'accept': (load is not None) and (load < 100) and (inst_recentness >= 0),
+                'local_ip': local_ips.get(inst)
+            }
+        accept = dict((is_leader, impl.should_accept_session(is_leader)) for is_leader in leader_flags)
+        redirect_instance = impl.get_redirect_instance_id()
+
+        with ClusterView.LOCK:
+            ClusterView.INSTANCES = instances
+            ClusterView.ACCEPT.update(accept)
+            ClusterView.REDIRECT_INSTANCE = redirect_instance
+            ClusterView.REFRESHED = time.time()
+        ClusterView.log_debug("Refreshed cluster view. instances: %r, accept: %r, redirect: %r",
+                              instances, accept, redirect_instance)
+
+    @staticmethod
+    def _is_fresh():
+        return (ClusterView.THREAD is not None) and \
+               ((time.time() - ClusterView.REFRESHED) <= ClusterView.MAX_STALENESS)
+
+    @staticmethod
+    def get_instances():
+        """ Snapshot of the view as a dict of instance: {load, image_recentness, accept}. None if stale. """
+        with ClusterView.LOCK:
+            if not ClusterView._is_fresh():
+                return None
+            return dict((inst, dict(info)) for (inst, info) in ClusterView.INSTANCES.iteritems())
+
+    @staticmethod
+    def get_instance_local_ips():
+        """ Local IPs of instances in the view, as a dict of instance: local IP. None if stale. """
+        with ClusterView.LOCK:
+            if not ClusterView._is_fresh():
+                return None
+            return dict((inst, info['local_ip']) for (inst, info) in ClusterView.INSTANCES.iteritems()
+                        if info['local_ip'] is not None)
+
+    @staticmethod
+    def get_cluster_load():
+        with ClusterView.LOCK:
+            if not ClusterView._is_fresh():
+                return None
+            return dict((inst, info['load']) for (inst, info) in ClusterView.INSTANCES.iteritems()
+                        if info['load'] is not None)
+
+    @staticmethod
+    def get_image_recentness(instance=None):
+        lookup = Compute.get_instance_id() if instance is None else instance
+        with ClusterView.LOCK:
+            if ClusterView._is_fresh() and (lookup in ClusterView.INSTANCES):
+                return ClusterView.INSTANCES[lookup]['image_recentness']
+        return Compute.impl.get_image_recentness(instance)
+
+    @staticmethod
+    def should_accept_session(is_leader):
+        with ClusterView.LOCK:
+            if ClusterView._is_fresh() and (is_leader in ClusterView.ACCEPT):
+                return ClusterView.ACCEPT[is_leader]
+        accept = Compute.impl.should_accept_session(is_leader)
+        with ClusterView.LOCK:
+            # refreshed along with the rest of the view from now on
+            ClusterView.ACCEPT[is_leader] = accept
+        return accept
+
+    @staticmethod
+    def get_redirect_instance_id():
+        with ClusterView.LOCK:
+            if ClusterView._is_fresh():
+                return ClusterView.REDIRECT_INSTANCE
+        return Compute.impl.get_redirect_instance_id()
@@ -0,0 +1,105 @@
+__author__ = 'tan'
+
+import time
+import threading
+import collections
+
+from juliabox.jbox_util import LoggerMixin, JBoxCfg
+
+
+class MetricsPublisher(LoggerMixin):
+    """ Publishes metric points to a monitoring service from a background thread.
+
+    Points are queued by `put`, which never blocks on the service. The queue is flushed when it holds
+    `max_batch` points, or every `flush_secs` seconds otherwise. Each flush writes up to `max_batch` points,
+    the service's limit per call, in a single call to `write`. If `key` is given, it names the series a point
+    belongs to, and points of the same series queued together are merged to the latest one, as some services
+    accept only one point per series in a call.
+
+    A failed write is retried `retries` times with exponential backoff, and then dropped. At most `max_queued`
+    points are kept while the service is slow or unavailable; the oldest are dropped beyond that.
+    """
+
+    def __init__(self, name, write, max_batch, key=None):
+        self.name = name
+        self.write = write
+        self.max_batch = max_batch
+        self.key = key
+
+        self.flush_secs = JBoxCfg.get('metrics_publisher.flush_secs', 10)
+        self.max_queued = JBoxCfg.get('metrics_publisher.max_queued', 1000)
+        self.retries = JBoxCfg.get('metrics_publisher.retries', 3)
+        self.backoff_secs = JBoxCfg.get('metrics_publisher.backoff_secs', 1)
+
+        self.lock = threading.Condition()
+        self.queue = collections.deque()
+        self.thread = None
+        self.published = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def put(self, points):
+        with self.lock:
+            self.queue.extend(points)
+            ndrop = len(self.queue) - self.max_queued
+            for _ in range(ndrop):
+                self.queue.popleft()
+            if ndrop > 0:
+                self.dropped += ndrop
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._publish_periodically, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            if len(self.queue) >= self.max_batch:
+                self.lock.notify()
+        if ndrop > 0:
+            self.log_warn("%s: dropped %d points as the queue is full. %d dropped so far.", self.name, ndrop,
+                          self.dropped)
+
+    def stats(self):
+        with self.lock:
+            return {'queued': len(self.queue), 'published': self.published, 'merged': self.merged,
+                    'dropped': self.dropped}
+
+    def _next_batch(self):
+        # called with lock held
+        batch = []
+        positions = {}
+        while (len(self.queue) > 0) and (len(batch) < self.max_batch):
+            point = self.queue.popleft()
+            if self.key is not None:
+                k = self.key(point)
+                if k in positions:
+                    batch[positions[k]] = point
+                    self.merged += 1
+                    continue
+                positions[k] = len(batch)
+            batch.append(point)
+        return batch
+
+    def _publish_periodically(self):
+        while True:
+            with self.lock:
+                if len(self.queue) < self.max_batch:
+                    self.lock.wait(self.flush_secs)
+                batch = self._next_batch()
+            if len(batch) > 0:
+                self._write(batch)
+
+    def _write(self, batch):
+        attempt = 0
+        while True:
+            try:
+                self.write(batch)
+                break
+            except:
+                if attempt >= self.retries:
+                    self.log_exception("%s: dropping %d points after %d attempts", self.name, len(batch), attempt + 1)
+                    with self.lock:
+                        self.dropped += len(batch)
+                    return
+                self.log_warn("%s: exception publishing %d points. Will retry.", self.name, len(batch))
+                time.sleep(self.backoff_secs * (2 ** attempt))
+                attempt += 1
+        with self.lock:
+            self.published += len(batch)
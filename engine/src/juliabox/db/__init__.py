@@ -18,6 +18,7 @@ def configure():
     for cls in (JBoxUserV2, JBoxSessionProps, JBoxDynConfig, JBoxAPISpec):
         cls.NAME = tablenames.get(cls.NAME, cls.NAME)
         JBoxDB.log_info("%s provided by table %s", cls.__name__, cls.NAME)
+    JBoxDynConfig.configure()
 
     for plugin in JBPluginDB.jbox_get_plugins(JBPluginDB.JBP_TABLE):
         JBoxDB.log_info("Found plugin %r provides %r", plugin, plugin.provides)
@@ -86,11 +86,33 @@ class JBoxSessionProps(JBoxDB):
 
     @staticmethod
     def attach_instance(cluster, session_id, instance_id, container_state=None):
-        sessprops = JBoxSessionProps(cluster, session_id, create=True)
-        sessprops.set_instance_id(instance_id)
+        if session_id.startswith("/"):
+            session_id = session_id[1:]
+        attach_time = datetime.datetime.now(pytz.utc)
+        values = {
+            'instance_id': instance_id,
+            'attach_time': JBoxSessionProps.datetime_to_epoch_secs(attach_time)
+        }
         if container_state:
-            sessprops.set_container_state(container_state)
-        sessprops.save()
+            values['container_state'] = container_state
+        JBoxSessionProps.upsert({'session_id': JBoxDB.qual(cluster, session_id)}, values)
+
+    @staticmethod
+    def attach_instances(cluster, sessions, instance_id):
+        """ Same as `attach_instance`, for many sessions, passed as a dict of session id to container state. """
+        attach_time = JBoxSessionProps.datetime_to_epoch_secs(datetime.datetime.now(pytz.utc))
+        records = []
+        for (session_id, container_state) in sessions.iteritems():
+            if session_id.startswith("/"):
+                session_id = session_id[1:]
+            values = {
+                'instance_id': instance_id,
+                'attach_time': attach_time
+            }
+            if container_state:
+                values['container_state'] = container_state
+            records.append(({'session_id': JBoxDB.qual(cluster, session_id)}, values))
+        JBoxSessionProps.batch_upsert(records)
 
     @staticmethod
     def detach_instance(cluster, session_id, instance_id):
@@ -119,7 +141,8 @@ class JBoxSessionProps(JBoxDB):
         valid_time = nowsecs - JBoxSessionProps.SESS_UPDATE_INTERVAL
         result = dict()
         for record in JBoxSessionProps.scan(session_id__beginswith=cluster, attach_time__gte=valid_time,
-                                            instance_id__gt=" "):
+                                            instance_id__gt=" ",
+                                            attributes=('session_id', 'instance_id', 'container_state')):
             instance_id = record.get('instance_id', None)
             if instance_id:
                 sessions = result.get(instance_id, dict())
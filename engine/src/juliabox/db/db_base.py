@@ -13,6 +13,7 @@ class JBoxDB(LoggerMixin):
     INT = 'INT'
     VCHAR = 'VARCHAR(200)'
     TEXT = 'TEXT'
+    SQL_INDEXES = None
 
     @staticmethod
     def configure():
@@ -22,7 +23,7 @@ class JBoxDB(LoggerMixin):
     @classmethod
     def table(cls):
         if cls.TABLE is None:
-            cls.TABLE = JBoxDB.DB_IMPL.table_open(cls.NAME)
+            cls.TABLE = JBoxDB.DB_IMPL.table_open(cls.NAME, cls.SQL_INDEXES)
             cls.log_info("%s initialized to %s with %s", cls.__name__, cls.NAME, JBoxDB.DB_IMPL.__name__)
         return cls.TABLE
 
@@ -38,6 +39,10 @@ class JBoxDB(LoggerMixin):
     def scan(cls, **kwargs):
         return JBoxDB.DB_IMPL.record_scan(cls.table(), **kwargs)
 
+    @classmethod
+    def scan_page(cls, page_size=None, start_key=None, **kwargs):
+        return JBoxDB.DB_IMPL.record_scan_page(cls.table(), page_size=page_size, start_key=start_key, **kwargs)
+
     @classmethod
     def query(cls, **kwargs):
         return JBoxDB.DB_IMPL.record_query(cls.table(), **kwargs)
@@ -46,6 +51,30 @@ class JBoxDB(LoggerMixin):
     def query_count(cls, **kwargs):
         return JBoxDB.DB_IMPL.record_count(cls.table(), **kwargs)
 
+    @classmethod
+    def upsert(cls, keys, values):
+        JBoxDB.DB_IMPL.record_upsert(cls.table(), keys, values)
+
+    @classmethod
+    def batch_create(cls, records):
+        if len(records) > 0:
+            JBoxDB.DB_IMPL.record_batch_create(cls.table(), records)
+
+    @classmethod
+    def batch_save(cls, records):
+        if len(records) > 0:
+            JBoxDB.DB_IMPL.record_batch_save(cls.table(), records)
+
+    @classmethod
+    def batch_upsert(cls, records):
+        if len(records) > 0:
+            JBoxDB.DB_IMPL.record_batch_upsert(cls.table(), records)
+
+    @classmethod
+    def batch_delete(cls, records):
+        if len(records) > 0:
+            JBoxDB.DB_IMPL.record_batch_delete(cls.table(), records)
+
     def save(self):
         JBoxDB.DB_IMPL.record_save(self.__class__.table(), self.item)
 
@@ -99,14 +128,18 @@ class JBPluginDB(JBoxDB):
     - `JBPluginDB.JBP_DB`, `JBPluginDB.JBP_DB_DYNAMODB` and `JBPluginDB.JBP_DB_RDBMS`:
         Provide database access. Must implement the following methods.
         - `configure()`: Read and store database configuration.
-        - `table_open(table_name)`: Open and return a handle to the named table. Subsequent operations on table shall pass the handle.
+        - `table_open(table_name, indexes=None)`: Open and return a handle to the named table. Subsequent operations on table shall pass the handle. `indexes` are the indexes the table is queried with, as declared in `SQL_INDEXES`.
         - `record_create(table, data)`: Insert a new record with data (dictionary of column names and values).
         - `record_fetch(table, **kwargs)`: Fetch a single record. Keys passed in kwargs.
-        - `record_scan(table, **kwargs)`: Scan all records in the table`. Required attributes passed in kwargs.
+        - `record_scan(table, **kwargs)`: Scan all records in the table`. Selection criteria passed in kwargs. Records are returned as an iterator, read from the database `max_page_size` (optional kwarg) records at a time. Only the columns named in `attributes` (optional kwarg) are read, with the key columns in some databases.
+        - `record_scan_page(table, page_size=None, start_key=None, **kwargs)`: Scan a page of up to `page_size` records, starting after `start_key`. Returns the records and the key to pass as `start_key` for the next page, which is None after the last page. Pages may hold fewer records than `page_size`. Selection criteria and `attributes` passed in kwargs, as for `record_scan`.
         - `record_query(table, **kwargs)`: Fetch one or more records. Selection criteria passed in kwargs.
         - `record_count(table, **kwargs)`: Count matching records. Selection criteria passed in kwargs.
         - `record_save(table, data)`: Update a single record with data (dictionary of column names and values)
+        - `record_upsert(table, keys, values)`: Create a record with keys and values (dictionaries of column names and values) if it does not exist, else update only the columns in values. Atomically, in a single request to the database.
         - `record_delete(table, data)`: Delete a single record with keys specified in data (dictionary of column names and values)
+        - `record_batch_create(table, records)`, `record_batch_save(table, records)`, `record_batch_delete(table, records)`: Same as `record_create`, `record_save` and `record_delete`, for many records, with as few requests to the database as possible. In one transaction, where the database supports it.
+        - `record_batch_upsert(table, records)`: Same as `record_upsert`, for many records passed as a list of (keys, values).
     - `JBPluginDB.JBP_TABLE`, `JBPluginDB.JBP_TABLE_DYNAMODB` and `JBPluginDB.JBP_TABLE_RDBMS`:
         Provide a table implementation. Must extend `JBPluginDB` and provide the following attributes:
         - `TABLE`: to hold the opened table handle
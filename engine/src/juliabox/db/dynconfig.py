@@ -1,5 +1,7 @@
 import json
+import time
 import datetime
+import threading
 import pytz
 
 from boto.dynamodb2.fields import HashKey
@@ -7,10 +9,21 @@ from boto.dynamodb2.types import STRING
 import isodate
 
 from juliabox.db import JBoxDB, JBoxDBItemNotFound
-from juliabox.jbox_util import parse_iso_time
+from juliabox.jbox_util import parse_iso_time, JBoxCfg
 
 
 class JBoxDynConfig(JBoxDB):
+    """ Configuration that can be changed while JuliaBox is running, shared by all instances of a cluster.
+
+    Values are read through an in-process cache, and are read again from the database after `CACHE_SECS` seconds.
+    Values set or deleted through this process are written through to the cache. The keys changed are also passed to
+    `ON_CHANGE` (if set), with whether to pass them on to other instances, so that other processes and instances can
+    drop them from their caches with `invalidate`.
+    A change missed by a process is picked up when the cached value expires.
+
+    Changes to statistics (`set_stat`, `set_stat_collected_date`) are not passed on to other instances, where they
+    are read again when cached values expire.
+    """
     NAME = 'jbox_dynconfig'
 
     SCHEMA = [
@@ -30,6 +43,15 @@ class JBoxDynConfig(JBoxDB):
 
     DEFAULT_REGISTRATION_RATE = 60
 
+    CACHE_SECS = 60
+    # key -> (expiry time, value). value is None if the key is not set.
+    CACHE = {}
+    CACHE_LOCK = threading.Lock()
+    # incremented on every change, so that a value read from the database while it changed is not cached
+    GENERATION = 0
+    # called with (keys, forward). set it to a staticmethod, or it is bound as a method of this class.
+    ON_CHANGE = None
+
     def __init__(self, prop, create=False, value=None):
         try:
             self.item = self.fetch(name=prop)
@@ -54,56 +76,98 @@ class JBoxDynConfig(JBoxDB):
         return self.get_attrib('value')
 
     @staticmethod
-    def unset_cluster_leader(cluster):
+    def configure():
+        JBoxDynConfig.CACHE_SECS = JBoxCfg.get('db.dynconfig_cache_secs', JBoxDynConfig.CACHE_SECS)
+
+    @staticmethod
+    def invalidate(keys=None):
+        """ Drop `keys` (all keys if None) from the cache of this process. """
+        with JBoxDynConfig.CACHE_LOCK:
+            JBoxDynConfig.GENERATION += 1
+            if keys is None:
+                JBoxDynConfig.CACHE.clear()
+            else:
+                for key in keys:
+                    JBoxDynConfig.CACHE.pop(key, None)
+
+    @staticmethod
+    def _get(key):
+        tnow = time.time()
+        with JBoxDynConfig.CACHE_LOCK:
+            cached = JBoxDynConfig.CACHE.get(key)
+            if (cached is not None) and (cached[0] > tnow):
+                return cached[1]
+            generation = JBoxDynConfig.GENERATION
+
         try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'leader'))
-            record.delete()
+            value = JBoxDynConfig(key).get_value()
         except JBoxDBItemNotFound:
-            return
+            value = None
+
+        with JBoxDynConfig.CACHE_LOCK:
+            if (generation == JBoxDynConfig.GENERATION) and (JBoxDynConfig.CACHE_SECS > 0):
+                JBoxDynConfig.CACHE[key] = (tnow + JBoxDynConfig.CACHE_SECS, value)
+        return value
 
     @staticmethod
-    def set_cluster_leader(cluster, instance):
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'leader'), create=True, value=instance)
-        if not record.is_new:
-            record.set_value(instance)
-            record.save()
+    def _set(key, value, forward=True):
+        JBoxDynConfig.upsert({'name': key}, {'value': value})
+        JBoxDynConfig._changed(key, value, forward)
 
     @staticmethod
-    def get_cluster_leader(cluster):
+    def _delete(key):
         try:
-            return JBoxDynConfig(JBoxDB.qual(cluster, 'leader')).get_value()
+            JBoxDynConfig(key).delete()
         except JBoxDBItemNotFound:
-            return None
+            pass
+        JBoxDynConfig._changed(key, None)
+
+    @staticmethod
+    def _changed(key, value, forward=True):
+        with JBoxDynConfig.CACHE_LOCK:
+            JBoxDynConfig.GENERATION += 1
+            if JBoxDynConfig.CACHE_SECS > 0:
+                JBoxDynConfig.CACHE[key] = (time.time() + JBoxDynConfig.CACHE_SECS, value)
+        if JBoxDynConfig.ON_CHANGE is not None:
+            try:
+                JBoxDynConfig.ON_CHANGE([key], forward)
+            except:
+                JBoxDynConfig.log_exception("Exception notifying change of %s", key)
+
+    @staticmethod
+    def unset_cluster_leader(cluster):
+        JBoxDynConfig._delete(JBoxDB.qual(cluster, 'leader'))
+
+    @staticmethod
+    def set_cluster_leader(cluster, instance):
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'leader'), instance)
+
+    @staticmethod
+    def get_cluster_leader(cluster):
+        return JBoxDynConfig._get(JBoxDB.qual(cluster, 'leader'))
 
     @staticmethod
     def set_allow_registration(cluster, allow):
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'allow_registration'), create=True, value=str(allow))
-        if not record.is_new:
-            record.set_value(str(allow))
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'allow_registration'), str(allow))
 
     @staticmethod
     def get_allow_registration(cluster):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'allow_registration'))
-        except JBoxDBItemNotFound:
+        allow = JBoxDynConfig._get(JBoxDB.qual(cluster, 'allow_registration'))
+        if allow is None:
             return True
 
-        return record.get_value() == 'True'
+        return allow == 'True'
 
     @staticmethod
     def get_registration_hourly_rate(cluster):
-        try:
-            return int(JBoxDynConfig(JBoxDB.qual(cluster, 'registrations_hourly_rate')).get_value())
-        except JBoxDBItemNotFound:
+        rate = JBoxDynConfig._get(JBoxDB.qual(cluster, 'registrations_hourly_rate'))
+        if rate is None:
             return JBoxDynConfig.DEFAULT_REGISTRATION_RATE
+        return int(rate)
 
     @staticmethod
     def set_registration_hourly_rate(cluster, rate):
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'registrations_hourly_rate'), create=True, value=str(rate))
-        if not record.is_new:
-            record.set_value(str(rate))
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'registrations_hourly_rate'), str(rate))
 
     @staticmethod
     def set_message(cluster, message, valid_delta):
@@ -115,19 +179,11 @@ class JBoxDynConfig(JBoxDB):
             'valid_till': isodate.datetime_isoformat(tvalid)
         }
         msg = json.dumps(msg)
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'message'), create=True, value=msg)
-        if not record.is_new:
-            record.set_value(msg)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'message'), msg)
 
     @staticmethod
     def get_message(cluster, del_expired=True):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'message'))
-        except JBoxDBItemNotFound:
-            return None
-
-        msg = record.get_value()
+        msg = JBoxDynConfig._get(JBoxDB.qual(cluster, 'message'))
         if msg is None:
             return None
 
@@ -140,17 +196,16 @@ class JBoxDynConfig(JBoxDB):
             return msg['msg']
 
         if del_expired:
-            record.delete()
+            JBoxDynConfig._delete(JBoxDB.qual(cluster, 'message'))
 
         return None
 
     @staticmethod
     def get_user_home_image(cluster):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'user_home_image'))
-        except JBoxDBItemNotFound:
+        img = JBoxDynConfig._get(JBoxDB.qual(cluster, 'user_home_image'))
+        if img is None:
             return None, None, None
-        img = json.loads(record.get_value())
+        img = json.loads(img)
         pkg_file = img['pkg_file'] if 'pkg_file' in img else None
         home_file = img['home_file'] if 'home_file' in img else None
         return img['bucket'], pkg_file, home_file
@@ -163,26 +218,19 @@ class JBoxDynConfig(JBoxDB):
             'home_file': home_file
         }
         img = json.dumps(img)
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'user_home_image'), create=True, value=img)
-        if not record.is_new:
-            record.set_value(img)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'user_home_image'), img)
 
     @staticmethod
     def set_stat_collected_date(cluster):
         dt = datetime.datetime.now(pytz.utc).isoformat()
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'stat_date'), create=True, value=dt)
-        if not record.is_new:
-            record.set_value(dt)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'stat_date'), dt, forward=False)
 
     @staticmethod
     def get_stat_collected_date(cluster):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'stat_date'))
-        except JBoxDBItemNotFound:
+        dt = JBoxDynConfig._get(JBoxDB.qual(cluster, 'stat_date'))
+        if dt is None:
             return None
-        return parse_iso_time(record.get_value())
+        return parse_iso_time(dt)
 
     @staticmethod
     def is_stat_collected_within(cluster, days):
@@ -195,49 +243,37 @@ class JBoxDynConfig(JBoxDB):
     @staticmethod
     def set_stat(cluster, stat_name, stat):
         val = json.dumps(stat)
-        record = JBoxDynConfig(JBoxDB.qual(cluster, stat_name), create=True, value=val)
-        if not record.is_new:
-            record.set_value(val)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, stat_name), val, forward=False)
 
     @staticmethod
     def get_stat(cluster, stat_name):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, stat_name))
-        except JBoxDBItemNotFound:
+        val = JBoxDynConfig._get(JBoxDB.qual(cluster, stat_name))
+        if val is None:
             return None
-        return json.loads(record.get_value())
+        return json.loads(val)
 
     @staticmethod
     def get_course(cluster, course_id):
-        try:
-            course_key = '|'.join(['course', course_id])
-            record = JBoxDynConfig(JBoxDB.qual(cluster, course_key))
-        except JBoxDBItemNotFound:
+        course_key = '|'.join(['course', course_id])
+        val = JBoxDynConfig._get(JBoxDB.qual(cluster, course_key))
+        if val is None:
             return None
-        return json.loads(record.get_value())
+        return json.loads(val)
 
     @staticmethod
     def set_course(cluster, course_id, course_details):
         val = json.dumps(course_details)
         course_key = '|'.join(['course', course_id])
-        record = JBoxDynConfig(JBoxDB.qual(cluster, course_key), create=True, value=val)
-        if not record.is_new:
-            record.set_value(val)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, course_key), val)
 
     @staticmethod
     def get_user_cluster_config(cluster):
-        try:
-            record = JBoxDynConfig(JBoxDB.qual(cluster, 'user_cluster'))
-        except JBoxDBItemNotFound:
+        val = JBoxDynConfig._get(JBoxDB.qual(cluster, 'user_cluster'))
+        if val is None:
             return None
-        return json.loads(record.get_value())
+        return json.loads(val)
 
     @staticmethod
     def set_user_cluster_config(cluster, cfg):
         val = json.dumps(cfg)
-        record = JBoxDynConfig(JBoxDB.qual(cluster, 'user_cluster'), create=True, value=val)
-        if not record.is_new:
-            record.set_value(val)
-            record.save()
+        JBoxDynConfig._set(JBoxDB.qual(cluster, 'user_cluster'), val)
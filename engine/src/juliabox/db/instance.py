@@ -77,32 +77,45 @@ class JBoxInstanceProps(JBoxDB):
 
     @staticmethod
     def set_props(cluster, instance_id, load=None, accept=None, api_status=None):
-        instance_props = JBoxInstanceProps(cluster, instance_id, create=True)
+        now = datetime.datetime.now(pytz.utc)
+        values = {
+            'publish_time': JBoxInstanceProps.datetime_to_epoch_secs(now)
+        }
         if load is not None:
-            instance_props.set_load(load)
+            values['load'] = str(load)
         if accept is not None:
-            instance_props.set_accept(accept)
+            values['accept'] = 1 if accept else 0
         if api_status is not None:
-            instance_props.set_api_status(api_status)
-        instance_props.set_publish_time()
-        instance_props.save()
+            values['api_status'] = json.dumps(api_status)
+        JBoxInstanceProps.upsert({'instance_id': JBoxDB.qual(cluster, instance_id)}, values)
 
     @staticmethod
     def purge_stale_instances(cluster):
-        for iid in JBoxInstanceProps.get_stale_instances(cluster):
-            instance = JBoxInstanceProps(cluster, iid)
-            instance.delete()
+        # delete a page at a time, so that the stale records are not all held in memory
+        criteria = JBoxInstanceProps._stale_criteria(cluster)
+        start_key = None
+        while True:
+            records, start_key = JBoxInstanceProps.scan_page(start_key=start_key, attributes=('instance_id',),
+                                                             **criteria)
+            JBoxInstanceProps.batch_delete(records)
+            if start_key is None:
+                break
 
     @staticmethod
-    def get_stale_instances(cluster):
+    def _stale_criteria(cluster):
         now = datetime.datetime.now(pytz.utc)
         nowsecs = JBoxInstanceProps.datetime_to_epoch_secs(now)
         valid_time = nowsecs - JBoxInstanceProps.SESS_UPDATE_INTERVAL
-        stale = []
-        for record in JBoxInstanceProps.scan(instance_id__beginswith=JBoxDB.qual(cluster, ''),
-                                             publish_time__lt=valid_time):
-            stale.append(record.get('instance_id').split('.', 1)[1])
-        return stale
+        return {
+            'instance_id__beginswith': JBoxDB.qual(cluster, ''),
+            'publish_time__lt': valid_time
+        }
+
+    @staticmethod
+    def get_stale_instances(cluster):
+        return [record.get('instance_id').split('.', 1)[1]
+                for record in JBoxInstanceProps.scan(attributes=('instance_id',),
+                                                     **JBoxInstanceProps._stale_criteria(cluster))]
 
     @staticmethod
     def get_instance_status(cluster):
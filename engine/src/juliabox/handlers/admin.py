@@ -3,16 +3,21 @@ from datetime import datetime, timedelta
 import isodate
 import re
 
+import tornado.web
+import tornado.gen
+
 from juliabox.cloud import Compute
 from juliabox.jbox_util import JBoxCfg
 from handler_base import JBoxHandler
-from juliabox.interactive import SessContainer
+from juliabox.interactive import SessContainer, SessDeadlines
 from juliabox.jbox_tasks import JBoxAsyncJob
-from juliabox.db import JBoxUserV2, JBoxDynConfig, JBPluginDB, JBoxSessionProps, JBoxInstanceProps
+from juliabox.db import JBoxUserV2, JBoxDynConfig, JBPluginDB
 from juliabox.api import APIContainer
 
 
 class AdminHandler(JBoxHandler):
+    @tornado.web.asynchronous
+    @tornado.gen.coroutine
     def get(self):
         sessname = self.get_session_id()
         user_id = self.get_user_id()
@@ -36,7 +41,8 @@ class AdminHandler(JBoxHandler):
             return
         if self.handle_if_show_cfg(is_admin):
             return
-        if self.handle_if_instance_info(is_admin):
+        handled = yield self.handle_if_instance_info(is_admin)
+        if handled:
             return
         if self.handle_if_open_port(sessname, user_id):
             return
@@ -44,14 +50,15 @@ class AdminHandler(JBoxHandler):
         juliaboxver, _upgrade_available = self.get_upgrade_available(cont)
 
         expire = JBoxCfg.get('interactive.expire')
+        started = SessDeadlines.session_start_time(cont.get_name(), cont.time_started())
         d = dict(
             manage_containers=manage_containers,
             show_report=show_report,
             sessname=sessname,
             user_id=user_id,
             created=isodate.datetime_isoformat(cont.time_created()),
-            started=isodate.datetime_isoformat(cont.time_started()),
-            allowed_till=isodate.datetime_isoformat((cont.time_started() + timedelta(seconds=expire))),
+            started=isodate.datetime_isoformat(started),
+            allowed_till=isodate.datetime_isoformat((started + timedelta(seconds=expire))),
             mem=cont.get_memory_allocated(),
             cpu=cont.get_cpu_allocated(),
             disk=cont.get_disk_allocated(),
@@ -108,10 +115,11 @@ class AdminHandler(JBoxHandler):
             return True
         return False
 
+    @tornado.gen.coroutine
     def handle_if_instance_info(self, is_allowed):
         stats = self.get_argument('instance_info', None)
         if stats is None:
-            return False
+            raise tornado.gen.Return(False)
 
         if not is_allowed:
             AdminHandler.log_error("Show instance info not allowed for user")
@@ -130,9 +138,23 @@ class AdminHandler(JBoxHandler):
                         for n, v in machine_loads.iteritems():
                             result['Instance ' + n] = v
                 elif stats == 'sessions':
-                    result = JBoxSessionProps.get_active_sessions(Compute.get_install_id())
+                    result, failed = yield JBoxAsyncJob.rpc_cluster_session_status()
+                    if len(failed) > 0:
+                        result['Not responding'] = failed
                 elif stats == 'apis':
-                    result = JBoxInstanceProps.get_instance_status(Compute.get_install_id())
+                    result, failed = yield JBoxAsyncJob.rpc_cluster_api_status()
+                    if len(failed) > 0:
+                        result['Not responding'] = failed
+                elif stats == 'launch':
+                    resp = yield JBoxAsyncJob.rpc_launch_stats()
+                    if resp['code'] != 0:
+                        raise Exception("error getting launch stats: %r" % (resp,))
+                    result = resp['data']
+                elif stats == 'workers':
+                    resp = yield JBoxAsyncJob.rpc_worker_stats()
+                    if resp['code'] != 0:
+                        raise Exception("error getting worker stats: %r" % (resp,))
+                    result = resp['data']
                 else:
                     raise Exception("unknown command %s" % (stats,))
 
@@ -143,7 +165,7 @@ class AdminHandler(JBoxHandler):
                 response = {'code': -1, 'data': 'error getting stats'}
 
         self.write(response)
-        return True
+        raise tornado.gen.Return(True)
 
     @staticmethod
     def get_session_stats():
@@ -10,7 +10,7 @@ import tornado.escape
 from tornado.web import RequestHandler
 
 from juliabox.jbox_util import LoggerMixin, unique_sessname, unquote, JBoxCfg, JBoxPluginType
-from juliabox.interactive import SessContainer
+from juliabox.interactive import SessContainer, LaunchProgress
 from juliabox.jbox_tasks import JBoxAsyncJob
 from juliabox.jbox_crypto import signstr
 from juliabox.cloud import Compute
@@ -348,6 +348,7 @@ class JBoxHandler(JBoxCookies):
             self_load = Compute.get_instance_stats(Compute.get_instance_id(), 'Load')
             if self_load < 100:
                 SessContainer.invalidate_container(sessname)
+                LaunchProgress.update(sessname, LaunchProgress.STAGE_QUEUED)
                 JBoxAsyncJob.async_launch_by_name(sessname, user_id, True)
                 return True
 
@@ -359,6 +360,7 @@ class JBoxHandler(JBoxCookies):
             return False
 
         SessContainer.invalidate_container(sessname)
+        LaunchProgress.update(sessname, LaunchProgress.STAGE_QUEUED)
         JBoxAsyncJob.async_launch_by_name(sessname, user_id, True)
         return True
 
@@ -1,11 +1,14 @@
 import json
+import time
 import httplib2
 
+import tornado.web
+import tornado.gen
 from oauth2client.client import OAuth2Credentials
 
 from handler_base import JBoxHandler, JBPluginHandler
 from juliabox.jbox_util import unique_sessname, JBoxCfg
-from juliabox.interactive import SessContainer
+from juliabox.interactive import SessContainer, LaunchProgress
 from juliabox.cloud import Compute
 
 
@@ -14,6 +17,14 @@ class MainHandler(JBoxHandler):
                              "Please try again in a few hours. " + \
                              "We will also send you an email as things quieten down and your account is enabled."
 
+    # Loading is abandoned after these many steps, each of which is LOADING_STEP_SECS long
+    MAX_LOADING_STEPS = 90
+    LOADING_STEP_SECS = 2
+    # Seconds an AJAX request waits for launch progress before responding
+    LOADING_WAIT_SECS = 20
+
+    @tornado.web.asynchronous
+    @tornado.gen.coroutine
     def get(self):
         user_id = self.get_user_id()
 
@@ -30,7 +41,7 @@ class MainHandler(JBoxHandler):
             if self.is_loading():
                 is_ajax = self.get_argument('monitor_loading', None) is not None
                 if is_ajax:
-                    self.do_monitor_loading_ajax(user_id)
+                    yield self.do_monitor_loading_ajax(user_id)
                 else:
                     self.do_monitor_loading(user_id)
             else:
@@ -39,22 +50,43 @@ class MainHandler(JBoxHandler):
     def is_loading(self):
         return self.get_loading_state() is not None
 
+    @tornado.gen.coroutine
     def do_monitor_loading_ajax(self, user_id):
         sessname = unique_sessname(user_id)
-        self.log_debug("AJAX monitoring loading of session [%s] user[%s]...", sessname, user_id)
-        cont = SessContainer.get_by_name(sessname)
-        if (cont is None) or (not cont.is_running()):
-            loading_step = int(self.get_loading_state(), 0)
-            if loading_step > 90:
-                self.log_error("Could not start instance. Session [%s] for user [%s] didn't load.", sessname, user_id)
-                self.write({'code': -1})
-                return
-
-            loading_step += 1
-            self.set_loading_state(loading_step)
-            self.write({'code': 0})
+        known_stage = self.get_argument('stage', None) or None
+        self.log_debug("AJAX monitoring loading of session [%s] user[%s] from stage [%s]...",
+                       sessname, user_id, known_stage)
+        tstart = time.time()
+        if LaunchProgress.get(sessname) is None:
+            # nothing heard of this launch yet, check back soon
+            wait_secs = MainHandler.LOADING_STEP_SECS
         else:
+            wait_secs = MainHandler.LOADING_WAIT_SECS
+        stage = yield LaunchProgress.wait(sessname, known_stage, timeout=wait_secs)
+
+        if stage is None:
+            # no progress known for this launch (e.g. session manager restarted). check the container instead.
+            cont = SessContainer.get_by_name(sessname)
+            if (cont is not None) and cont.is_running():
+                stage = LaunchProgress.STAGE_READY
+
+        if stage == LaunchProgress.STAGE_READY:
             self.write({'code': 1})
+            return
+        if stage == LaunchProgress.STAGE_FAILED:
+            self.log_error("Could not start instance. Session [%s] for user [%s] failed to launch.", sessname, user_id)
+            self.write({'code': -1})
+            return
+
+        loading_step = int(self.get_loading_state(), 0)
+        if loading_step > MainHandler.MAX_LOADING_STEPS:
+            self.log_error("Could not start instance. Session [%s] for user [%s] didn't load.", sessname, user_id)
+            self.write({'code': -1})
+            return
+
+        loading_step += max(1, int((time.time() - tstart) / MainHandler.LOADING_STEP_SECS))
+        self.set_loading_state(loading_step)
+        self.write({'code': 0, 'stage': stage})
 
     def do_monitor_loading(self, user_id):
         sessname = unique_sessname(user_id)
@@ -62,7 +94,7 @@ class MainHandler(JBoxHandler):
         cont = SessContainer.get_by_name(sessname)
         if (cont is None) or (not cont.is_running()):
             loading_step = int(self.get_loading_state(), 0)
-            if loading_step > 90:
+            if loading_step > MainHandler.MAX_LOADING_STEPS:
                 self.log_error("Could not start instance. Session [%s] for user [%s] didn't load.", sessname, user_id)
                 self.clear_container()
                 self.rendertpl("index.tpl", cfg=JBoxCfg.nv,
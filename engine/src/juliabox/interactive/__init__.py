@@ -1,2 +1,4 @@
 __author__ = 'tan'
-from sess_container import SessContainer
\ No newline at end of file
+from sess_container import SessContainer
+from launch_progress import LaunchProgress
+from sess_deadlines import SessDeadlines
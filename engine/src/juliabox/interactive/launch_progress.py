@@ -0,0 +1,98 @@
+__author__ = 'tan'
+import time
+import datetime
+
+import tornado.gen
+from tornado.concurrent import Future
+from zmq.eventloop import zmqstream
+
+from juliabox.jbox_util import LoggerMixin
+from juliabox.jbox_tasks import JBoxAsyncJob
+
+
+class LaunchProgress(LoggerMixin):
+    """ Progress of session launches on this instance.
+
+    The container manager publishes the stage each launch reaches (`JBoxAsyncJob.publish_progress`).
+    The session manager follows them here, so that requests waiting on a launch can be answered as soon as
+    the launch moves ahead, instead of repeatedly checking container state.
+    """
+    STAGE_QUEUED = 'queued'
+    STAGE_RESTORED = 'restored'
+    STAGE_CREATED = 'created'
+    STAGE_STARTED = 'started'
+    STAGE_READY = 'ready'
+    STAGE_FAILED = 'failed'
+    FINAL_STAGES = (STAGE_READY, STAGE_FAILED)
+
+    # forget about launches not heard of for this long
+    EXPIRE_SECS = 10 * 60
+
+    STATUS = {}
+    WAITERS = {}
+    STREAM = None
+
+    @staticmethod
+    def follow():
+        """ Start following launch progress published by the container manager. Call once, from the session manager. """
+        if LaunchProgress.STREAM is not None:
+            return
+        sock = JBoxAsyncJob.get().subscribe_progress()
+        LaunchProgress.STREAM = zmqstream.ZMQStream(sock)
+        LaunchProgress.STREAM.on_recv(LaunchProgress._on_recv)
+
+    @staticmethod
+    def _on_recv(msg):
+        try:
+            progress = JBoxAsyncJob.extract_progress(msg[0])
+        except:
+            LaunchProgress.log_exception("Invalid launch progress message")
+            return
+        if progress is not None:
+            LaunchProgress.update(*progress)
+
+    @staticmethod
+    def update(sessname, stage):
+        LaunchProgress.log_debug("launch of %s at stage %s", sessname, stage)
+        LaunchProgress.STATUS[sessname] = (stage, time.time())
+        for waiter in LaunchProgress.WAITERS.pop(sessname, []):
+            if not waiter.done():
+                waiter.set_result(stage)
+
+    @staticmethod
+    def get(sessname):
+        status = LaunchProgress.STATUS.get(sessname)
+        if (status is None) or ((time.time() - status[1]) > LaunchProgress.EXPIRE_SECS):
+            return None
+        return status[0]
+
+    @staticmethod
+    @tornado.gen.coroutine
+    def wait(sessname, known_stage=None, timeout=20):
+        """ Wait till the launch of `sessname` moves on from `known_stage`, for at most `timeout` seconds.
+        Returns the current stage, or None if nothing is known about the launch.
+        """
+        stage = LaunchProgress.get(sessname)
+        if (stage != known_stage) or (stage in LaunchProgress.FINAL_STAGES):
+            raise tornado.gen.Return(stage)
+
+        waiter = Future()
+        LaunchProgress.WAITERS.setdefault(sessname, []).append(waiter)
+        try:
+            yield tornado.gen.with_timeout(datetime.timedelta(seconds=timeout), waiter)
+        except tornado.gen.TimeoutError:
+            pass
+        finally:
+            waiters = LaunchProgress.WAITERS.get(sessname, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+                if len(waiters) == 0:
+                    del LaunchProgress.WAITERS[sessname]
+        raise tornado.gen.Return(LaunchProgress.get(sessname))
+
+    @staticmethod
+    def purge():
+        tnow = time.time()
+        for sessname, status in LaunchProgress.STATUS.items():
+            if (tnow - status[1]) > LaunchProgress.EXPIRE_SECS:
+                del LaunchProgress.STATUS[sessname]
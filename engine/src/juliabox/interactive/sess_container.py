@@ -3,12 +3,16 @@ import pytz
 
 from juliabox.cloud import Compute
 from juliabox.jbox_tasks import JBoxAsyncJob
-from juliabox.jbox_util import JBoxCfg
-from juliabox.jbox_container import BaseContainer
+from juliabox.jbox_util import JBoxCfg, LatencyStats
+from juliabox.jbox_container import BaseContainer, ContainerInventory
 from juliabox.vol import VolMgr, JBoxVol
+from launch_progress import LaunchProgress
+from sess_deadlines import SessDeadlines
 import docker.utils
 from docker.utils import Ulimit
+import threading
 import time
+import uuid
 
 
 class SessContainer(BaseContainer):
@@ -25,7 +29,11 @@ class SessContainer(BaseContainer):
     PORTS = PORTS_INTERNAL + PORTS_USER
     VOLUMES = ['/home/juser', JBoxVol.CONFIG_MOUNT_POINT, JBoxVol.PKG_MOUNT_POINT]
     MAX_CONTAINERS = 0
-    VALID_CONTAINERS = {}
+    # Number of pre-created containers to keep ready on this instance (0 disables the pool), and the load percent
+    # beyond which the pool is drained to make room for sessions.
+    POOL_SIZE = 0
+    POOL_MAX_LOAD = 80
+    POOL_LOCK = threading.Lock()
     INITIAL_DISK_USED_PCT = None
     LAST_CPU_PCT = None
 
@@ -48,7 +56,7 @@ class SessContainer(BaseContainer):
 
     @staticmethod
     def configure():
-        BaseContainer.DCKR = JBoxCfg.dckr
+        BaseContainer.configure()
         SessContainer.DCKR_IMAGE = JBoxCfg.get('interactive.docker_image')
         SessContainer.MEM_LIMIT = JBoxCfg.get('interactive.mem_limit')
 
@@ -59,13 +67,22 @@ class SessContainer(BaseContainer):
 
         SessContainer.CPU_LIMIT = JBoxCfg.get('interactive.cpu_limit')
         SessContainer.MAX_CONTAINERS = JBoxCfg.get('interactive.numlocalmax')
+        SessContainer.POOL_SIZE = JBoxCfg.get('interactive.pool_size', 0)
+        SessContainer.POOL_MAX_LOAD = JBoxCfg.get('interactive.pool_max_load', 80)
 
     @staticmethod
     def _create_new(name, email):
         home_disk = VolMgr.get_disk_for_user(email)
+        SessContainer.publish_progress(name, LaunchProgress.STAGE_RESTORED)
         cfg_disk = VolMgr.get_cfg_mount_for_user(email)
         pkgs_disk = VolMgr.get_pkg_mount_for_user(email)
+        with LatencyStats.timed('launch.create'):
+            cont = SessContainer._create_container(name, home_disk, cfg_disk, pkgs_disk)
+        SessContainer.publish_progress(name, LaunchProgress.STAGE_CREATED)
+        return cont
 
+    @staticmethod
+    def _create_container(name, home_disk, cfg_disk, pkgs_disk):
         vols = {
             home_disk.disk_path: {
                 'bind': SessContainer.VOLUMES[0],
@@ -95,18 +112,94 @@ class SessContainer(BaseContainer):
                                                           hostname='juliabox',
                                                           name=name)
         dockid = jsonobj["Id"]
+        ContainerInventory.update(dockid)
         cont = SessContainer(dockid)
         SessContainer.log_info("Created %s with hostcfg %r, cpu_limit: %r, volumes: %r", cont.debug_str(), hostcfg,
                                SessContainer.CPU_LIMIT, vols)
         return cont
 
+    @staticmethod
+    def create_pool_container():
+        """ Create and start a container with blank disks, to be claimed by a user later.
+        Returns None if blank disks can not be had (no free disks, or not supported by the volume plugins).
+        """
+        name = uuid.uuid4().hex + SessContainer.SFX_POOL
+        disks = VolMgr.get_blank_disks(name)
+        if disks is None:
+            return None
+        cont = SessContainer._create_container(name, *disks)
+        try:
+            cont.start()
+        except:
+            cont.delete()
+            raise
+        return cont
+
+    @staticmethod
+    def shrink_pool(size):
+        """ Delete pre-created containers beyond `size`, and any that are not running or have been in the pool for
+        more than half of the max session lifetime.
+        """
+        # the claim time of a session is not known to a session manager started after the claim, which then counts
+        # the session's lifetime from when the container started
+        expire = JBoxCfg.get('interactive.expire', 0)
+        tnow = datetime.datetime.now(pytz.utc)
+        with SessContainer.POOL_LOCK:
+            running = []
+            for cdesc in SessContainer.pool_containers(allcontainers=True):
+                cont = SessContainer(cdesc['Id'])
+                if not cont.is_running():
+                    SessContainer.log_warn("Pooled container not running %s. Deleting.", cont.debug_str())
+                    cont.delete()
+                elif (expire > 0) and ((tnow - cont.time_started()).total_seconds() > expire / 2):
+                    SessContainer.log_info("Pooled container too old %s. Deleting.", cont.debug_str())
+                    cont.delete()
+                else:
+                    running.append(cont)
+            for cont in running[size:]:
+                cont.delete()
+            return min(size, len(running))
+
+    @staticmethod
+    def _claim_from_pool(name, email):
+        with SessContainer.POOL_LOCK:
+            pooled = SessContainer.pool_containers(allcontainers=False)
+            if len(pooled) == 0:
+                return None
+            dockid = pooled[0]['Id']
+            with LatencyStats.timed('launch.pool_claim'):
+                BaseContainer.DCKR.rename(dockid, name)
+                ContainerInventory.update(dockid)
+
+        cont = SessContainer(dockid)
+        SessDeadlines.record_claim(cont.get_name())
+        SessContainer.log_info("Claimed pooled container for %s", cont.debug_str())
+        try:
+            VolMgr.assign_disk_to_user(dockid, email)
+        except:
+            SessContainer.log_exception("Failure restoring disk into pooled container %s", cont.debug_str())
+            cont.delete()
+            return None
+        SessContainer.publish_progress(name, LaunchProgress.STAGE_RESTORED)
+        cont.on_start()
+        return cont
+
+    def is_pooled(self):
+        cname = self.get_name()
+        return (cname is not None) and cname.endswith(SessContainer.SFX_POOL)
+
+    @staticmethod
+    def publish_progress(name, stage):
+        queue = JBoxAsyncJob.get()
+        if queue is not None:
+            queue.publish_progress(name, stage)
+
     @staticmethod
     def invalidate_container(cname):
         if not cname.startswith("/"):
             cname = "/" + cname
-        if SessContainer.VALID_CONTAINERS.has_key(cname):
-            SessContainer.log_info("Invalidating container %s", cname)
-            del SessContainer.VALID_CONTAINERS[cname]
+        SessContainer.log_info("Invalidating container %s", cname)
+        ContainerInventory.invalidate_name(cname)
 
     @staticmethod
     def launch_by_name(name, email, reuse=True):
@@ -118,12 +211,16 @@ class SessContainer(BaseContainer):
             cont.delete()
             cont = None
 
+        if cont is None:
+            cont = SessContainer._claim_from_pool(name, email)
+
         if cont is None:
             cont = SessContainer._create_new(name, email)
 
         try:
             if not (cont.is_running() or cont.is_restarting()):
-                cont.start()
+                with LatencyStats.timed('launch.start'):
+                    cont.start()
             #else:
             #    cont.restart()
         except:
@@ -133,6 +230,7 @@ class SessContainer(BaseContainer):
             cont.delete()
             raise
 
+        SessContainer.publish_progress(name, LaunchProgress.STAGE_STARTED)
         spent = time.time() - tstart
         SessContainer.log_info("Success launching container %s, time spent %f s",
                                name, spent)
@@ -170,9 +268,12 @@ class SessContainer(BaseContainer):
                 SessContainer.log_info("Discovered new container %s", cont.debug_str())
                 SessContainer.record_ping(cname)
 
-            start_time = cont.time_started()
+            start_time = SessDeadlines.session_start_time(cname, cont.time_started())
             # check that start time is not absurdly small (indicates a continer that's starting up)
             start_time_not_zero = (tnow-start_time).total_seconds() < (365*24*60*60)
+            if c_is_active and start_time_not_zero:
+                # deadlines are normally tracked from start events and pings. this catches any that were missed.
+                SessDeadlines.track(cname, start_time, SessContainer._get_last_ping(cname))
             if (start_time < stop_before) and start_time_not_zero:
                 # don't allow running beyond the limit for long running sessions
                 # SessContainer.log_info("time_started " + str(cont.time_started()) +
@@ -199,33 +300,20 @@ class SessContainer(BaseContainer):
             if cname not in all_cnames:
                 del SessContainer.PINGS[cname]
 
-        SessContainer.VALID_CONTAINERS = all_cnames
+        # pooled containers hold disks too
+        container_id_list.extend([cdesc['Id'] for cdesc in SessContainer.pool_containers(allcontainers=True)])
+
         VolMgr.refresh_disk_use_status(container_id_list=container_id_list)
         SessContainer.log_info("Finished container maintenance.")
 
     @staticmethod
     def is_valid_container(cname, hostports):
-        cont = None
-        if cname in SessContainer.VALID_CONTAINERS:
-            try:
-                cont = SessContainer(SessContainer.VALID_CONTAINERS[cname])
-            except:
-                pass
-        else:
-            all_containers = SessContainer.session_containers(allcontainers=True)
-            for cdesc in all_containers:
-                cid = cdesc['Id']
-                cont = SessContainer(cid)
-                cont_name = cont.get_name()
-                SessContainer.VALID_CONTAINERS[cont_name] = cid
-                if cname == cont_name:
-                    break
-
-        if cont is None:
+        cid = ContainerInventory.get_id_by_name(cname)
+        if cid is None:
             return False
 
         try:
-            return hostports == cont.get_host_ports()
+            return hostports == SessContainer(cid).get_host_ports()
         except:
             return False
 
@@ -257,31 +345,33 @@ class SessContainer(BaseContainer):
 
     @staticmethod
     def get_by_name(name):
-        if not name.startswith("/"):
-            nname = "/" + unicode(name)
-        else:
-            nname = unicode(name)
-
-        for c in SessContainer.session_containers(allcontainers=True):
-            if ('Names' in c) and (c['Names'] is not None) and (c['Names'][0] == nname):
-                return SessContainer(c['Id'])
-        return None
+        if name.endswith(BaseContainer.SFX_SVC) or name.endswith(BaseContainer.SFX_API) or \
+                name.endswith(BaseContainer.SFX_POOL):
+            return None
+        cid = ContainerInventory.get_id_by_name(name)
+        return SessContainer(cid) if cid is not None else None
 
     @staticmethod
     def record_ping(name):
         SessContainer.PINGS[name] = datetime.datetime.now(pytz.utc)
+        SessDeadlines.record_ping(name)
         # log_info("Recorded ping for %s", name)
 
     @staticmethod
     def _get_last_ping(name):
         return SessContainer.PINGS[name] if (name in SessContainer.PINGS) else None
 
+    def time_session_started(self):
+        # a container claimed from the pool was created before the session
+        return SessDeadlines.session_start_time(self.get_name(), self.time_created())
+
     def on_stop(self):
-        self.record_usage()
+        if not self.is_pooled():
+            self.record_usage()
 
     def on_start(self):
         cname = self.get_name()
-        if cname is not None:
+        if (cname is not None) and not self.is_pooled():
             SessContainer.record_ping(cname)
 
     def on_restart(self):
@@ -297,3 +387,4 @@ class SessContainer(BaseContainer):
                 disk.release(backup=backup)
         if cname is not None:
             SessContainer.PINGS.pop(cname, None)
+            SessDeadlines.forget(cname)
@@ -0,0 +1,194 @@
+__author__ = 'tan'
+import time
+import heapq
+import calendar
+import datetime
+import pytz
+
+from juliabox.jbox_util import LoggerMixin, JBoxCfg
+from juliabox.jbox_tasks import JBoxAsyncJob
+from juliabox.jbox_container import BaseContainer, ContainerInventory
+
+
+class SessDeadlines(LoggerMixin):
+    """ Cleanup deadlines of session containers on this instance.
+
+    Each session has a max lifetime deadline (from the time it started) and an inactivity deadline
+    (from the last ping). Deadlines are updated from pings and from container start events, and are kept
+    in a heap with at most one entry per session and deadline type. An entry is not moved when its deadline moves
+    later; when it falls due it is checked against the current deadline and pushed back if required.
+    A single ioloop timeout is armed for the earliest entry, so that cleanups are scheduled close to their deadline.
+
+    A session in a container claimed from the pool starts when the container is renamed for it, not when the
+    container started. Claims seen since this process started are remembered, see `record_claim` and
+    `session_start_time`. The container manager records the claims it makes, for usage accounting.
+
+    `SessContainer.maintain` still scans all containers, but only as a safety net.
+    """
+    EXPIRE = 'expire'
+    INACTIVE = 'inactive'
+
+    MAX_TIMEOUT = 0
+    INACTIVE_TIMEOUT = 0
+
+    IOLOOP = None
+    TIMER = None
+    TIMER_AT = None
+
+    # (deadline, cname, type) entries
+    HEAP = []
+    # (cname, type) -> deadline of the entry in heap
+    QUEUED = {}
+    # cname -> {type: current deadline}
+    DEADLINES = {}
+    # cname -> time the container was claimed from the pool for the session
+    CLAIMED = {}
+
+    START_ACTIONS = ('start', 'restart', 'rename')
+    STOP_ACTIONS = ('die', 'stop', 'kill', 'destroy')
+
+    @staticmethod
+    def configure(ioloop):
+        """ Start tracking deadlines. Call once, from the session manager, with the ioloop to schedule cleanups on. """
+        SessDeadlines.MAX_TIMEOUT = JBoxCfg.get('interactive.expire', 0)
+        SessDeadlines.INACTIVE_TIMEOUT = JBoxCfg.get('interactive.inactivity_timeout', 0)
+        SessDeadlines.IOLOOP = ioloop
+        ContainerInventory.add_listener(SessDeadlines._on_container_event)
+
+    @staticmethod
+    def _on_container_event(cid, action, name):
+        # called from the inventory thread. hand over to the ioloop.
+        if (name is None) or (ContainerInventory._type_of(name) != BaseContainer.SFX_INT):
+            return
+        if action in SessDeadlines.START_ACTIONS:
+            # pooled containers are renamed only when claimed
+            claimed_at = time.time() if (action == 'rename') else None
+            SessDeadlines.IOLOOP.add_callback(SessDeadlines._on_start, cid, name, claimed_at)
+        elif action in SessDeadlines.STOP_ACTIONS:
+            SessDeadlines.IOLOOP.add_callback(SessDeadlines.forget, name)
+
+    @staticmethod
+    def _on_start(cid, name, claimed_at=None):
+        if claimed_at is not None:
+            SessDeadlines.record_claim(name, claimed_at)
+        try:
+            cont = BaseContainer(cid)
+            if not (cont.is_running() or cont.is_restarting()):
+                return
+            start_time = SessDeadlines.session_start_time(name, cont.time_started())
+        except:
+            SessDeadlines.log_exception("Exception reading start time of %s", name)
+            return
+        SessDeadlines.track(name, start_time)
+
+    @staticmethod
+    def record_claim(cname, claimed_at=None):
+        """ Remember that container `cname` was claimed from the pool for a session at `claimed_at` (epoch seconds,
+        now if None).
+        """
+        SessDeadlines.CLAIMED[cname] = time.time() if (claimed_at is None) else claimed_at
+
+    @staticmethod
+    def session_start_time(cname, container_start_time):
+        """ Time session `cname` started: when its container was claimed from the pool, if later than when the
+        container started.
+        """
+        claimed_at = SessDeadlines.CLAIMED.get(cname)
+        if claimed_at is None:
+            return container_start_time
+        return max(container_start_time, datetime.datetime.fromtimestamp(claimed_at, pytz.utc))
+
+    @staticmethod
+    def track(cname, start_time, last_ping=None):
+        """ Set deadlines of session `cname`, started at `start_time`, last pinged at `last_ping` (datetimes).
+        The inactivity deadline runs from now if there has been no ping yet.
+        """
+        if SessDeadlines.IOLOOP is None:
+            return
+        start_ts = calendar.timegm(start_time.utctimetuple())
+        if SessDeadlines.MAX_TIMEOUT > 0:
+            SessDeadlines._set(cname, SessDeadlines.EXPIRE, start_ts + SessDeadlines.MAX_TIMEOUT)
+        if (SessDeadlines.INACTIVE_TIMEOUT > 0) and (SessDeadlines.INACTIVE not in SessDeadlines.DEADLINES.get(cname, {})):
+            ping_ts = calendar.timegm(last_ping.utctimetuple()) if (last_ping is not None) else time.time()
+            SessDeadlines._set(cname, SessDeadlines.INACTIVE, ping_ts + SessDeadlines.INACTIVE_TIMEOUT)
+
+    @staticmethod
+    def record_ping(cname):
+        if (SessDeadlines.IOLOOP is None) or (SessDeadlines.INACTIVE_TIMEOUT <= 0):
+            return
+        SessDeadlines._set(cname, SessDeadlines.INACTIVE, time.time() + SessDeadlines.INACTIVE_TIMEOUT)
+
+    @staticmethod
+    def forget(cname):
+        # heap entries of forgotten sessions are dropped when they fall due
+        SessDeadlines.DEADLINES.pop(cname, None)
+        SessDeadlines.CLAIMED.pop(cname, None)
+
+    @staticmethod
+    def _set(cname, typ, deadline):
+        SessDeadlines.DEADLINES.setdefault(cname, {})[typ] = deadline
+        key = (cname, typ)
+        queued = SessDeadlines.QUEUED.get(key)
+        if (queued is None) or (deadline < queued):
+            SessDeadlines._push(deadline, cname, typ)
+
+    @staticmethod
+    def _push(deadline, cname, typ, arm=True):
+        SessDeadlines.QUEUED[(cname, typ)] = deadline
+        heapq.heappush(SessDeadlines.HEAP, (deadline, cname, typ))
+        if arm:
+            SessDeadlines._arm()
+
+    @staticmethod
+    def _arm():
+        if len(SessDeadlines.HEAP) == 0:
+            return
+        at = SessDeadlines.HEAP[0][0]
+        if (SessDeadlines.TIMER_AT is not None) and (SessDeadlines.TIMER_AT <= at):
+            return
+        if SessDeadlines.TIMER is not None:
+            SessDeadlines.IOLOOP.remove_timeout(SessDeadlines.TIMER)
+        SessDeadlines.TIMER_AT = at
+        SessDeadlines.TIMER = SessDeadlines.IOLOOP.add_timeout(at, SessDeadlines._on_timer)
+
+    @staticmethod
+    def _on_timer():
+        SessDeadlines.TIMER = None
+        SessDeadlines.TIMER_AT = None
+        tnow = time.time()
+        while (len(SessDeadlines.HEAP) > 0) and (SessDeadlines.HEAP[0][0] <= tnow):
+            deadline, cname, typ = heapq.heappop(SessDeadlines.HEAP)
+            key = (cname, typ)
+            if SessDeadlines.QUEUED.get(key) != deadline:
+                # superseded by an earlier entry
+                continue
+            del SessDeadlines.QUEUED[key]
+
+            current = SessDeadlines.DEADLINES.get(cname, {}).get(typ)
+            if current is None:
+                continue
+            if current > tnow:
+                SessDeadlines._push(current, cname, typ, arm=False)
+            else:
+                SessDeadlines._cleanup(cname, typ)
+        SessDeadlines._arm()
+
+    @staticmethod
+    def _cleanup(cname, typ):
+        SessDeadlines.forget(cname)
+        cid = ContainerInventory.get_id_by_name(cname)
+        if cid is None:
+            return
+        cont = BaseContainer(cid)
+        try:
+            if not (cont.is_running() or cont.is_restarting()):
+                return
+        except:
+            SessDeadlines.log_exception("Exception checking state of %s", cname)
+            return
+        if typ == SessDeadlines.EXPIRE:
+            SessDeadlines.log_warn("Running beyond allowed time %s. Scheduling cleanup.", cont.debug_str())
+        else:
+            SessDeadlines.log_warn("Inactive beyond allowed time %s. Scheduling cleanup.", cont.debug_str())
+        ContainerInventory.invalidate_name(cname)
+        JBoxAsyncJob.async_backup_and_cleanup(cid)
@@ -1,11 +1,350 @@
 __author__ = 'tan'
 import multiprocessing
+import threading
+import json
+import time
 import psutil
 
-from jbox_util import LoggerMixin, parse_iso_time
+from jbox_util import LoggerMixin, JBoxCfg, parse_iso_time
 from juliabox.db import JBPluginDB
 
 
+class ContainerInventory(LoggerMixin):
+    """ In-memory view of the docker containers on this host.
+
+    Populated by a full listing at startup and kept current from the docker events stream.
+    A full listing is repeated every `RECONCILE_INTERVAL` seconds as a safety net.
+    Containers are indexed by id, name, type suffix, state, host ports and mounts, so that
+    lookups do not need a round trip to the docker daemon.
+
+    If the events stream is not connected, reads fall back to reconciling with docker
+    (at most once a second), which is what every read used to cost before.
+    """
+
+    DCKR = None
+    LOCK = threading.RLock()
+    THREAD = None
+    EVENTS_LIVE = False
+    LAST_RECONCILE = 0
+    RECONCILE_INTERVAL = 60
+    FALLBACK_RECONCILE_INTERVAL = 1
+
+    # id -> entry
+    # an entry has the container listing in 'desc', inspect results in 'props' (None till fetched)
+    # and 'stale' set when props must be fetched again
+    ENTRIES = {}
+    BY_NAME = {}
+    BY_TYPE = {}
+    BY_STATE = {}
+    BY_HOST_PORT = {}
+    BY_MOUNT = {}
+
+    REFRESH_ACTIONS = ('create', 'start', 'restart', 'die', 'stop', 'kill', 'pause', 'unpause', 'rename', 'oom',
+                       'update')
+    REMOVE_ACTIONS = ('destroy',)
+
+    # callables invoked with (container id, action, container name) for each container event, from the events thread
+    LISTENERS = []
+
+    @staticmethod
+    def configure(dckr):
+        ContainerInventory.DCKR = dckr
+        ContainerInventory.RECONCILE_INTERVAL = JBoxCfg.get('container_inventory_reconcile_secs', 60)
+
+    @staticmethod
+    def start():
+        if ContainerInventory.THREAD is not None:
+            return
+        ContainerInventory.THREAD = threading.Thread(target=ContainerInventory._watch_events,
+                                                     name='container_inventory')
+        ContainerInventory.THREAD.daemon = True
+        ContainerInventory.THREAD.start()
+
+    @staticmethod
+    def add_listener(fn):
+        ContainerInventory.LISTENERS.append(fn)
+
+    @staticmethod
+    def _watch_events():
+        since = None
+        while True:
+            try:
+                until = int(time.time()) + ContainerInventory.RECONCILE_INTERVAL
+                if since is None:
+                    since = int(time.time())
+                    ContainerInventory.reconcile()
+                ContainerInventory.EVENTS_LIVE = True
+                for evt in ContainerInventory.DCKR.events(since=since, until=until):
+                    ContainerInventory._on_event(evt)
+                # events stream returns at the end of the window. reconcile as a safety net and start a new window.
+                since = until
+                ContainerInventory.reconcile()
+            except:
+                ContainerInventory.EVENTS_LIVE = False
+                since = None
+                ContainerInventory.log_exception("Exception watching docker events. Will retry after 5 seconds")
+                time.sleep(5)
+
+    @staticmethod
+    def _on_event(evt):
+        if isinstance(evt, basestring):
+            evt = json.loads(evt)
+        if evt.get('Type', 'container') != 'container':
+            return
+        action = evt.get('Action', evt.get('status', ''))
+        cid = evt.get('id', evt.get('Actor', {}).get('ID'))
+        if cid is None:
+            return
+        action = action.split(':')[0]
+        with ContainerInventory.LOCK:
+            entry = ContainerInventory.ENTRIES.get(cid)
+            name = entry['name'] if entry is not None else None
+        if action in ContainerInventory.REMOVE_ACTIONS:
+            ContainerInventory.remove(cid)
+        elif action in ContainerInventory.REFRESH_ACTIONS:
+            ContainerInventory.log_debug("container %s event %s", cid[0:12], action)
+            try:
+                name = ContainerInventory.update(cid)['name']
+            except:
+                # container may have been removed already
+                ContainerInventory.remove(cid)
+        else:
+            return
+        for fn in ContainerInventory.LISTENERS:
+            try:
+                fn(cid, action, name)
+            except:
+                ContainerInventory.log_exception("Exception in container event listener")
+
+    @staticmethod
+    def _name_of(desc):
+        names = desc.get('Names')
+        return names[0] if (names is not None) and (len(names) > 0) else desc['Id'][0:12]
+
+    @staticmethod
+    def _type_of(name):
+        if name.endswith(BaseContainer.SFX_SVC):
+            return BaseContainer.SFX_SVC
+        elif name.endswith(BaseContainer.SFX_API):
+            return BaseContainer.SFX_API
+        elif name.endswith(BaseContainer.SFX_POOL):
+            return BaseContainer.SFX_POOL
+        return BaseContainer.SFX_INT
+
+    @staticmethod
+    def _state_of(entry):
+        props = entry['props']
+        if props is not None:
+            state = props['State']
+            if state.get('Restarting', False):
+                return 'restarting'
+            if state.get('Paused', False):
+                return 'paused'
+            return 'running' if state.get('Running', False) else 'exited'
+        return 'running' if entry['desc'].get('Status', '').startswith('Up') else 'exited'
+
+    @staticmethod
+    def _host_ports_of(props):
+        host_ports = {}
+        if props is None:
+            return host_ports
+        ports = props.get('NetworkSettings', {}).get('Ports') or {}
+        for cport, bindings in ports.iteritems():
+            if bindings:
+                host_ports[cport] = bindings[0]['HostPort']
+        return host_ports
+
+    @staticmethod
+    def _mounts_of(props):
+        if props is None:
+            return []
+        return [(m['Destination'], m['Source']) for m in props.get('Mounts') or []]
+
+    @staticmethod
+    def _unindex(cid):
+        entry = ContainerInventory.ENTRIES.pop(cid, None)
+        if entry is None:
+            return None
+        if ContainerInventory.BY_NAME.get(entry['name']) == cid:
+            del ContainerInventory.BY_NAME[entry['name']]
+        ContainerInventory.BY_TYPE.get(entry['typ'], set()).discard(cid)
+        ContainerInventory.BY_STATE.get(entry['state'], set()).discard(cid)
+        for hport in entry['host_ports'].values():
+            if ContainerInventory.BY_HOST_PORT.get(hport) == cid:
+                del ContainerInventory.BY_HOST_PORT[hport]
+        for _cpath, hpath in entry['mounts']:
+            if ContainerInventory.BY_MOUNT.get(hpath) == cid:
+                del ContainerInventory.BY_MOUNT[hpath]
+        return entry
+
+    @staticmethod
+    def _index(desc, props, stale=False):
+        cid = desc['Id']
+        ContainerInventory._unindex(cid)
+        name = ContainerInventory._name_of(desc)
+        if props is not None and props.get('Name'):
+            name = props['Name']
+            desc['Names'] = [name]
+        entry = {
+            'desc': desc,
+            'props': props,
+            'stale': stale,
+            'name': name,
+            'typ': ContainerInventory._type_of(name),
+            'host_ports': ContainerInventory._host_ports_of(props),
+            'mounts': ContainerInventory._mounts_of(props)
+        }
+        entry['state'] = ContainerInventory._state_of(entry)
+
+        ContainerInventory.ENTRIES[cid] = entry
+        ContainerInventory.BY_NAME[name] = cid
+        ContainerInventory.BY_TYPE.setdefault(entry['typ'], set()).add(cid)
+        ContainerInventory.BY_STATE.setdefault(entry['state'], set()).add(cid)
+        for hport in entry['host_ports'].values():
+            ContainerInventory.BY_HOST_PORT[hport] = cid
+        for _cpath, hpath in entry['mounts']:
+            ContainerInventory.BY_MOUNT[hpath] = cid
+        return entry
+
+    @staticmethod
+    def update(cid, listing=True):
+        """ Fetch inspect details of a single container and index them.
+        The container listing is fetched too, unless `listing` is False and the container is already known.
+        """
+        desc = None
+        if not listing:
+            with ContainerInventory.LOCK:
+                entry = ContainerInventory.ENTRIES.get(cid)
+                if entry is not None:
+                    desc = entry['desc']
+        if desc is None:
+            descs = ContainerInventory.DCKR.containers(all=True, filters={'id': cid})
+            if len(descs) > 0:
+                desc = descs[0]
+        props = ContainerInventory.DCKR.inspect_container(cid)
+        if desc is None:
+            desc = {'Id': props['Id'], 'Names': [props['Name']], 'Status': ''}
+        with ContainerInventory.LOCK:
+            return ContainerInventory._index(desc, props)
+
+    @staticmethod
+    def remove(cid):
+        with ContainerInventory.LOCK:
+            if ContainerInventory._unindex(cid) is not None:
+                ContainerInventory.log_debug("removed container %s from inventory", cid[0:12])
+
+    @staticmethod
+    def invalidate(cid):
+        """ Mark inspect details of a container stale. They are fetched afresh on the next read. """
+        with ContainerInventory.LOCK:
+            entry = ContainerInventory.ENTRIES.get(cid)
+            if entry is not None:
+                entry['stale'] = True
+
+    @staticmethod
+    def invalidate_name(name):
+        with ContainerInventory.LOCK:
+            cid = ContainerInventory.BY_NAME.get(name)
+            if cid is not None:
+                ContainerInventory.ENTRIES[cid]['stale'] = True
+
+    @staticmethod
+    def reconcile():
+        """ Reconcile with a full listing from docker.
+        Listing entries are replaced. Inspect details are retained for known containers, unless the events stream
+        is down, in which case they are marked stale and fetched afresh on the next read.
+        """
+        descs = ContainerInventory.DCKR.containers(all=True)
+        with ContainerInventory.LOCK:
+            listed = set()
+            for desc in descs:
+                cid = desc['Id']
+                listed.add(cid)
+                entry = ContainerInventory.ENTRIES.get(cid)
+                if entry is None:
+                    ContainerInventory._index(desc, None, stale=True)
+                else:
+                    stale = entry['stale'] or (not ContainerInventory.EVENTS_LIVE)
+                    ContainerInventory._index(desc, entry['props'], stale=stale)
+            for cid in ContainerInventory.ENTRIES.keys():
+                if cid not in listed:
+                    ContainerInventory._unindex(cid)
+            ContainerInventory.LAST_RECONCILE = time.time()
+        ContainerInventory.log_debug("reconciled inventory of %d containers", len(descs))
+
+    @staticmethod
+    def _ensure_current():
+        if ContainerInventory.EVENTS_LIVE:
+            return
+        if (time.time() - ContainerInventory.LAST_RECONCILE) > ContainerInventory.FALLBACK_RECONCILE_INTERVAL:
+            ContainerInventory.reconcile()
+
+    @staticmethod
+    def get_props(cid):
+        """ Inspect details of a container. Raises the docker exception if the container does not exist. """
+        with ContainerInventory.LOCK:
+            entry = ContainerInventory.ENTRIES.get(cid)
+            if (entry is not None) and (entry['props'] is not None) and not entry['stale']:
+                return entry['props']
+        try:
+            return ContainerInventory.update(cid, listing=False)['props']
+        except:
+            ContainerInventory.remove(cid)
+            raise
+
+    @staticmethod
+    def get_id_by_name(name):
+        if not name.startswith("/"):
+            name = "/" + name
+        ContainerInventory._ensure_current()
+        with ContainerInventory.LOCK:
+            return ContainerInventory.BY_NAME.get(unicode(name))
+
+    @staticmethod
+    def get_id_by_host_port(host_port):
+        ContainerInventory._ensure_current()
+        with ContainerInventory.LOCK:
+            return ContainerInventory.BY_HOST_PORT.get(str(host_port))
+
+    @staticmethod
+    def get_host_ports(cid, ports):
+        cont_ports = ContainerInventory._host_ports_of(ContainerInventory.get_props(cid))
+        return tuple([cont_ports[str(port) + '/tcp'] for port in ports])
+
+    @staticmethod
+    def get_mounts(cid):
+        return ContainerInventory._mounts_of(ContainerInventory.get_props(cid))
+
+    @staticmethod
+    def get_ids_with_mount(path_prefix):
+        ContainerInventory._ensure_current()
+        with ContainerInventory.LOCK:
+            return list(set([cid for (hpath, cid) in ContainerInventory.BY_MOUNT.iteritems()
+                             if hpath.startswith(path_prefix)]))
+
+    @staticmethod
+    def containers(types=None, exclude_types=None, state=None):
+        """ Container listings (as returned by docker list), optionally filtered by type suffix and state. """
+        ContainerInventory._ensure_current()
+        with ContainerInventory.LOCK:
+            if types is None:
+                cids = set(ContainerInventory.ENTRIES.keys())
+            else:
+                cids = set()
+                for typ in types:
+                    cids.update(ContainerInventory.BY_TYPE.get(typ, set()))
+            if exclude_types is not None:
+                for typ in exclude_types:
+                    cids.difference_update(ContainerInventory.BY_TYPE.get(typ, set()))
+            if state is not None:
+                cids.intersection_update(ContainerInventory.BY_STATE.get(state, set()))
+            return [dict(ContainerInventory.ENTRIES[cid]['desc']) for cid in cids]
+
+    @staticmethod
+    def count(types=None, exclude_types=None, state=None):
+        return len(ContainerInventory.containers(types=types, exclude_types=exclude_types, state=state))
+
+
 class BaseContainer(LoggerMixin):
     DCKR = None
     LAST_CPU_PCT = None
@@ -17,6 +356,9 @@ class BaseContainer(LoggerMixin):
     SFX_SVC = CONTAINER_NAME_SEP + 'jboxsvc'
     SFX_API = CONTAINER_NAME_SEP + 'jboxapi'
     SFX_INT = CONTAINER_NAME_SEP + 'jboxint'
+    # Pre-created session containers, not yet bound to any user, are suffixed so that they are kept out of
+    # session listings and counts until they are claimed (renamed) for a session.
+    SFX_POOL = CONTAINER_NAME_SEP + 'jboxpool'
 
     def __init__(self, dockid):
         self.dockid = dockid
@@ -24,24 +366,25 @@ class BaseContainer(LoggerMixin):
         self.dbgstr = None
         self.host_ports = None
 
+    @staticmethod
+    def configure():
+        BaseContainer.DCKR = JBoxCfg.dckr
+        ContainerInventory.configure(BaseContainer.DCKR)
+        ContainerInventory.start()
+
     def refresh(self):
         self.props = None
         self.dbgstr = None
         self.host_ports = None
+        ContainerInventory.invalidate(self.dockid)
 
     def get_props(self):
         if self.props is None:
-            self.props = BaseContainer.DCKR.inspect_container(self.dockid)
+            self.props = ContainerInventory.get_props(self.dockid)
         return self.props
 
     def _get_host_ports(self, ports):
-        props = self.get_props()
-        cont_ports = props['NetworkSettings']['Ports']
-        port_map = []
-        for port in ports:
-            tcp_port = str(port) + '/tcp'
-            port_map.append(cont_ports[tcp_port][0]['HostPort'])
-        return tuple(port_map)
+        return ContainerInventory.get_host_ports(self.dockid, ports)
 
     def get_cpu_allocated(self):
         props = self.get_props()
@@ -81,12 +424,9 @@ class BaseContainer(LoggerMixin):
 
     @staticmethod
     def session_containers(allcontainers=True):
-        sessions = []
-        for c in BaseContainer.DCKR.containers(all=allcontainers):
-            name = c["Names"][0] if (("Names" in c) and (c["Names"] is not None)) else c["Id"][0:12]
-            if not name.endswith(BaseContainer.SFX_SVC) and not name.endswith(BaseContainer.SFX_API):
-                sessions.append(c)
-        return sessions
+        return ContainerInventory.containers(exclude_types=(BaseContainer.SFX_SVC, BaseContainer.SFX_API,
+                                                            BaseContainer.SFX_POOL),
+                                             state=None if allcontainers else 'running')
 
     @staticmethod
     def api_containers(allcontainers=True):
@@ -97,29 +437,18 @@ class BaseContainer(LoggerMixin):
         return BaseContainer._containers_of_type(BaseContainer.SFX_SVC, allcontainers=allcontainers)
 
     @staticmethod
-    def num_active(sfx=None):
-        cnt = 0
-        for c in BaseContainer.DCKR.containers(all=True):
-            name = c["Names"][0] if (("Names" in c) and (c["Names"] is not None)) else c["Id"][0:12]
-            if name.endswith(BaseContainer.SFX_SVC):
-                typ = BaseContainer.SFX_SVC
-            elif name.endswith(BaseContainer.SFX_API):
-                typ = BaseContainer.SFX_API
-            else:
-                typ = BaseContainer.SFX_INT
+    def pool_containers(allcontainers=True):
+        return BaseContainer._containers_of_type(BaseContainer.SFX_POOL, allcontainers=allcontainers)
 
-            if ((sfx is None) and (typ != BaseContainer.SFX_SVC)) or (typ == sfx):
-                cnt += 1
-        return cnt
+    @staticmethod
+    def num_active(sfx=None):
+        if sfx is None:
+            return ContainerInventory.count(exclude_types=(BaseContainer.SFX_SVC, BaseContainer.SFX_POOL))
+        return ContainerInventory.count(types=(sfx,))
 
     @staticmethod
     def _containers_of_type(sfx, allcontainers=True):
-        sessions = []
-        for c in BaseContainer.DCKR.containers(all=allcontainers):
-            name = c["Names"][0] if (("Names" in c) and (c["Names"] is not None)) else c["Id"][0:12]
-            if name.endswith(sfx):
-                sessions.append(c)
-        return sessions
+        return ContainerInventory.containers(types=(sfx,), state=None if allcontainers else 'running')
 
     def is_running(self):
         props = self.get_props()
@@ -143,6 +472,10 @@ class BaseContainer(LoggerMixin):
         props = self.get_props()
         return parse_iso_time(props['Created'])
 
+    def time_session_started(self):
+        """ Time the session in this container started, from which its usage is recorded. """
+        return self.time_created()
+
     def on_stop(self):
         pass
 
@@ -203,9 +536,11 @@ class BaseContainer(LoggerMixin):
             self.kill()
         self.before_delete(cname, backup=backup)
         BaseContainer.DCKR.remove_container(self.dockid)
+        ContainerInventory.remove(self.dockid)
         BaseContainer.log_info("Deleted %s", self.debug_str())
 
     def record_usage(self):
         plugin = JBPluginDB.jbox_get_plugin(JBPluginDB.JBP_USAGE_ACCOUNTING)
         if plugin is not None:
-            plugin.record_session_time(self.get_name(), self.get_image_names(), self.time_created(), self.time_finished())
\ No newline at end of file
+            plugin.record_session_time(self.get_name(), self.get_image_names(), self.time_session_started(),
+                                        self.time_finished())
\ No newline at end of file
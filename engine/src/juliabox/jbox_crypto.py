@@ -46,8 +46,11 @@ def decrypt(ciphertext, secret, lazy=True, checksum=True):
 
 
 def signstr(s, k):
-    h = hmac.new(k, s, hashlib.sha1)
-    return base64.b64encode(h.digest())
+    return base64.b64encode(signbytes(s, k))
+
+
+def signbytes(s, k):
+    return hmac.new(k, s, hashlib.sha1).digest()
 
 
 def ssh_keygen(size=2048):
@@ -0,0 +1,144 @@
+import json
+import time
+import sqlite3
+import threading
+
+from jbox_util import LoggerMixin, JBoxCfg
+
+
+class JBoxCmdJournal(LoggerMixin):
+    """ Durable journal of commands received by the container manager.
+
+    Commands are recorded as they are received and marked done when they finish, so that commands lost to a restart
+    can be replayed. Entries are kept in a SQLite database in WAL mode. Writes are queued and committed in batches
+    by a writer thread, so that a burst of commands costs a few fsyncs and the command loop never waits on disk.
+    Commands received within the last `FLUSH_INTERVAL` seconds before a crash may still be lost.
+    """
+    NAME = 'jboxd_journal'
+    LOCATION = None
+    FLUSH_INTERVAL = 0.1
+    # finished entries are removed after this many seconds
+    PURGE_DONE_SECS = 24 * 60 * 60
+
+    LOCK = threading.Condition()
+    OPS = []
+    # signature -> number of unfinished entries
+    PENDING = {}
+    THREAD = None
+
+    @staticmethod
+    def configure():
+        JBoxCmdJournal.LOCATION = JBoxCfg.get('jboxd_journal')
+        if JBoxCmdJournal.LOCATION is None:
+            JBoxCmdJournal.log_warn("Command journal not configured. Commands lost in a restart will not be replayed.")
+
+    @staticmethod
+    def enabled():
+        return JBoxCmdJournal.LOCATION is not None
+
+    @staticmethod
+    def _connect():
+        conn = sqlite3.connect(JBoxCmdJournal.LOCATION)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+        conn.execute('CREATE TABLE IF NOT EXISTS ' + JBoxCmdJournal.NAME + ' ('
+                     'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'sign TEXT NOT NULL, '
+                     'cmd INTEGER NOT NULL, '
+                     'data TEXT, '
+                     'received REAL NOT NULL, '
+                     'done REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ' + JBoxCmdJournal.NAME + '_pending ON ' + JBoxCmdJournal.NAME +
+                     ' (done, sign)')
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def start():
+        """ Returns unfinished entries as a list of (id, sign, cmd, data, received), oldest first,
+        and starts the writer thread.
+        """
+        if not JBoxCmdJournal.enabled() or (JBoxCmdJournal.THREAD is not None):
+            return []
+
+        conn = JBoxCmdJournal._connect()
+        try:
+            rows = conn.execute('SELECT id, sign, cmd, data, received FROM ' + JBoxCmdJournal.NAME +
+                                ' WHERE done IS NULL ORDER BY id').fetchall()
+        finally:
+            conn.close()
+
+        unfinished = []
+        with JBoxCmdJournal.LOCK:
+            for (entry_id, sign, cmd, data, received) in rows:
+                unfinished.append((entry_id, sign, cmd, json.loads(data), received))
+                JBoxCmdJournal.PENDING[sign] = JBoxCmdJournal.PENDING.get(sign, 0) + 1
+
+        JBoxCmdJournal.THREAD = threading.Thread(target=JBoxCmdJournal._write, name='jboxd_journal')
+        JBoxCmdJournal.THREAD.daemon = True
+        JBoxCmdJournal.THREAD.start()
+        JBoxCmdJournal.log_info("Command journal at %s has %d unfinished entries", JBoxCmdJournal.LOCATION,
+                                len(unfinished))
+        return unfinished
+
+    @staticmethod
+    def _queue(op):
+        JBoxCmdJournal.OPS.append(op)
+        JBoxCmdJournal.LOCK.notify()
+
+    @staticmethod
+    def record(sign, cmd, data):
+        if not JBoxCmdJournal.enabled():
+            return
+        with JBoxCmdJournal.LOCK:
+            JBoxCmdJournal.PENDING[sign] = JBoxCmdJournal.PENDING.get(sign, 0) + 1
+            JBoxCmdJournal._queue(('INSERT INTO ' + JBoxCmdJournal.NAME + ' (sign, cmd, data, received) '
+                                   'VALUES (?, ?, ?, ?)', (sign, cmd, json.dumps(data), time.time())))
+
+    @staticmethod
+    def done(sign):
+        """ Mark all unfinished entries with signature `sign` done. """
+        with JBoxCmdJournal.LOCK:
+            if JBoxCmdJournal.PENDING.pop(sign, None) is None:
+                return
+            JBoxCmdJournal._queue(('UPDATE ' + JBoxCmdJournal.NAME + ' SET done = ? WHERE done IS NULL AND sign = ?',
+                                   (time.time(), sign)))
+
+    @staticmethod
+    def discard(entry_id, sign):
+        """ Mark a single unfinished entry done without running it. """
+        with JBoxCmdJournal.LOCK:
+            npending = JBoxCmdJournal.PENDING.get(sign, 0) - 1
+            if npending > 0:
+                JBoxCmdJournal.PENDING[sign] = npending
+            else:
+                JBoxCmdJournal.PENDING.pop(sign, None)
+            JBoxCmdJournal._queue(('UPDATE ' + JBoxCmdJournal.NAME + ' SET done = ? WHERE id = ?',
+                                   (time.time(), entry_id)))
+
+    @staticmethod
+    def purge():
+        if not JBoxCmdJournal.enabled():
+            return
+        with JBoxCmdJournal.LOCK:
+            JBoxCmdJournal._queue(('DELETE FROM ' + JBoxCmdJournal.NAME + ' WHERE done < ?',
+                                   (time.time() - JBoxCmdJournal.PURGE_DONE_SECS,)))
+
+    @staticmethod
+    def _write():
+        conn = JBoxCmdJournal._connect()
+        while True:
+            with JBoxCmdJournal.LOCK:
+                while len(JBoxCmdJournal.OPS) == 0:
+                    JBoxCmdJournal.LOCK.wait()
+                ops = JBoxCmdJournal.OPS
+                JBoxCmdJournal.OPS = []
+            try:
+                for (stmt, params) in ops:
+                    conn.execute(stmt, params)
+                conn.commit()
+            except:
+                JBoxCmdJournal.log_exception("Exception writing %d entries to command journal", len(ops))
+                conn.rollback()
+            # let more operations gather, to be committed together
+            time.sleep(JBoxCmdJournal.FLUSH_INTERVAL)
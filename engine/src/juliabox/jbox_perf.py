@@ -0,0 +1,123 @@
+import time
+import threading
+import collections
+
+from jbox_util import LoggerMixin, JBoxCfg
+from cloud import Compute
+
+
+class JBoxPerfCounters(LoggerMixin):
+    """ Performance counters of this instance, sampled at a fixed interval by a background thread.
+
+    The sampler function (set with `configure`) returns a list of (name, unit, value) tuples.
+    The last `HISTORY` samples of each counter are kept in a ring buffer, which serves reads without
+    any system calls. The latest samples are published to the cloud in a single batch every `PUBLISH_INTERVAL`
+    seconds by a separate thread, so that a slow publish does not delay sampling.
+
+    Events that change the counters significantly (session launches and cleanups) may ask for an early sample with
+    `request_sample`. Requests are merged into the next sample.
+    """
+    SAMPLE_INTERVAL = 10
+    PUBLISH_INTERVAL = 60
+    HISTORY = 360
+
+    SAMPLER = None
+    LOCK = threading.Lock()
+    SAMPLE_REQUESTED = threading.Event()
+    # name -> deque of (time, value)
+    SERIES = {}
+    UNITS = {}
+    # names in the order they were sampled
+    NAMES = []
+    LAST_PUBLISHED = 0
+    THREADS = []
+
+    @staticmethod
+    def configure(sampler):
+        JBoxPerfCounters.SAMPLER = sampler
+        JBoxPerfCounters.SAMPLE_INTERVAL = JBoxCfg.get('perf_counters.sample_secs', JBoxPerfCounters.SAMPLE_INTERVAL)
+        JBoxPerfCounters.PUBLISH_INTERVAL = JBoxCfg.get('perf_counters.publish_secs',
+                                                        JBoxPerfCounters.PUBLISH_INTERVAL)
+        JBoxPerfCounters.HISTORY = JBoxCfg.get('perf_counters.history', JBoxPerfCounters.HISTORY)
+
+    @staticmethod
+    def start():
+        """ Takes and publishes the first sample, and starts the sampler and publisher threads. """
+        if len(JBoxPerfCounters.THREADS) > 0:
+            return
+        JBoxPerfCounters.sample()
+        JBoxPerfCounters.publish()
+        for (name, target) in (('perf_sampler', JBoxPerfCounters._sample_periodically),
+                               ('perf_publisher', JBoxPerfCounters._publish_periodically)):
+            t = threading.Thread(target=target, name=name)
+            t.daemon = True
+            JBoxPerfCounters.THREADS.append(t)
+            t.start()
+
+    @staticmethod
+    def request_sample():
+        JBoxPerfCounters.SAMPLE_REQUESTED.set()
+
+    @staticmethod
+    def sample():
+        tnow = time.time()
+        stats = JBoxPerfCounters.SAMPLER()
+        with JBoxPerfCounters.LOCK:
+            for (name, unit, value) in stats:
+                series = JBoxPerfCounters.SERIES.get(name)
+                if series is None:
+                    series = JBoxPerfCounters.SERIES[name] = collections.deque(maxlen=JBoxPerfCounters.HISTORY)
+                    JBoxPerfCounters.UNITS[name] = unit
+                    JBoxPerfCounters.NAMES.append(name)
+                series.append((tnow, value))
+
+    @staticmethod
+    def publish():
+        with JBoxPerfCounters.LOCK:
+            stats = [(name, JBoxPerfCounters.UNITS[name], JBoxPerfCounters.SERIES[name][-1][1])
+                     for name in JBoxPerfCounters.NAMES]
+        if len(stats) > 0:
+            Compute.publish_stats_multi(stats)
+        JBoxPerfCounters.LAST_PUBLISHED = time.time()
+
+    @staticmethod
+    def _sample_periodically():
+        while True:
+            JBoxPerfCounters.SAMPLE_REQUESTED.wait(JBoxPerfCounters.SAMPLE_INTERVAL)
+            JBoxPerfCounters.SAMPLE_REQUESTED.clear()
+            try:
+                JBoxPerfCounters.sample()
+            except:
+                JBoxPerfCounters.log_exception("Exception sampling performance counters")
+                time.sleep(JBoxPerfCounters.SAMPLE_INTERVAL)
+
+    @staticmethod
+    def _publish_periodically():
+        while True:
+            time.sleep(max(0, JBoxPerfCounters.LAST_PUBLISHED + JBoxPerfCounters.PUBLISH_INTERVAL - time.time()))
+            try:
+                JBoxPerfCounters.publish()
+            except:
+                JBoxPerfCounters.log_exception("Exception publishing performance counters")
+                JBoxPerfCounters.LAST_PUBLISHED = time.time()
+
+    @staticmethod
+    def latest(name, default=None):
+        with JBoxPerfCounters.LOCK:
+            series = JBoxPerfCounters.SERIES.get(name)
+            return series[-1][1] if (series is not None) and (len(series) > 0) else default
+
+    @staticmethod
+    def series(name, secs=None):
+        """ Samples of counter `name` as a list of (time, value), oldest first. Only the last `secs` if specified. """
+        with JBoxPerfCounters.LOCK:
+            series = list(JBoxPerfCounters.SERIES.get(name, []))
+        if secs is not None:
+            tmin = time.time() - secs
+            series = [s for s in series if s[0] >= tmin]
+        return series
+
+    @staticmethod
+    def average(name, secs, default=None):
+        values = [v for (_t, v) in JBoxPerfCounters.series(name, secs)]
+        return (float(sum(values)) / len(values)) if len(values) > 0 else default
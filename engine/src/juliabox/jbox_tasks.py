@@ -1,9 +1,18 @@
 import zmq
 import json
+import hmac
+import itertools
+import threading
+import time
+
+import tornado.gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from zmq.eventloop import zmqstream
 
 from jbox_util import LoggerMixin, JBoxCfg, JBoxPluginType
-from jbox_crypto import signstr
-from cloud import Compute
+from jbox_crypto import signstr, signbytes
+from cloud import Compute, ClusterView
 
 
 class JBoxAsyncJob(LoggerMixin):
@@ -19,11 +28,25 @@ class JBoxAsyncJob(LoggerMixin):
     CMD_RECORD_PERF_COUNTERS = 8
     CMD_PLUGIN_MAINTENANCE = 9
     CMD_PLUGIN_TASK = 10
+    CMD_REFILL_POOL = 11
+    CMD_PREPARE_DISKS = 12
+    CMD_LAUNCH_PROGRESS = 13
+    CMD_INVALIDATE_DYNCONFIG = 14
+    CMD_SAMPLE_CLUSTER_LOAD = 15
 
     CMD_REQ_RESP = 50
     CMD_SESSION_STATUS = 51
     CMD_API_STATUS = 52
     CMD_IS_TERMINATING = 53
+    CMD_LAUNCH_STATS = 54
+    CMD_WORKER_STATS = 55
+
+    # Messages are framed as a version byte, the signature of the payload, and the payload (compact JSON).
+    # Version 0 (the older JSON message with an embedded signature) is still understood, and can be sent by setting
+    # `async_msg_version` to 0 till all peers understand the newer framing.
+    MSG_VERSION = 1
+    SIGN_LEN = 20
+    SEND_VERSION = MSG_VERSION
 
     ENCKEY = None
     PORTS = None
@@ -33,6 +56,13 @@ class JBoxAsyncJob(LoggerMixin):
     def __init__(self, ports, mode):
         self._mode = mode
         self._ctx = zmq.Context()
+        self._progress_sock = None
+        self._progress_lock = threading.Lock()
+        self._invalidation_stream = None
+        # push sockets to container managers of other instances, to forward notifications to
+        self._peer_socks = {}
+        self._peer_lock = threading.Lock()
+        self._ppport = ports[0]
 
         ppmode = zmq.PUSH if (mode == JBoxAsyncJob.MODE_PUB) else zmq.PULL
         self._push_pull_sock = self._ctx.socket(ppmode)
@@ -46,6 +76,8 @@ class JBoxAsyncJob(LoggerMixin):
         ppconnaddr = 'tcp://%s:%d' % (local_ip, ports[0],)
         rraddr = 'tcp://%s:%d' % (local_ip, ports[1],)
         self._rrport = ports[1]
+        # launch progress is published on the port after the request-response port, unless configured
+        self._progress_addr = 'tcp://%s:%d' % (local_ip, ports[2] if len(ports) > 2 else (ports[1] + 1),)
         self._poller = zmq.Poller()
 
         if mode == JBoxAsyncJob.MODE_PUB:
@@ -55,11 +87,14 @@ class JBoxAsyncJob(LoggerMixin):
             self._poller.register(self._push_pull_sock, zmq.POLLIN)
             self._req_rep_sock = self._ctx.socket(rrmode)
             self._req_rep_sock.bind(rraddr)
+            self._progress_sock = self._ctx.socket(zmq.PUB)
+            self._progress_sock.bind(self._progress_addr)
 
     @staticmethod
     def configure():
         JBoxAsyncJob.PORTS = JBoxCfg.get('container_manager_ports')
         JBoxAsyncJob.ENCKEY = JBoxCfg.get('sesskey')
+        JBoxAsyncJob.SEND_VERSION = JBoxCfg.get('async_msg_version', JBoxAsyncJob.MSG_VERSION)
 
     @staticmethod
     def init(async_mode):
@@ -89,14 +124,155 @@ class JBoxAsyncJob(LoggerMixin):
         JBoxAsyncJob.log_error("signature mismatch. expected [%s], got [%s], srep [%s]", sign, msg['sign'], srep)
         raise ValueError("invalid signature for cmd: %s, data: %s" % (msg['cmd'], msg['data']))
 
-    def sendrecv(self, cmd, data, dest=None, port=None):
+    @staticmethod
+    def _encode(obj):
+        payload = json.dumps(obj, separators=(',', ':'))
+        return chr(JBoxAsyncJob.MSG_VERSION) + signbytes(payload, JBoxAsyncJob.ENCKEY) + payload
+
+    @staticmethod
+    def _is_framed(frame):
+        return (len(frame) > 0) and (ord(frame[0]) == JBoxAsyncJob.MSG_VERSION)
+
+    @staticmethod
+    def _decode(frame):
+        sign = frame[1:(1 + JBoxAsyncJob.SIGN_LEN)]
+        payload = frame[(1 + JBoxAsyncJob.SIGN_LEN):]
+        if not hmac.compare_digest(sign, signbytes(payload, JBoxAsyncJob.ENCKEY)):
+            JBoxAsyncJob.log_error("signature mismatch for payload [%s]", payload)
+            raise ValueError("invalid signature for payload: %s" % (payload,))
+        return json.loads(payload)
+
+    @staticmethod
+    def _make_frame(cmd, data):
+        if JBoxAsyncJob.SEND_VERSION < JBoxAsyncJob.MSG_VERSION:
+            return json.dumps(JBoxAsyncJob._make_msg(cmd, data))
+        return JBoxAsyncJob._encode([cmd, data])
+
+    @staticmethod
+    def _extract_frame(frame):
+        if JBoxAsyncJob._is_framed(frame):
+            cmd, data = JBoxAsyncJob._decode(frame)
+            return cmd, data
+        return JBoxAsyncJob._extract_msg(json.loads(frame))
+
+    def _rr_addr(self, dest, port):
         if (dest is None) or (dest == 'localhost'):
             dest = Compute.get_instance_local_ip()
         else:
             dest = Compute.get_instance_local_ip(dest)
+        return self._rr_addr_of(dest, port)
+
+    def _rr_addr_of(self, ip, port=None):
         if port is None:
             port = self._rrport
-        rraddr = 'tcp://%s:%d' % (dest, port)
+        return 'tcp://%s:%d' % (ip, port)
+
+    def rpc(self, cmd, data, dest=None, port=None, timeout=10):
+        """ Same as `sendrecv`, but returns a Future instead of blocking. Must be called from the IOLoop thread. """
+        if JBoxAsyncJob.SEND_VERSION < JBoxAsyncJob.MSG_VERSION:
+            # peers may not understand request ids yet
+            future = Future()
+            try:
+                future.set_result(self.sendrecv(cmd, data, dest=dest, port=port))
+            except Exception as ex:
+                future.set_exception(ex)
+            return future
+        return JBoxRPCClient.get(self._ctx, self._rr_addr(dest, port)).call(cmd, data, timeout)
+
+    @staticmethod
+    @tornado.gen.coroutine
+    def rpc_all(cmd, data, timeout=10, instances=None):
+        """ Send a request to the container managers of all instances (or of `instances`) in parallel.
+        Waits at most `timeout` seconds in all. Must be called from the IOLoop thread.
+        Returns a dict of instance id to response data, and a dict of instance id to the reason of failure
+        for instances that did not respond in time or responded with an error.
+
+        Instances and their local IPs are taken from `ClusterView`. They are looked up on a separate thread if the view
+        is stale or not running.
+        """
+        queue = JBoxAsyncJob.get()
+        whole_cluster = instances is None
+        local_ips = ClusterView.get_instance_local_ips()
+        if (local_ips is not None) and (whole_cluster or all((inst in local_ips) for inst in instances)):
+            if whole_cluster:
+                instances = local_ips.keys()
+            ips = dict((inst, local_ips[inst]) for inst in instances)
+            failed = {}
+        else:
+            # the cluster view is stale or not running, and looking up instances may take calls to the cloud
+            ips, failed = yield JBoxAsyncJob._in_thread(JBoxAsyncJob._lookup_local_ips, instances)
+            instances = ips.keys() + failed.keys()
+
+        addrs = dict((inst, queue._rr_addr_of(ip)) for (inst, ip) in ips.iteritems())
+        if whole_cluster:
+            # clients of instances that left the cluster are not needed any more
+            JBoxRPCClient.retain(set(addrs.values() + [queue._rr_addr_of(Compute.get_instance_local_ip())]))
+        futures = {}
+        for inst, addr in addrs.iteritems():
+            try:
+                if JBoxAsyncJob.SEND_VERSION < JBoxAsyncJob.MSG_VERSION:
+                    futures[inst] = queue.rpc(cmd, data, dest=inst, timeout=timeout)
+                else:
+                    futures[inst] = JBoxRPCClient.get(queue._ctx, addr).call(cmd, data, timeout)
+            except Exception as ex:
+                failed[inst] = str(ex)
+
+        results = {}
+        # requests were sent together and share the deadline, so waiting on them in turn takes at most `timeout`
+        for inst, future in futures.iteritems():
+            try:
+                resp = yield future
+            except Exception as ex:
+                failed[inst] = str(ex)
+                continue
+            if resp.get('code') == 0:
+                results[inst] = resp['data']
+            else:
+                failed[inst] = resp.get('data')
+        if len(failed) > 0:
+            JBoxAsyncJob.log_warn("cluster request %r failed at %d of %d instances: %r", cmd, len(failed),
+                                  len(instances), failed)
+        raise tornado.gen.Return((results, failed))
+
+    @staticmethod
+    def _lookup_local_ips(instances=None):
+        """ Local IPs of `instances` (all instances if None) from the compute plugin, which may call the cloud.
+        Returns a dict of instance id to local IP, and a dict of instance id to the reason of failure.
+        """
+        if instances is None:
+            instances = Compute.get_all_instances()
+        ips = {}
+        failed = {}
+        for inst in instances:
+            try:
+                ips[inst] = Compute.get_instance_local_ip(inst)
+            except Exception as ex:
+                failed[inst] = str(ex)
+        return ips, failed
+
+    @staticmethod
+    def _in_thread(fn, *args):
+        """ Run `fn(*args)` on a new thread, to keep blocking calls off the IOLoop.
+        Returns a Future that is resolved on the current IOLoop.
+        """
+        ioloop = IOLoop.current()
+        future = Future()
+
+        def run():
+            try:
+                result = fn(*args)
+            except Exception as ex:
+                ioloop.add_callback(future.set_exception, ex)
+                return
+            ioloop.add_callback(future.set_result, result)
+
+        t = threading.Thread(target=run, name='jbox_async_lookup')
+        t.daemon = True
+        t.start()
+        return future
+
+    def sendrecv(self, cmd, data, dest=None, port=None):
+        rraddr = self._rr_addr(dest, port)
 
         JBoxAsyncJob.log_debug("sendrecv to %s. connecting...", rraddr)
         sock = self._ctx.socket(zmq.REQ)
@@ -107,35 +283,117 @@ class JBoxAsyncJob(LoggerMixin):
         poller.register(sock, zmq.POLLOUT)
 
         if poller.poll(10*1000):
-            sock.send_json(self._make_msg(cmd, data))
+            sock.send(self._make_frame(cmd, data))
         else:
             sock.close()
             raise IOError("could not connect to %s", rraddr)
 
         poller.modify(sock, zmq.POLLIN)
         if poller.poll(10*1000):
-            msg = sock.recv_json()
+            msg = sock.recv()
         else:
             sock.close()
             raise IOError("did not receive anything from %s", rraddr)
 
         JBoxAsyncJob.log_debug("sendrecv to %s. received.", rraddr)
         sock.close()
-        return msg
+        # older peers respond with unsigned JSON
+        return self._decode(msg) if self._is_framed(msg) else json.loads(msg)
 
     def respond(self, callback):
-        msg = self._req_rep_sock.recv_json()
-        cmd, data = self._extract_msg(msg)
-        resp = callback(cmd, data)
-        self._req_rep_sock.send_json(resp)
+        frame = self._req_rep_sock.recv()
+        if not self._is_framed(frame):
+            cmd, data = self._extract_frame(frame)
+            self._req_rep_sock.send_json(callback(cmd, data))
+            return
+
+        req = self._decode(frame)
+        resp = callback(req[0], req[1])
+        # requests from JBoxRPCClient carry an id, which is returned with the response
+        if len(req) > 2:
+            resp = [req[2], resp]
+        self._req_rep_sock.send(self._encode(resp))
+
+    def publish_progress(self, sessname, stage):
+        """ Publish the stage a session launch has reached. Only the container manager (MODE_SUB) publishes. """
+        if self._progress_sock is None:
+            return
+        with self._progress_lock:
+            self._progress_sock.send(self._make_frame(JBoxAsyncJob.CMD_LAUNCH_PROGRESS, [sessname, stage]))
+
+    def publish_invalidation(self, keys):
+        """ Publish keys of dynamic configuration that changed. Only the container manager (MODE_SUB) publishes. """
+        if self._progress_sock is None:
+            return
+        with self._progress_lock:
+            self._progress_sock.send(self._make_frame(JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG, [keys, False]))
+
+    def follow_invalidations(self, callback):
+        """ Call `callback(keys)` from the IOLoop with keys of dynamic configuration changed anywhere in the cluster,
+        as published by the container manager of this instance.
+        """
+        def on_recv(msg):
+            try:
+                cmd, data = JBoxAsyncJob._extract_frame(msg[0])
+            except:
+                JBoxAsyncJob.log_exception("Invalid notification message")
+                return
+            if cmd == JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG:
+                callback(data[0])
+
+        self._invalidation_stream = zmqstream.ZMQStream(self.subscribe_progress())
+        self._invalidation_stream.on_recv(on_recv)
+
+    def forward(self, cmd, data, instances):
+        """ Send a command to the container managers of `instances`, without waiting for them to be received.
+        Commands that can not be queued immediately are dropped.
+        """
+        frame = self._make_frame(cmd, data)
+        with self._peer_lock:
+            for inst in instances:
+                sock = self._peer_socks.get(inst)
+                if sock is None:
+                    sock = self._peer_socks[inst] = self._ctx.socket(zmq.PUSH)
+                    sock.setsockopt(zmq.LINGER, 0)
+                    sock.setsockopt(zmq.SNDHWM, 100)
+                    sock.connect('tcp://%s:%d' % (Compute.get_instance_local_ip(inst), self._ppport))
+                try:
+                    sock.send(frame, zmq.NOBLOCK)
+                except zmq.Again:
+                    JBoxAsyncJob.log_warn("dropped command %r to %s", cmd, inst)
+
+    def retain_peers(self, instances):
+        """ Close sockets to container managers of instances other than `instances`. """
+        with self._peer_lock:
+            for inst in self._peer_socks.keys():
+                if inst not in instances:
+                    JBoxAsyncJob.log_debug("closing socket to %s, no longer in the cluster", inst)
+                    self._peer_socks.pop(inst).close()
+
+    def subscribe_progress(self):
+        """ Returns a socket that receives launch progress messages. Use `extract_progress` to decode them.
+        Configuration change notifications are also received on it, for which `extract_progress` returns None.
+        """
+        sock = self._ctx.socket(zmq.SUB)
+        sock.setsockopt(zmq.SUBSCRIBE, '')
+        sock.connect(self._progress_addr)
+        return sock
+
+    @staticmethod
+    def extract_progress(msg):
+        cmd, data = JBoxAsyncJob._extract_frame(msg)
+        if cmd == JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG:
+            return None
+        if cmd != JBoxAsyncJob.CMD_LAUNCH_PROGRESS:
+            raise ValueError("unexpected command %r on progress channel" % (cmd,))
+        return data[0], data[1]
 
     def send(self, cmd, data):
         assert self._mode == JBoxAsyncJob.MODE_PUB
-        self._push_pull_sock.send_json(self._make_msg(cmd, data))
+        self._push_pull_sock.send(self._make_frame(cmd, data))
 
     def recv(self):
-        msg = self._push_pull_sock.recv_json()
-        return self._extract_msg(msg)
+        return self._extract_frame(self._push_pull_sock.recv())
 
     def poll(self, req_resp_pending=False):
         if not req_resp_pending:
@@ -175,10 +433,27 @@ class JBoxAsyncJob(LoggerMixin):
         JBoxAsyncJob.log_info("scheduling activations")
         JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_AUTO_ACTIVATE, '')
 
+    @staticmethod
+    def async_prepare_disks():
+        JBoxAsyncJob.log_info("scheduling preparation of free disks")
+        JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_PREPARE_DISKS, '')
+
+    @staticmethod
+    def async_refill_pool():
+        JBoxAsyncJob.log_info("scheduling refill of container pool")
+        JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_REFILL_POOL, '')
+
+    @staticmethod
+    def async_invalidate_dynconfig(keys, forward=True):
+        JBoxAsyncJob.log_debug("scheduling invalidation of dynamic configuration %r", keys)
+        # forwarded to all instances by the container manager, if `forward` is set
+        JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG, [keys, forward])
+
     @staticmethod
     def async_launch_by_name(name, email, reuse=True):
         JBoxAsyncJob.log_info("Scheduling startup name:%s email:%s", name, email)
-        JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_LAUNCH_SESSION, (name, email, reuse))
+        # time of scheduling is sent along to measure the wait in queue
+        JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_LAUNCH_SESSION, (name, email, reuse, time.time()))
 
     @staticmethod
     def async_backup_and_cleanup(dockid):
@@ -195,11 +470,36 @@ class JBoxAsyncJob(LoggerMixin):
         JBoxAsyncJob.log_debug("fetching api status from %r", instance_id)
         return JBoxAsyncJob.get().sendrecv(JBoxAsyncJob.CMD_API_STATUS, {}, dest=instance_id)
 
+    @staticmethod
+    def rpc_cluster_session_status():
+        JBoxAsyncJob.log_debug("fetching session status from all instances")
+        return JBoxAsyncJob.rpc_all(JBoxAsyncJob.CMD_SESSION_STATUS, {})
+
+    @staticmethod
+    def rpc_cluster_api_status():
+        JBoxAsyncJob.log_debug("fetching api status from all instances")
+        return JBoxAsyncJob.rpc_all(JBoxAsyncJob.CMD_API_STATUS, {})
+
+    @staticmethod
+    def rpc_launch_stats(instance_id=None):
+        JBoxAsyncJob.log_debug("fetching launch stats from %r", instance_id)
+        return JBoxAsyncJob.get().rpc(JBoxAsyncJob.CMD_LAUNCH_STATS, {}, dest=instance_id)
+
+    @staticmethod
+    def rpc_worker_stats(instance_id=None):
+        JBoxAsyncJob.log_debug("fetching worker stats from %r", instance_id)
+        return JBoxAsyncJob.get().rpc(JBoxAsyncJob.CMD_WORKER_STATS, {}, dest=instance_id)
+
     @staticmethod
     def sync_is_terminating():
         JBoxAsyncJob.log_debug("checking if instance is terminating")
         return JBoxAsyncJob.get().sendrecv(JBoxAsyncJob.CMD_IS_TERMINATING, {})
 
+    @staticmethod
+    def rpc_is_terminating():
+        JBoxAsyncJob.log_debug("checking if instance is terminating")
+        return JBoxAsyncJob.get().rpc(JBoxAsyncJob.CMD_IS_TERMINATING, {})
+
     @staticmethod
     def async_plugin_maintenance(is_leader):
         JBoxAsyncJob.log_info("scheduling plugin maintenance. leader:%r", is_leader)
@@ -211,6 +511,95 @@ class JBoxAsyncJob(LoggerMixin):
         JBoxAsyncJob.get().send(JBoxAsyncJob.CMD_PLUGIN_TASK, (JBPluginTask.JBP_CMD_ASYNC, target_class, data))
 
 
+class JBoxRPCClient(LoggerMixin):
+    """ Client for requests to a container manager, for use from the IOLoop.
+
+    Holds a persistent DEALER socket per container manager, over which any number of requests may be in flight.
+    Each request carries an id that the container manager returns with the response, which is used to resolve
+    the Future returned for the request. Requests not responded to within their deadline fail with an IOError,
+    and responses that arrive later are dropped.
+
+    Requests are queued only to a connected container manager, and at most `MAX_PENDING` at a time. A client is
+    closed when a request to it times out, which fails its other pending requests and drops those not sent yet.
+    The next request opens a new one. Clients of instances no longer in the cluster are closed with `retain`.
+    """
+    CLIENTS = {}
+    REQ_IDS = itertools.count(1)
+    MAX_PENDING = 100
+
+    def __init__(self, ctx, addr):
+        self._addr = addr
+        self._pending = {}
+        self._ioloop = IOLoop.current()
+        sock = ctx.socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.setsockopt(zmq.IMMEDIATE, 1)
+        sock.setsockopt(zmq.SNDHWM, JBoxRPCClient.MAX_PENDING)
+        sock.connect(addr)
+        self._stream = zmqstream.ZMQStream(sock, self._ioloop)
+        self._stream.on_recv(self._on_recv)
+
+    @staticmethod
+    def get(ctx, addr):
+        client = JBoxRPCClient.CLIENTS.get(addr)
+        if client is None:
+            JBoxRPCClient.log_debug("connecting rpc client to %s", addr)
+            client = JBoxRPCClient.CLIENTS[addr] = JBoxRPCClient(ctx, addr)
+        return client
+
+    @staticmethod
+    def retain(addrs):
+        """ Close clients of container managers other than those at `addrs`. """
+        for addr in JBoxRPCClient.CLIENTS.keys():
+            if addr not in addrs:
+                JBoxRPCClient.log_debug("closing rpc client to %s, no longer in the cluster", addr)
+                JBoxRPCClient.CLIENTS[addr].close()
+
+    def call(self, cmd, data, timeout):
+        future = Future()
+        if len(self._pending) >= JBoxRPCClient.MAX_PENDING:
+            future.set_exception(IOError("too many requests pending at %s" % (self._addr,)))
+            return future
+        reqid = next(JBoxRPCClient.REQ_IDS)
+        expiry = self._ioloop.add_timeout(time.time() + timeout, lambda: self._expire(reqid))
+        self._pending[reqid] = (future, expiry)
+        # empty delimiter frame, as expected by the REP socket at the other end
+        self._stream.send_multipart(['', JBoxAsyncJob._encode([cmd, data, reqid])])
+        return future
+
+    def close(self):
+        """ Close the socket and fail pending requests. Requests not sent yet are dropped. """
+        if JBoxRPCClient.CLIENTS.get(self._addr) is self:
+            del JBoxRPCClient.CLIENTS[self._addr]
+        pending = self._pending
+        self._pending = {}
+        for future, expiry in pending.itervalues():
+            self._ioloop.remove_timeout(expiry)
+            future.set_exception(IOError("connection to %s closed" % (self._addr,)))
+        self._stream.close()
+
+    def _expire(self, reqid):
+        pending = self._pending.pop(reqid, None)
+        if pending is not None:
+            pending[0].set_exception(IOError("did not receive response from %s in time" % (self._addr,)))
+            JBoxRPCClient.log_info("closing rpc client to %s after a request timed out", self._addr)
+            self.close()
+
+    def _on_recv(self, msg):
+        try:
+            reqid, resp = JBoxAsyncJob._decode(msg[-1])
+        except:
+            JBoxRPCClient.log_exception("Invalid response from %s", self._addr)
+            return
+        pending = self._pending.pop(reqid, None)
+        if pending is None:
+            JBoxRPCClient.log_debug("dropping late response to request %r from %s", reqid, self._addr)
+            return
+        future, expiry = pending
+        self._ioloop.remove_timeout(expiry)
+        future.set_result(resp)
+
+
 class JBPluginTask(LoggerMixin):
     """ Provide tasks that help with container management.
     They run in privileged mode and can interact with the host system if required.
@@ -7,6 +7,8 @@ import hashlib
 import math
 import logging
 import string
+import threading
+import contextlib
 
 import isodate
 import httplib
@@ -293,6 +295,85 @@ class JBoxPluginType(type):
                     return plugin
         return None
 
+
+class LatencyHistogram(object):
+    """ Histogram of durations (in seconds) in exponentially growing buckets, from 1ms to a few hours.
+    Percentiles are accurate to within a bucket, that is about 20% of the value.
+    """
+    MIN_SECS = 0.001
+    GROWTH = 1.2
+    NUM_BUCKETS = 90
+
+    def __init__(self):
+        self.counts = [0] * (LatencyHistogram.NUM_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket(secs):
+        if secs <= LatencyHistogram.MIN_SECS:
+            return 0
+        idx = int(math.ceil(math.log(secs / LatencyHistogram.MIN_SECS, LatencyHistogram.GROWTH)))
+        return min(LatencyHistogram.NUM_BUCKETS, idx)
+
+    def record(self, secs):
+        secs = max(0.0, secs)
+        self.counts[LatencyHistogram._bucket(secs)] += 1
+        self.count += 1
+        self.total += secs
+        self.max = max(self.max, secs)
+
+    def percentile(self, pct):
+        if self.count == 0:
+            return None
+        target = max(1, int(math.ceil(self.count * pct / 100.0)))
+        cumulative = 0
+        for idx, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                return min(self.max, LatencyHistogram.MIN_SECS * (LatencyHistogram.GROWTH ** idx))
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': (self.total / self.count) if self.count > 0 else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class LatencyStats(object):
+    """ Named latency histograms, kept in memory of the process that records them. """
+    LOCK = threading.Lock()
+    HISTOGRAMS = {}
+
+    @staticmethod
+    def record(name, secs):
+        with LatencyStats.LOCK:
+            hist = LatencyStats.HISTOGRAMS.get(name)
+            if hist is None:
+                hist = LatencyStats.HISTOGRAMS[name] = LatencyHistogram()
+            hist.record(secs)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def timed(name):
+        """ Records the time taken by the enclosed block, if it completes without an exception. """
+        tstart = time.time()
+        yield
+        LatencyStats.record(name, time.time() - tstart)
+
+    @staticmethod
+    def summary(prefix=''):
+        with LatencyStats.LOCK:
+            return dict((name, hist.summary()) for (name, hist) in LatencyStats.HISTOGRAMS.iteritems()
+                        if name.startswith(prefix))
+
+
 def retry_on_errors(retries=10, backoff=2, max_sleep_time=32):
     from googleapiclient.errors import HttpError
     def g(f):
@@ -7,7 +7,7 @@ import boto.ec2
 import boto.ec2.cloudwatch
 import boto.ec2.autoscale
 
-from juliabox.cloud import JBPluginCloud, Compute
+from juliabox.cloud import JBPluginCloud, Compute, MetricsPublisher
 from juliabox.jbox_util import JBoxCfg, parse_iso_time, retry
 from juliabox.db import JBoxInstanceProps
 
@@ -29,6 +29,7 @@ class CompEC2(JBPluginCloud):
     SCALE_UP_POLICY = None
     SCALE_UP_AT_LOAD = 80
     LAST_SCALE_UP_TIME = None
+    SCALER_PLUGIN = None
 
     INSTANCE_ID = None
     INSTANCE_IMAGE_VERS = {}
@@ -39,6 +40,9 @@ class CompEC2(JBPluginCloud):
     PUBLIC_IP = None
 
     SELF_STATS = dict()
+    # CloudWatch accepts up to 20 points in a call
+    PUBLISHER = None
+    MAX_PUBLISH_BATCH = 20
 
     @staticmethod
     def configure():
@@ -48,6 +52,9 @@ class CompEC2(JBPluginCloud):
 
         CompEC2.INSTALL_ID = JBoxCfg.get('cloud_host.install_id', 'JuliaBox')
         CompEC2.REGION = JBoxCfg.get('cloud_host.region', 'us-east-1')
+        scaler = CompEC2._get_scaler_plugin()
+        if scaler:
+            scaler.configure()
 
     @staticmethod
     def get_install_id():
@@ -116,20 +123,36 @@ class CompEC2(JBPluginCloud):
             attrs = CompEC2._instance_attrs(instance_id)
             return attrs.private_ip_address
 
+    @staticmethod
+    def _put_metric_data(points):
+        names, units, values, timestamps, dims = [list(x) for x in zip(*points)]
+        CompEC2._connect_cloudwatch().put_metric_data(namespace=CompEC2.INSTALL_ID, name=names, value=values,
+                                                      timestamp=timestamps, unit=units, dimensions=dims)
+
+    @staticmethod
+    def _publisher():
+        if CompEC2.PUBLISHER is None:
+            CompEC2.PUBLISHER = MetricsPublisher('cloudwatch_publisher', CompEC2._put_metric_data,
+                                                 CompEC2.MAX_PUBLISH_BATCH)
+        return CompEC2.PUBLISHER
+
     @staticmethod
     def publish_stats(stat_name, stat_unit, stat_value):
         """ Publish custom cloudwatch statistics. Used for status monitoring and auto scaling. """
-        CompEC2.SELF_STATS[stat_name] = stat_value
-        dims = {'InstanceID': CompEC2.get_instance_id()}
-        CompEC2.log_info("CloudWatch %s.%s.%s=%r(%s)", CompEC2.INSTALL_ID, CompEC2.get_instance_id(),
-                         stat_name, stat_value, stat_unit)
-        CompEC2._connect_cloudwatch().put_metric_data(namespace=CompEC2.INSTALL_ID, name=stat_name,
-                                                      unit=stat_unit, value=stat_value, dimensions=dims)
+        CompEC2.publish_stats_multi([(stat_name, stat_unit, stat_value)])
 
     @staticmethod
     def publish_stats_multi(stats):
+        """ Queue custom cloudwatch statistics, to be published in batches in the background. """
+        dims = {'InstanceID': CompEC2.get_instance_id()}
+        tnow = datetime.datetime.utcnow()
+        points = []
         for (stat_name, stat_unit, stat_value) in stats:
-            CompEC2.publish_stats(stat_name, stat_unit, stat_value)
+            CompEC2.SELF_STATS[stat_name] = stat_value
+            CompEC2.log_info("CloudWatch %s.%s.%s=%r(%s)", CompEC2.INSTALL_ID, CompEC2.get_instance_id(),
+                             stat_name, stat_value, stat_unit)
+            points.append((stat_name, stat_unit, stat_value, tnow, dims))
+        CompEC2._publisher().put(points)
 
     @staticmethod
     def get_instance_stats(instance, stat_name, namespace=None):
@@ -241,12 +264,22 @@ class CompEC2(JBPluginCloud):
             CompEC2.log_debug("not terminating as this is the only machine")
             return False
 
+        scaler = CompEC2._get_scaler_plugin()
+        if scaler:
+            cluster_load = CompEC2.get_cluster_stats('Load')
+            recentness = CompEC2.get_image_recentness_all()
+            cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0}
+            avg_load = CompEC2.get_cluster_average_stats('Load', results=cluster_load)
+            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load), 'is_leader': is_leader}
+            return scaler.machines_to_add(ctx) < 0
+
         return True
 
     @staticmethod
     def get_redirect_instance_id():
         cluster_load = CompEC2.get_cluster_stats('Load')
-        cluster_load = {k: v for k, v in cluster_load.iteritems() if CompEC2.get_image_recentness(k) >= 0}
+        recentness = CompEC2.get_image_recentness_all()
+        cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0}
         avg_load = CompEC2.get_cluster_average_stats('Load', results=cluster_load)
 
         if avg_load >= 50:
@@ -272,6 +305,12 @@ class CompEC2(JBPluginCloud):
         CompEC2.log_info("Redirect to instance_id: %r", filtered_nodes[0])
         return filtered_nodes[0]
 
+    @staticmethod
+    def _get_scaler_plugin():
+        if CompEC2.SCALER_PLUGIN is None:
+            CompEC2.SCALER_PLUGIN = JBPluginCloud.jbox_get_plugin(JBPluginCloud.JBP_SCALER)
+        return CompEC2.SCALER_PLUGIN
+
     @staticmethod
     def should_accept_session(is_leader):
         self_instance_id = CompEC2.get_instance_id()
@@ -286,14 +325,22 @@ class CompEC2(JBPluginCloud):
             cluster_load[self_instance_id] = self_load
 
         # remove machines with older AMIs
-        cluster_load = {k: v for k, v in cluster_load.iteritems()
-                        if CompEC2.get_image_recentness(k) >= 0 and v is not None}
+        recentness = CompEC2.get_image_recentness_all()
+        cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0 and v is not None}
         CompEC2.log_debug("Cluster load (excluding old amis): %r", cluster_load)
 
         avg_load = CompEC2.get_cluster_average_stats('Load', results=cluster_load)
         CompEC2.log_debug("Average load (excluding old amis): %r", avg_load)
 
-        if avg_load >= CompEC2.SCALE_UP_AT_LOAD:
+        scaler = CompEC2._get_scaler_plugin()
+        if scaler:
+            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load), 'is_leader': is_leader}
+            m = scaler.machines_to_add(ctx)
+            if m > 0:
+                CompEC2.log_warn("%r has requested scale up, adding %d machines, average load is %r",
+                                 scaler.get_name(), m, avg_load)
+                CompEC2._add_instance(m)
+        elif avg_load >= CompEC2.SCALE_UP_AT_LOAD:
             CompEC2.log_warn("Requesting scale up as cluster average load %r > %r", avg_load, CompEC2.SCALE_UP_AT_LOAD)
             CompEC2._add_instance()
 
@@ -428,7 +475,7 @@ class CompEC2(JBPluginCloud):
         return instances
 
     @staticmethod
-    def _add_instance():
+    def _add_instance(num_instances=1):
         try:
             # Execute policy only after a reasonable wait period to let a new machine boot up.
             # This will prevent thrashing AWS APIs and triggering AWS throttling.
@@ -437,37 +484,61 @@ class CompEC2(JBPluginCloud):
             if (CompEC2.LAST_SCALE_UP_TIME is None) or \
                     (now > CompEC2.LAST_SCALE_UP_TIME + datetime.timedelta(minutes=5)):
                 CompEC2.LAST_SCALE_UP_TIME = now
-                CompEC2._connect_autoscale().execute_policy(CompEC2.SCALE_UP_POLICY,
-                                                            as_group=CompEC2.AUTOSCALE_GROUP,
-                                                            honor_cooldown='true')
+                if num_instances > 1:
+                    # the scale up policy adds a fixed number of instances, set the capacity directly instead
+                    group = CompEC2._get_autoscale_group(CompEC2.AUTOSCALE_GROUP)
+                    capacity = min(group.desired_capacity + num_instances, group.max_size)
+                    CompEC2.log_info("Setting desired capacity to %d", capacity)
+                    CompEC2._connect_autoscale().set_desired_capacity(CompEC2.AUTOSCALE_GROUP, capacity,
+                                                                      honor_cooldown=True)
+                else:
+                    CompEC2._connect_autoscale().execute_policy(CompEC2.SCALE_UP_POLICY,
+                                                                as_group=CompEC2.AUTOSCALE_GROUP,
+                                                                honor_cooldown='true')
         except:
             CompEC2.log_exception("Error requesting scale up")
 
+    @staticmethod
+    def _image_versions(instances):
+        """ Returns the image version of each of `instances`, and the max and min among them. """
+        vers = dict((inst, CompEC2._image_version(inst)) for inst in instances)
+        max_ami_ver = max([0] + vers.values())
+        min_ami_ver = min([sys.maxint] + vers.values())
+        return vers, max_ami_ver, min_ami_ver
+
+    @staticmethod
+    def _recentness(ami_ver, max_ami_ver, min_ami_ver):
+        if ami_ver == 0:
+            return 0
+        elif max_ami_ver > ami_ver:
+            return -1
+        elif min_ami_ver < ami_ver:
+            return 1
+        else:
+            return 0
+
     @staticmethod
     def get_image_recentness(instance=None):
         instances = CompEC2.get_all_instances()
         if instances is None:
             return 0
-        max_ami_ver = 0
-        min_ami_ver = sys.maxint
-        for inst in instances:
-            ami_ver = CompEC2._image_version(inst)
-            max_ami_ver = max(max_ami_ver, ami_ver)
-            min_ami_ver = min(min_ami_ver, ami_ver)
+        _vers, max_ami_ver, min_ami_ver = CompEC2._image_versions(instances)
 
         if instance is None:
             instance = CompEC2.get_instance_id()
         self_ami_ver = CompEC2._image_version(instance)
         CompEC2.log_debug("ami versions: max: %d, min: %d, self(%s):%d", max_ami_ver, min_ami_ver,
                           instance, self_ami_ver)
-        if self_ami_ver == 0:
-            return 0
-        elif max_ami_ver > self_ami_ver:
-            return -1
-        elif min_ami_ver < self_ami_ver:
-            return 1
-        else:
-            return 0
+        return CompEC2._recentness(self_ami_ver, max_ami_ver, min_ami_ver)
+
+    @staticmethod
+    def get_image_recentness_all():
+        """ Image recentness of all instances, finding image versions once for the whole cluster. """
+        instances = CompEC2.get_all_instances()
+        if instances is None:
+            return {}
+        vers, max_ami_ver, min_ami_ver = CompEC2._image_versions(instances)
+        return dict((inst, CompEC2._recentness(ver, max_ami_ver, min_ami_ver)) for (inst, ver) in vers.iteritems())
 
     @staticmethod
     def _state_check(obj, state):
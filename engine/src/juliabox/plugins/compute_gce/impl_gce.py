@@ -199,9 +199,10 @@ class CompGCE(JBPluginCloud):
         scaler = CompGCE._get_scaler_plugin()
         if scaler:
             cluster_load = CompGCE.get_cluster_stats('Load')
-            cluster_load = {k: v for k, v in cluster_load.iteritems() if CompGCE.get_image_recentness(k) >= 0}
+            recentness = CompGCE.get_image_recentness_all()
+            cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0}
             avg_load = CompGCE.get_cluster_average_stats('Load', results=cluster_load)
-            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load)}
+            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load), 'is_leader': is_leader}
             return scaler.machines_to_add(ctx) < 0
 
         return True
@@ -209,7 +210,8 @@ class CompGCE(JBPluginCloud):
     @staticmethod
     def get_redirect_instance_id():
         cluster_load = CompGCE.get_cluster_stats('Load')
-        cluster_load = {k: v for k, v in cluster_load.iteritems() if CompGCE.get_image_recentness(k) >= 0}
+        recentness = CompGCE.get_image_recentness_all()
+        cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0}
         avg_load = CompGCE.get_cluster_average_stats('Load', results=cluster_load)
         if avg_load == None:
             return CompGCE.get_instance_id()
@@ -256,7 +258,8 @@ class CompGCE(JBPluginCloud):
             cluster_load[self_instance_id] = self_load
 
         # remove machines with older AMIs
-        cluster_load = {k: v for k, v in cluster_load.iteritems() if CompGCE.get_image_recentness(k) >= 0}
+        recentness = CompGCE.get_image_recentness_all()
+        cluster_load = {k: v for k, v in cluster_load.iteritems() if recentness.get(k, 0) >= 0}
         CompGCE.log_debug("Cluster load (excluding old amis): %r", cluster_load)
 
         avg_load = CompGCE.get_cluster_average_stats('Load', results=cluster_load)
@@ -264,7 +267,7 @@ class CompGCE(JBPluginCloud):
 
         scaler = CompGCE._get_scaler_plugin()
         if scaler:
-            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load)}
+            ctx = {'avg_load': avg_load, 'num_active_machines': len(cluster_load), 'is_leader': is_leader}
             m = scaler.machines_to_add(ctx)
             if m > 0:
                 CompGCE.log_warn("%r has requested scale up, adding %d machines, average load is %r",
@@ -483,31 +486,47 @@ class CompGCE(JBPluginCloud):
         except:
             CompGCE.log_exception("Error requesting scale up")
 
+    @staticmethod
+    def _image_versions(instances):
+        """ Returns the image version of each of `instances`, and the max and min among them. """
+        vers = dict((inst, CompGCE._image_version(inst)) for inst in instances)
+        max_ami_ver = max([0] + vers.values())
+        min_ami_ver = min([sys.maxint] + vers.values())
+        return vers, max_ami_ver, min_ami_ver
+
+    @staticmethod
+    def _recentness(ami_ver, max_ami_ver, min_ami_ver):
+        if ami_ver == 0:
+            return 0
+        elif max_ami_ver > ami_ver:
+            return -1
+        elif min_ami_ver < ami_ver:
+            return 1
+        else:
+            return 0
+
     @staticmethod
     def get_image_recentness(instance=None):
         instances = CompGCE.get_all_instances()
         if instances is None:
             return 0
-        max_ami_ver = 0
-        min_ami_ver = sys.maxint
-        for inst in instances:
-            ami_ver = CompGCE._image_version(inst)
-            max_ami_ver = max(max_ami_ver, ami_ver)
-            min_ami_ver = min(min_ami_ver, ami_ver)
+        _vers, max_ami_ver, min_ami_ver = CompGCE._image_versions(instances)
 
         if instance is None:
             instance = CompGCE.get_instance_id()
         self_ami_ver = CompGCE._image_version(instance)
         CompGCE.log_debug("ami versions: max: %d, min: %d, self(%s):%d",
                           max_ami_ver, min_ami_ver, instance, self_ami_ver)
-        if self_ami_ver == 0:
-            return 0
-        elif max_ami_ver > self_ami_ver:
-            return -1
-        elif min_ami_ver < self_ami_ver:
-            return 1
-        else:
-            return 0
+        return CompGCE._recentness(self_ami_ver, max_ami_ver, min_ami_ver)
+
+    @staticmethod
+    def get_image_recentness_all():
+        """ Image recentness of all instances, finding image versions once for the whole cluster. """
+        instances = CompGCE.get_all_instances()
+        if instances is None:
+            return {}
+        vers, max_ami_ver, min_ami_ver = CompGCE._image_versions(instances)
+        return dict((inst, CompGCE._recentness(ver, max_ami_ver, min_ami_ver)) for (inst, ver) in vers.iteritems())
 
     @staticmethod
     def _state_check(obj, state):
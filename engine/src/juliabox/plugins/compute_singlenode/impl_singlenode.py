@@ -137,6 +137,10 @@ class CompSingleNode(JBPluginCloud):
     def get_image_recentness(instance=None):
         return 0
 
+    @staticmethod
+    def get_image_recentness_all():
+        return {CompSingleNode.get_instance_id(): 0}
+
     @staticmethod
     def get_available_instances():
         JBoxInstanceProps.get_available_instances(CompSingleNode.get_install_id())
@@ -1,5 +1,6 @@
 __author__ = 'tan'
 import datetime
+from decimal import Decimal
 import pytz
 import json
 import traceback
@@ -213,6 +214,8 @@ class HomeworkHandler(JBPluginHandler):
             'create_time': JBoxUserV2.datetime_to_yyyymmdd(dt)
         })
 
+        # correct q&a entries are created, or updated if they exist, together
+        answers = []
         for problemset in course['problemsets']:
             problemset_id = problemset['id']
             questions = problemset['questions']
@@ -223,18 +226,21 @@ class HomeworkHandler(JBPluginHandler):
                 attempts = question['attempts'] if 'attempts' in question else 0
                 explanation = question['explanation'] if 'explanation' in question else None
                 # nscore = question['nscore'] if 'nscore' in question else 0
-                try:
-                    ans = JBoxCourseHomework(course_id, problemset_id, question_id, JBoxCourseHomework.ANSWER_KEY,
-                                             answer=answer, state=JBoxCourseHomework.STATE_CORRECT, create=True, explanation=explanation)
-                except:
-                    # The correct q&a entry already exists, update it.
-                    ans = JBoxCourseHomework(course_id, problemset_id, question_id, JBoxCourseHomework.ANSWER_KEY)
-                    ans.set_answer(answer, JBoxCourseHomework.STATE_CORRECT)
-                    ans.set_explanation(explanation)
-
-                ans.set_score(score)
-                ans.set_attempts(attempts)
-                ans.save()
+                answers.append(({
+                    'question_gid': JBoxCourseHomework.question_gid(course_id, problemset_id, question_id),
+                    'student_id': JBoxCourseHomework.ANSWER_KEY
+                }, {
+                    'course_id': course_id,
+                    'problemset_id': problemset_id,
+                    'question_id': question_id,
+                    'answer': answer,
+                    'explanation': explanation,
+                    'state': JBoxCourseHomework.STATE_CORRECT,
+                    'score': Decimal(str(score)),
+                    'attempts': int(attempts),
+                    'create_time': JBoxCourseHomework.datetime_to_epoch_secs(dt)
+                }))
+        JBoxCourseHomework.batch_upsert(answers)
 
         for uid in course['admins']:
             user = JBoxUserV2(uid)
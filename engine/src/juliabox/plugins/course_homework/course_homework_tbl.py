@@ -137,16 +137,27 @@ class JBoxCourseHomework(JBPluginDB):
                     rec.set_answer(answer, state)
                 else:
                     score = rec.get_attrib('score', 0)
-            except JBoxDBItemNotFound:
-                # If this is the first attempt, add an entry to record the attempt
-                rec = JBoxCourseHomework(course_id, problemset_id, question_id, student_id,
-                                         answer=answer, state=state, create=True)
-
-            if state == JBoxCourseHomework.STATE_INCORRECT:
-                rec.increment_attempts()
+                if state == JBoxCourseHomework.STATE_INCORRECT:
+                    rec.increment_attempts()
 
-            rec.set_score(score)
-            rec.save()
+                rec.set_score(score)
+                rec.save()
+            except JBoxDBItemNotFound:
+                # If this is the first attempt, add an entry to record the attempt, with its outcome
+                dt = datetime.datetime.now(pytz.utc)
+                JBoxCourseHomework.upsert({
+                    'question_gid': JBoxCourseHomework.question_gid(course_id, problemset_id, question_id),
+                    'student_id': student_id
+                }, {
+                    'course_id': course_id,
+                    'problemset_id': problemset_id,
+                    'question_id': question_id,
+                    'answer': answer,
+                    'state': state,
+                    'attempts': 1 if (state == JBoxCourseHomework.STATE_INCORRECT) else 0,
+                    'score': Decimal(str(score)),
+                    'create_time': JBoxCourseHomework.datetime_to_epoch_secs(dt)
+                })
 
         return state, score, used_attempts, max_score, max_attempts, explanation
 
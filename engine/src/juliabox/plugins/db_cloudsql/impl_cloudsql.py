@@ -1,12 +1,13 @@
 __author__ = 'Nishanth'
 
+import time
 import threading
 import MySQLdb
 import decimal
 import copy
 
 from juliabox.db import JBPluginDB, JBoxDBItemNotFound
-from juliabox.jbox_util import JBoxCfg, LoggerMixin
+from juliabox.jbox_util import JBoxCfg, LoggerMixin, LatencyStats
 
 
 class JBoxMySQLTable(LoggerMixin):
@@ -24,9 +25,8 @@ class JBoxMySQLTable(LoggerMixin):
     def __init__(self, table_name):
         self.name = '`' + table_name + '`'
         pragma_sql = 'show columns from %s' % (self.name,)
-        c = JBoxCloudSQL.execute(pragma_sql)
-        rows = c.fetchall()
-        pragma_cols = [spec[0] for spec in c.description]
+        rows, description = JBoxCloudSQL.execute(pragma_sql)
+        pragma_cols = [spec[0] for spec in description]
 
         columns = []
         pk = []
@@ -36,7 +36,6 @@ class JBoxMySQLTable(LoggerMixin):
             columns.append(colname)
             if rowdict['Key'] == 'PRI':
                 pk.append(colname)
-        c.close()
         self.columns = columns
         self.pk = pk
         params = []
@@ -48,13 +47,15 @@ class JBoxMySQLTable(LoggerMixin):
                                 " (" + ", ".join(qcols) + ")" + \
                                 " values (" + ", ".join(params) + ")"
 
-    def insert(self, record_):
+    def _insert_stmts(self, record_):
         record = copy.deepcopy(record_)
         for col in self.columns:
             if col not in record.keys():
                 record[col] = None
-        c = JBoxCloudSQL.execute(self.insert_statement, record)
-        c.close()
+        return [(self.insert_statement, record)]
+
+    def insert(self, record):
+        JBoxCloudSQL.execute_batch(self._insert_stmts(record))
 
     @staticmethod
     def _op(name, opstr, value, names, values):
@@ -70,7 +71,23 @@ class JBoxMySQLTable(LoggerMixin):
         else:
             values.append(vals)
 
-    def _select(self, count, **kwargs):
+    def _columns(self, attributes):
+        """ Columns to select for a projection to `attributes`. Keys are always selected. """
+        if attributes is None:
+            return self.columns
+        return [col for col in self.columns if (col in self.pk) or (col in attributes)]
+
+    def _after(self, start_key, names, params):
+        """ Adds a condition that selects records after `start_key`, in the order of the primary key. """
+        terms = []
+        for idx in range(len(self.pk)):
+            terms.append(' and '.join(["`%s` = %%(_start_%s)s" % (col, col) for col in self.pk[:idx]] +
+                                      ["`%s` > %%(_start_%s)s" % (self.pk[idx], self.pk[idx])]))
+        names.append('(' + ' or '.join(['(' + term + ')' for term in terms]) + ')')
+        for col in self.pk:
+            params['_start_' + col] = start_key[col]
+
+    def _select_stmt(self, count, attributes=None, start_key=None, page_size=None, **kwargs):
         names = []
         values = []
         colnames = []
@@ -91,40 +108,65 @@ class JBoxMySQLTable(LoggerMixin):
                 colnames.extend((colname + 'L', colname + 'R'))
             else:
                 colnames.append(colname)
+        params = dict(zip(colnames, values))
+        if start_key is not None:
+            self._after(start_key, names, params)
 
-        selattribs = 'count(*)' if count else '*'
+        columns = self._columns(attributes)
+        selattribs = 'count(*)' if count else ', '.join(['`' + col + '`' for col in columns])
         if len(names) > 0:
             criteria = ' where ' + ' and '.join(names)
         else:
             criteria = ''
+        if page_size is not None:
+            criteria += ' order by ' + ', '.join(['`' + col + '`' for col in self.pk]) + ' limit %(_page_size)s'
+            params['_page_size'] = page_size
         stmt = 'select %s from %s%s%s' % (selattribs, self.name,
                                           use_index_sql, criteria)
-        params = dict(zip(colnames, values))
-        c = JBoxCloudSQL.execute(stmt, params)
-        return c
+        return stmt, params, columns
+
+    def _select(self, count, **kwargs):
+        stmt, params, columns = self._select_stmt(count, **kwargs)
+        rows, _description = JBoxCloudSQL.execute(stmt, params)
+        return rows, columns
 
     def select(self, **kwargs):
-        c = self._select(False, **kwargs)
-        row = c.fetchone()
-        if row is None:
+        rows, columns = self._select(False, **kwargs)
+        if len(rows) == 0:
             raise JBoxDBItemNotFound()
 
-        item = dict(zip(self.columns, row))
-        c.close()
-        return item
-
-    def scan(self, **kwargs):
-        c = self._select(False, **kwargs)
-        return (dict(zip(self.columns, row)) for row in c)
+        return dict(zip(columns, rows[0]))
+
+    def scan_page(self, page_size=None, start_key=None, **kwargs):
+        """ Returns up to `page_size` records after `start_key`, in the order of the primary key, and the key to
+        continue from (None after the last page).
+        """
+        if page_size is None:
+            page_size = JBoxCloudSQL.SCAN_PAGE_SIZE
+        rows, columns = self._select(False, start_key=start_key, page_size=page_size, **kwargs)
+        records = [dict(zip(columns, row)) for row in rows]
+        if len(records) < page_size:
+            return records, None
+        return records, dict((col, records[-1][col]) for col in self.pk)
+
+    def scan(self, max_page_size=None, **kwargs):
+        # read a page at a time, each with a statement of its own, so that a slow reader neither holds a pooled
+        # connection for the whole scan nor runs into the server's write timeout
+        start_key = None
+        while True:
+            records, start_key = self.scan_page(page_size=max_page_size, start_key=start_key, **kwargs)
+            for record in records:
+                yield record
+            if start_key is None:
+                break
 
     def count(self, **kwargs):
-        c = self._select(True, **kwargs)
-        row = c.fetchone()
-        if row is None:
+        rows, _columns = self._select(True, **kwargs)
+        if len(rows) == 0:
             return 0
-        return row[0]
+        return rows[0][0]
 
-    def delete(self, record):
+    def _delete_stmts(self, record):
         names = []
         values = []
         colnames = []
@@ -141,11 +183,12 @@ class JBoxMySQLTable(LoggerMixin):
         criteria = ' where ' + ' and '.join(names)
         stmt = "delete from %s%s" % (self.name, criteria)
 
-        # self.log_debug("SQL: %s", stmt)
-        c = JBoxCloudSQL.execute(stmt, dict(zip(colnames, values)))
-        c.close()
+        return [(stmt, dict(zip(colnames, values)))]
 
-    def update(self, record):
+    def delete(self, record):
+        JBoxCloudSQL.execute_batch(self._delete_stmts(record))
+
+    def _update_stmts(self, record):
         keynames = []
         updates = []
         values = []
@@ -174,18 +217,190 @@ class JBoxMySQLTable(LoggerMixin):
 
         stmt = "update %s set %s%s" % (self.name, updatecols, criteria)
 
-        # self.log_debug("SQL: %s", stmt)
-        c = JBoxCloudSQL.execute(stmt, dict(zip(names, values)))
-        c.close()
+        return [(stmt, dict(zip(names, values)))]
+
+    def update(self, record):
+        JBoxCloudSQL.execute_batch(self._update_stmts(record))
+
+    def _upsert_stmts(self, keys, values):
+        if len(keys) != len(self.pk):
+            raise JBoxDBItemNotFound()
+        record = dict(keys)
+        record.update(values)
+        cols = [colname for colname in self.columns if colname in record]
+        updatecols = [colname for colname in cols if colname not in self.pk]
+
+        stmt = "insert %sinto %s (%s) values (%s)" % ('' if len(updatecols) > 0 else 'ignore ', self.name,
+                                                      ", ".join(['`' + col + '`' for col in cols]),
+                                                      ", ".join(['%(' + col + ')s' for col in cols]))
+        if len(updatecols) > 0:
+            stmt += " on duplicate key update " + \
+                    ", ".join(["`%s` = values(`%s`)" % (colname, colname) for colname in updatecols])
+
+        return [(stmt, dict((col, record[col]) for col in cols))]
+
+    def upsert(self, keys, values):
+        JBoxCloudSQL.execute_batch(self._upsert_stmts(keys, values))
+
+
+class JBoxMySQLPool(LoggerMixin):
+    """ Bounded pool of connections to the database, shared by all threads of the process.
+
+    Connections are checked out for the duration of a statement (or a transaction) and checked back in after.
+    At most `MAX_SIZE` connections are open at a time. A checkout waits up to `TIMEOUT_SECS` for a connection to be
+    checked in, and the time spent waiting is recorded as the `db.pool_wait` latency statistic.
+
+    Idle connections are pinged every `PING_SECS` by a background thread, so that they are not dropped by the server,
+    and are checked with a ping at checkout if idle for longer. Connections open for more than `MAX_LIFETIME_SECS`
+    are closed at checkin (or by the background thread, if idle) and replaced by new ones as needed.
+    """
+    MAX_SIZE = 10
+    TIMEOUT_SECS = 10
+    PING_SECS = 60
+    MAX_LIFETIME_SECS = 60 * 60
+
+    LOCK = threading.Condition()
+    # idle connections as [connection, time opened, time last used], the most recently used last
+    IDLE = []
+    NUM_OPEN = 0
+    THREAD = None
+    STATS = {
+        'checkouts': 0,
+        'waits': 0,
+        'timeouts': 0,
+        'opened': 0,
+        'recycled': 0,
+        'broken': 0
+    }
+
+    @staticmethod
+    def configure(dbconf):
+        JBoxMySQLPool.MAX_SIZE = dbconf.get('pool_size', JBoxMySQLPool.MAX_SIZE)
+        JBoxMySQLPool.TIMEOUT_SECS = dbconf.get('pool_timeout_secs', JBoxMySQLPool.TIMEOUT_SECS)
+        JBoxMySQLPool.PING_SECS = dbconf.get('pool_ping_secs', JBoxMySQLPool.PING_SECS)
+        JBoxMySQLPool.MAX_LIFETIME_SECS = dbconf.get('pool_max_lifetime_secs', JBoxMySQLPool.MAX_LIFETIME_SECS)
+
+    @staticmethod
+    def stats():
+        with JBoxMySQLPool.LOCK:
+            stats = dict(JBoxMySQLPool.STATS)
+            stats['open'] = JBoxMySQLPool.NUM_OPEN
+            stats['idle'] = len(JBoxMySQLPool.IDLE)
+        return stats
+
+    @staticmethod
+    def checkout():
+        """ Returns a connection as [connection, time opened, time last used], to be passed back to `checkin`. """
+        tstart = time.time()
+        waited = False
+        with JBoxMySQLPool.LOCK:
+            JBoxMySQLPool.STATS['checkouts'] += 1
+            if JBoxMySQLPool.THREAD is None:
+                JBoxMySQLPool.THREAD = threading.Thread(target=JBoxMySQLPool._keep_alive, name='mysql_pool')
+                JBoxMySQLPool.THREAD.daemon = True
+                JBoxMySQLPool.THREAD.start()
+            while (len(JBoxMySQLPool.IDLE) == 0) and (JBoxMySQLPool.NUM_OPEN >= JBoxMySQLPool.MAX_SIZE):
+                remaining = tstart + JBoxMySQLPool.TIMEOUT_SECS - time.time()
+                if remaining <= 0:
+                    JBoxMySQLPool.STATS['timeouts'] += 1
+                    raise MySQLdb.OperationalError("no database connection free in %r secs. %d open." %
+                                                   (JBoxMySQLPool.TIMEOUT_SECS, JBoxMySQLPool.NUM_OPEN))
+                if not waited:
+                    JBoxMySQLPool.STATS['waits'] += 1
+                    waited = True
+                JBoxMySQLPool.LOCK.wait(remaining)
+            pooled = JBoxMySQLPool.IDLE.pop() if len(JBoxMySQLPool.IDLE) > 0 else None
+            if pooled is None:
+                JBoxMySQLPool.NUM_OPEN += 1
+        LatencyStats.record('db.pool_wait', time.time() - tstart)
+
+        if pooled is not None:
+            tnow = time.time()
+            if tnow - pooled[1] > JBoxMySQLPool.MAX_LIFETIME_SECS:
+                JBoxMySQLPool._close(pooled, 'recycled', reopen=True)
+                pooled = None
+            elif tnow - pooled[2] > JBoxMySQLPool.PING_SECS:
+                try:
+                    pooled[0].ping()
+                except MySQLdb.Error:
+                    JBoxMySQLPool._close(pooled, 'broken', reopen=True)
+                    pooled = None
+
+        if pooled is None:
+            try:
+                pooled = [JBoxCloudSQL.connect(), time.time(), time.time()]
+            except:
+                with JBoxMySQLPool.LOCK:
+                    JBoxMySQLPool.NUM_OPEN -= 1
+                    JBoxMySQLPool.LOCK.notify()
+                raise
+            with JBoxMySQLPool.LOCK:
+                JBoxMySQLPool.STATS['opened'] += 1
+        return pooled
+
+    @staticmethod
+    def checkin(pooled, broken=False):
+        tnow = time.time()
+        if broken:
+            JBoxMySQLPool._close(pooled, 'broken')
+        elif tnow - pooled[1] > JBoxMySQLPool.MAX_LIFETIME_SECS:
+            JBoxMySQLPool._close(pooled, 'recycled')
+        else:
+            pooled[2] = tnow
+            with JBoxMySQLPool.LOCK:
+                JBoxMySQLPool.IDLE.append(pooled)
+                JBoxMySQLPool.LOCK.notify()
+
+    @staticmethod
+    def _close(pooled, reason, reopen=False):
+        """ Close a connection. Its slot in the pool is freed, unless it is to be reopened by the caller. """
+        try:
+            pooled[0].close()
+        except MySQLdb.Error:
+            pass
+        with JBoxMySQLPool.LOCK:
+            JBoxMySQLPool.STATS[reason] += 1
+            if not reopen:
+                JBoxMySQLPool.NUM_OPEN -= 1
+                JBoxMySQLPool.LOCK.notify()
+
+    @staticmethod
+    def _keep_alive():
+        while True:
+            time.sleep(JBoxMySQLPool.PING_SECS)
+            tnow = time.time()
+            with JBoxMySQLPool.LOCK:
+                # take out connections that need attention, so that they are not checked out meanwhile
+                stale = [pooled for pooled in JBoxMySQLPool.IDLE if tnow - pooled[2] >= JBoxMySQLPool.PING_SECS]
+                JBoxMySQLPool.IDLE = [pooled for pooled in JBoxMySQLPool.IDLE
+                                      if tnow - pooled[2] < JBoxMySQLPool.PING_SECS]
+            for pooled in stale:
+                if tnow - pooled[1] > JBoxMySQLPool.MAX_LIFETIME_SECS:
+                    JBoxMySQLPool._close(pooled, 'recycled')
+                    continue
+                try:
+                    pooled[0].ping()
+                except MySQLdb.Error:
+                    JBoxMySQLPool._close(pooled, 'broken')
+                    continue
+                pooled[2] = time.time()
+                with JBoxMySQLPool.LOCK:
+                    # ahead of more recently used connections, so that unused ones are picked last
+                    JBoxMySQLPool.IDLE.insert(0, pooled)
+                    JBoxMySQLPool.LOCK.notify()
+            if len(stale) > 0:
+                JBoxMySQLPool.log_debug("pinged %d idle connections. pool stats: %r", len(stale),
+                                        JBoxMySQLPool.stats())
+
 
 class JBoxCloudSQL(JBPluginDB):
     provides = [JBPluginDB.JBP_DB, JBPluginDB.JBP_DB_CLOUDSQL]
 
-    threadlocal = threading.local()
     USER = None
     PASSWD = None
     UNIX_SOCKET = None
     DB = None
+    SCAN_PAGE_SIZE = 1000
 
     @staticmethod
     def configure():
@@ -196,35 +411,81 @@ class JBoxCloudSQL(JBPluginDB):
             JBoxCloudSQL.PASSWD = dbconf['passwd']
             JBoxCloudSQL.UNIX_SOCKET = dbconf['unix_socket']
             JBoxCloudSQL.DB = dbconf['db']
+            JBoxCloudSQL.SCAN_PAGE_SIZE = dbconf.get('scan_page_size', JBoxCloudSQL.SCAN_PAGE_SIZE)
+            JBoxMySQLPool.configure(dbconf)
 
     @staticmethod
-    def conn(reconnect=False):
-        c = getattr(JBoxCloudSQL.threadlocal, 'cloudsql_conn', None)
-        if c is None or reconnect:
-            JBoxCloudSQL.log_debug("connecting with %s", JBoxCloudSQL.USER)
-            JBoxCloudSQL.threadlocal.cloudsql_conn = c = MySQLdb.connect(
-                user=JBoxCloudSQL.USER, passwd=JBoxCloudSQL.PASSWD,
-                unix_socket=JBoxCloudSQL.UNIX_SOCKET, db=JBoxCloudSQL.DB)
-            c.autocommit(True)
-            c.set_character_set('utf8')
-            cur = c.cursor()
-            cur.execute('SET NAMES utf8;')
-            cur.execute('SET CHARACTER SET utf8;')
-            cur.execute('SET character_set_connection=utf8;')
+    def connect():
+        JBoxCloudSQL.log_debug("connecting with %s", JBoxCloudSQL.USER)
+        c = MySQLdb.connect(
+            user=JBoxCloudSQL.USER, passwd=JBoxCloudSQL.PASSWD,
+            unix_socket=JBoxCloudSQL.UNIX_SOCKET, db=JBoxCloudSQL.DB)
+        c.autocommit(True)
+        c.set_character_set('utf8')
+        cur = c.cursor()
+        cur.execute('SET NAMES utf8;')
+        cur.execute('SET CHARACTER SET utf8;')
+        cur.execute('SET character_set_connection=utf8;')
+        cur.close()
         return c
 
+    @staticmethod
+    def _run(fn):
+        """ Call `fn(connection)` with a pooled connection. Retried once with another connection if it fails. """
+        for attempt in (1, 2):
+            pooled = JBoxMySQLPool.checkout()
+            try:
+                result = fn(pooled[0])
+            except (AttributeError, MySQLdb.OperationalError):
+                JBoxMySQLPool.checkin(pooled, broken=True)
+                if attempt == 2:
+                    raise
+                continue
+            except:
+                JBoxMySQLPool.checkin(pooled)
+                raise
+            JBoxMySQLPool.checkin(pooled)
+            return result
+
     @staticmethod
     def execute(sql, params=None):
-        try:
-            cursor = JBoxCloudSQL.conn().cursor()
-            cursor.execute(sql, params)
-        except (AttributeError, MySQLdb.OperationalError):
-            cursor = JBoxCloudSQL.conn(reconnect=True).cursor()
-            cursor.execute(sql, params)
-        return cursor
+        """ Run a statement. Returns the rows and the description of the columns of its result. """
+        def _execute(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                # read everything off the cursor before the connection is checked in
+                return cursor.fetchall(), cursor.description
+            finally:
+                cursor.close()
+        return JBoxCloudSQL._run(_execute)
+
+    @staticmethod
+    def execute_batch(stmts):
+        """ Run statements, as (sql, params) tuples, in a single transaction. """
+        if len(stmts) == 1:
+            JBoxCloudSQL.execute(*stmts[0])
+            return
+
+        def _execute_batch(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute('start transaction')
+                for (sql, params) in stmts:
+                    cursor.execute(sql, params)
+                cursor.execute('commit')
+            except MySQLdb.OperationalError:
+                # the connection is discarded, which rolls back the transaction
+                raise
+            except:
+                cursor.execute('rollback')
+                raise
+            finally:
+                cursor.close()
+        JBoxCloudSQL._run(_execute_batch)
 
     @staticmethod
-    def table_open(tablename):
+    def table_open(tablename, indexes=None):
         return JBoxMySQLTable(tablename)
 
     @staticmethod
@@ -239,6 +500,10 @@ class JBoxCloudSQL(JBPluginDB):
     def record_scan(table, **kwargs):
         return table.scan(**kwargs)
 
+    @staticmethod
+    def record_scan_page(table, page_size=None, start_key=None, **kwargs):
+        return table.scan_page(page_size=page_size, start_key=start_key, **kwargs)
+
     @staticmethod
     def record_query(table, **kwargs):
         return table.scan(**kwargs)
@@ -251,6 +516,26 @@ class JBoxCloudSQL(JBPluginDB):
     def record_save(table, record):
         table.update(record)
 
+    @staticmethod
+    def record_upsert(table, keys, values):
+        table.upsert(keys, values)
+
     @staticmethod
     def record_delete(table, record):
         table.delete(record)
+
+    @staticmethod
+    def record_batch_create(table, records):
+        JBoxCloudSQL.execute_batch([stmt for record in records for stmt in table._insert_stmts(record)])
+
+    @staticmethod
+    def record_batch_save(table, records):
+        JBoxCloudSQL.execute_batch([stmt for record in records for stmt in table._update_stmts(record)])
+
+    @staticmethod
+    def record_batch_upsert(table, records):
+        JBoxCloudSQL.execute_batch([stmt for (keys, values) in records for stmt in table._upsert_stmts(keys, values)])
+
+    @staticmethod
+    def record_batch_delete(table, records):
+        JBoxCloudSQL.execute_batch([stmt for record in records for stmt in table._delete_stmts(record)])
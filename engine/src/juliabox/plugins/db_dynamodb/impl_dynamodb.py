@@ -1,20 +1,31 @@
 __author__ = 'tan'
 
+import time
+
 from boto.dynamodb2.exceptions import ItemNotFound
 from boto.dynamodb2.table import Table
 
 from juliabox.db import JBPluginDB, JBoxDBItemNotFound
+from juliabox.jbox_util import JBoxCfg
 
 
 class JBoxDynamoDB(JBPluginDB):
     provides = [JBPluginDB.JBP_DB, JBPluginDB.JBP_DB_DYNAMODB]
 
+    # DynamoDB accepts at most 25 items in a batch write
+    MAX_BATCH = 25
+    BATCH_RETRIES = 5
+    BATCH_BACKOFF_SECS = 0.1
+    SCAN_PAGE_SIZE = 1000
+
     @staticmethod
     def configure():
-        pass
+        dbconf = JBoxCfg.get("db", dict())
+        JBoxDynamoDB.BATCH_RETRIES = dbconf.get('batch_retries', JBoxDynamoDB.BATCH_RETRIES)
+        JBoxDynamoDB.SCAN_PAGE_SIZE = dbconf.get('scan_page_size', JBoxDynamoDB.SCAN_PAGE_SIZE)
 
     @staticmethod
-    def table_open(tablename):
+    def table_open(tablename, indexes=None):
         return Table(tablename)
 
     @staticmethod
@@ -30,8 +41,19 @@ class JBoxDynamoDB(JBPluginDB):
             raise JBoxDBItemNotFound()
 
     @staticmethod
-    def record_scan(table, **kwargs):
-        return table.scan(**kwargs)
+    def record_scan(table, max_page_size=None, **kwargs):
+        # the result set reads the next page when the records read so far have been iterated over
+        if max_page_size is None:
+            max_page_size = JBoxDynamoDB.SCAN_PAGE_SIZE
+        return table.scan(max_page_size=max_page_size, **kwargs)
+
+    @staticmethod
+    def record_scan_page(table, page_size=None, start_key=None, **kwargs):
+        # a page holds the matching records among the next `page_size` records read. it may be empty.
+        if page_size is None:
+            page_size = JBoxDynamoDB.SCAN_PAGE_SIZE
+        page = table._scan(limit=page_size, exclusive_start_key=start_key, **kwargs)
+        return page['results'], page['last_key']
 
     @staticmethod
     def record_query(table, **kwargs):
@@ -46,7 +68,62 @@ class JBoxDynamoDB(JBPluginDB):
         if table is not None:
             record.save()
 
+    @staticmethod
+    def record_upsert(table, keys, values):
+        updates = dict()
+        for (name, value) in values.iteritems():
+            if value is None:
+                updates[name] = {'Action': 'DELETE'}
+            else:
+                updates[name] = {'Action': 'PUT', 'Value': table._dynamizer.encode(value)}
+        table.connection.update_item(table.table_name, table._encode_keys(keys), attribute_updates=updates)
+
     @staticmethod
     def record_delete(table, record):
         if table is not None:
-            record.delete()
\ No newline at end of file
+            record.delete()
+
+    @staticmethod
+    def _batch_write(table, requests):
+        for idx in range(0, len(requests), JBoxDynamoDB.MAX_BATCH):
+            pending = {table.table_name: requests[idx:(idx + JBoxDynamoDB.MAX_BATCH)]}
+            attempt = 0
+            while True:
+                resp = table.connection.batch_write_item(pending)
+                pending = resp.get('UnprocessedItems', None)
+                if not pending:
+                    break
+                if attempt >= JBoxDynamoDB.BATCH_RETRIES:
+                    raise Exception("Error writing batch. %d items not processed." %
+                                    (len(pending.get(table.table_name, [])),))
+                # items are left unprocessed when throughput is exceeded
+                time.sleep(JBoxDynamoDB.BATCH_BACKOFF_SECS * (2 ** attempt))
+                attempt += 1
+
+    @staticmethod
+    def _encode(table, data):
+        return table._encode_keys(dict((n, v) for (n, v) in data.items() if v is not None))
+
+    @staticmethod
+    def record_batch_create(table, records):
+        JBoxDynamoDB._batch_write(table, [{'PutRequest': {'Item': JBoxDynamoDB._encode(table, data)}}
+                                          for data in records])
+
+    @staticmethod
+    def record_batch_save(table, records):
+        # records are items fetched earlier, which are overwritten in full
+        JBoxDynamoDB._batch_write(table, [{'PutRequest': {'Item': JBoxDynamoDB._encode(table, record)}}
+                                          for record in records])
+
+    @staticmethod
+    def record_batch_upsert(table, records):
+        # batch writes can not update items partially
+        for (keys, values) in records:
+            JBoxDynamoDB.record_upsert(table, keys, values)
+
+    @staticmethod
+    def record_batch_delete(table, records):
+        key_fields = table.get_key_fields()
+        JBoxDynamoDB._batch_write(table, [{'DeleteRequest': {
+            'Key': table._encode_keys(dict((n, record[n]) for n in key_fields))
+        }} for record in records])
\ No newline at end of file
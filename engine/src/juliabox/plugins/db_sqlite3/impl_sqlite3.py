@@ -1,5 +1,6 @@
 __author__ = 'tan'
 
+import time
 import threading
 import sqlite3
 import decimal
@@ -20,7 +21,7 @@ class JBoxSQLiteTable(LoggerMixin):
         'between': (' between ? and ?', lambda x: x)
     }
 
-    def __init__(self, table_name):
+    def __init__(self, table_name, indexes=None):
         self.name = table_name
         c = JBoxSQLite3.conn().cursor()
         pragma_sql = 'pragma table_info("%s")' % (table_name,)
@@ -39,18 +40,22 @@ class JBoxSQLiteTable(LoggerMixin):
         c.close()
         self.columns = columns
         self.pk = pk
+        # statements by query shape. the same text is used for all queries of a shape, which lets sqlite reuse the
+        # statement prepared the first time from its statement cache.
+        self.stmts = {}
+        self.indexes = self._create_indexes(indexes)
         self.insert_statement = "insert into " + table_name + \
                                 " (" + ", ".join(self.columns) + ")" + \
                                 " values (" + ", ".join(['?'] * len(self.columns)) + ")"
 
-    def insert(self, record):
+    def _insert_stmts(self, record):
         values = []
         for colname in self.columns:
             values.append(record[colname] if colname in record else None)
-        c = JBoxSQLite3.conn().cursor()
-        c.execute(self.insert_statement, tuple(values))
-        c.close()
-        self.commit()
+        return [(self.insert_statement, tuple(values))]
+
+    def insert(self, record):
+        self._execute(self._insert_stmts(record))
 
     @staticmethod
     def _op(name, opstr, value, names, values):
@@ -62,50 +67,154 @@ class JBoxSQLiteTable(LoggerMixin):
         else:
             values.append(vals)
 
-    def _select(self, count, **kwargs):
-        names = []
-        values = []
+    def _create_indexes(self, indexes):
+        """ Creates declared indexes that do not exist yet. Returns names of indexes of the table. """
+        if indexes is not None:
+            stmts = []
+            for idx in indexes:
+                cols = ', '.join(['"%s"' % (col,) for col in idx['cols']])
+                stmts.append(('create index if not exists "%s" on %s (%s)' % (idx['name'], self.name, cols), ()))
+            self._execute(stmts)
+
+        c = JBoxSQLite3.conn().cursor()
+        c.execute('pragma index_list("%s")' % (self.name,))
+        pragma_cols = [spec[0] for spec in c.description]
+        names = set([dict(zip(pragma_cols, row))['name'] for row in c.fetchall()])
+        c.close()
+        self.log_info("%s has indexes %r", self.name, sorted(names))
+        return names
+
+    def _check_plan(self, stmt, values):
+        """ Reports queries that scan the whole table. Raises sqlite3.OperationalError if an index hint can not be
+        used for the query.
+        """
+        c = JBoxSQLite3.conn().cursor()
+        try:
+            c.execute('explain query plan ' + stmt, values)
+            plan = [row[-1] for row in c.fetchall()]
+        finally:
+            c.close()
+        # a scan without an index is reported as "SCAN TABLE <name>" (or "SCAN <name>" from sqlite 3.36). a scan in
+        # the order of the primary key walks all of its index: "SCAN <name> USING INDEX sqlite_autoindex_<name>_1".
+        scans = [step for step in plan if step.startswith('SCAN') and
+                 (('USING' not in step) or ('sqlite_autoindex_' in step))]
+        if len(scans) > 0:
+            JBoxSQLite3.TABLE_SCANS[stmt] = scans
+            self.log_warn("query scans the whole table: [%s] plan: %r", stmt, plan)
+        else:
+            self.log_debug("query plan: [%s] %r", stmt, plan)
+
+    def _columns(self, attributes):
+        """ Columns to select for a projection to `attributes`. Keys are always selected. """
+        if attributes is None:
+            return self.columns
+        return [col for col in self.columns if (col in self.pk) or (col in attributes)]
+
+    def _after(self, start_key, names, values):
+        """ Adds a condition that selects records after `start_key`, in the order of the primary key. """
+        terms = []
+        for idx in range(len(self.pk)):
+            terms.append(' and '.join(['%s = ?' % (col,) for col in self.pk[:idx]] + ['%s > ?' % (self.pk[idx],)]))
+            values.extend([start_key[col] for col in self.pk[:(idx + 1)]])
+        names.append('(' + ' or '.join(['(' + term + ')' for term in terms]) + ')')
+
+    def _select(self, count, attributes=None, start_key=None, page_size=None, **kwargs):
+        conditions = []
         for (n, v) in kwargs.iteritems():
             ncomps = n.split('__')
             colname = ncomps[0]
             if colname not in self.columns:
                 continue
             op = ncomps[1] if len(ncomps) > 1 else "eq"
-            JBoxSQLiteTable._op(colname, op, v, names, values)
+            conditions.append((colname, op, v))
+        conditions.sort(key=lambda cond: cond[:2])
 
-        selattribs = 'count(*)' if count else '*'
-        if len(names) > 0:
-            criteria = ' where ' + ' and '.join(names)
-        else:
-            criteria = ''
-        stmt = 'select %s from %s%s' % (selattribs, self.name, criteria)
+        names = []
+        values = []
+        for (colname, op, v) in conditions:
+            JBoxSQLiteTable._op(colname, op, v, names, values)
+        if start_key is not None:
+            self._after(start_key, names, values)
+        if page_size is not None:
+            values.append(page_size)
+
+        columns = self._columns(attributes)
+        index = kwargs.get('index', None)
+        if index not in self.indexes:
+            index = None
+        shape = ('select', count, index, tuple(columns), start_key is not None, page_size is not None) + \
+            tuple([cond[:2] for cond in conditions])
+        stmt = self.stmts.get(shape)
+        if stmt is None:
+            selattribs = 'count(*)' if count else ', '.join(columns)
+            if len(names) > 0:
+                criteria = ' where ' + ' and '.join(names)
+            else:
+                criteria = ''
+            if page_size is not None:
+                criteria += ' order by ' + ', '.join(self.pk) + ' limit ?'
+            stmt = 'select %s from %s%s%s' % (selattribs, self.name,
+                                              '' if index is None else (' indexed by "%s"' % (index,)), criteria)
+            try:
+                self._check_plan(stmt, tuple(values))
+            except sqlite3.OperationalError:
+                if index is None:
+                    raise
+                self.log_warn("index %s can not be used for [%s]. querying without it.", index, stmt)
+                stmt = 'select %s from %s%s' % (selattribs, self.name, criteria)
+                self._check_plan(stmt, tuple(values))
+            self.stmts[shape] = stmt
 
         c = JBoxSQLite3.conn().cursor()
         c.execute(stmt, tuple(values))
-        return c
+        return c, columns
 
     def select(self, **kwargs):
-        c = self._select(False, **kwargs)
+        c, columns = self._select(False, **kwargs)
         row = c.fetchone()
         if row is None:
             raise JBoxDBItemNotFound()
 
-        item = dict(zip(self.columns, row))
+        item = dict(zip(columns, row))
         c.close()
         return item
 
-    def scan(self, **kwargs):
-        c = self._select(False, **kwargs)
-        return (dict(zip(self.columns, row)) for row in c)
+    def query(self, **kwargs):
+        c, columns = self._select(False, **kwargs)
+        return (dict(zip(columns, row)) for row in c)
+
+    def scan_page(self, page_size=None, start_key=None, **kwargs):
+        """ Returns up to `page_size` records after `start_key`, in the order of the primary key, and the key to
+        continue from (None after the last page).
+        """
+        if page_size is None:
+            page_size = JBoxSQLite3.SCAN_PAGE_SIZE
+        c, columns = self._select(False, start_key=start_key, page_size=page_size, **kwargs)
+        records = [dict(zip(columns, row)) for row in c.fetchall()]
+        c.close()
+        if len(records) < page_size:
+            return records, None
+        return records, dict((col, records[-1][col]) for col in self.pk)
+
+    def scan(self, max_page_size=None, **kwargs):
+        # read a page at a time, so that a long scan neither holds all records in memory nor keeps a read
+        # transaction open (which would keep the WAL from being checkpointed)
+        start_key = None
+        while True:
+            records, start_key = self.scan_page(page_size=max_page_size, start_key=start_key, **kwargs)
+            for record in records:
+                yield record
+            if start_key is None:
+                break
 
     def count(self, **kwargs):
-        c = self._select(True, **kwargs)
+        c, _columns = self._select(True, **kwargs)
         row = c.fetchone()
         if row is None:
             return 0
         return row[0]
 
-    def delete(self, record):
+    def _delete_stmts(self, record):
         names = []
         values = []
         for keyname in self.pk:
@@ -119,14 +228,12 @@ class JBoxSQLiteTable(LoggerMixin):
             raise JBoxDBItemNotFound()
         criteria = ' where ' + ' and '.join(names)
         stmt = "delete from %s%s" % (self.name, criteria)
+        return [(stmt, tuple(values))]
 
-        c = JBoxSQLite3.conn().cursor()
-        # self.log_debug("SQL: %s", stmt)
-        c.execute(stmt, tuple(values))
-        c.close()
-        self.commit()
+    def delete(self, record):
+        self._execute(self._delete_stmts(record))
 
-    def update(self, record):
+    def _update_stmts(self, record):
         keynames = []
         updates = []
         values = []
@@ -151,11 +258,66 @@ class JBoxSQLiteTable(LoggerMixin):
         criteria = ' where ' + ' and '.join(keynames)
 
         stmt = "update %s set %s%s" % (self.name, updatecols, criteria)
+        return [(stmt, tuple(values))]
 
-        c = JBoxSQLite3.conn().cursor()
-        # self.log_debug("SQL: %s", stmt)
-        c.execute(stmt, tuple(values))
-        c.close()
+    def update(self, record):
+        self._execute(self._update_stmts(record))
+
+    def _upsert_stmts(self, keys, values):
+        if len(keys) != len(self.pk):
+            raise JBoxDBItemNotFound()
+        record = dict(keys)
+        record.update(values)
+        cols = [colname for colname in self.columns if colname in record]
+        colvals = tuple([record[colname] for colname in cols])
+        updatecols = [colname for colname in cols if colname not in self.pk]
+
+        stmt = "insert into %s (%s) values (%s)" % (self.name, ", ".join(cols), ", ".join(['?'] * len(cols)))
+        if JBoxSQLite3.HAS_UPSERT:
+            shape = ('upsert',) + tuple(cols)
+            upsert_stmt = self.stmts.get(shape)
+            if upsert_stmt is None:
+                if len(updatecols) > 0:
+                    upsert_stmt = stmt + " on conflict (%s) do update set %s" % (
+                        ", ".join(self.pk),
+                        ', '.join(["%s = excluded.%s" % (colname, colname) for colname in updatecols]))
+                else:
+                    upsert_stmt = stmt + " on conflict do nothing"
+                self.stmts[shape] = upsert_stmt
+            return [(upsert_stmt, colvals)]
+
+        # older sqlite: insert if absent and update, in the same transaction
+        stmts = [(stmt.replace("insert into", "insert or ignore into", 1), colvals)]
+        if len(updatecols) > 0:
+            stmt = "update %s set %s where %s" % (self.name,
+                                                  ', '.join(["%s = ?" % (colname,) for colname in updatecols]),
+                                                  ' and '.join(["%s = ?" % (keyname,) for keyname in self.pk]))
+            stmts.append((stmt, tuple([record[colname] for colname in updatecols] +
+                                      [record[keyname] for keyname in self.pk])))
+        return stmts
+
+    def upsert(self, keys, values):
+        self._execute(self._upsert_stmts(keys, values))
+
+    def batch(self, stmts):
+        """ Run statements of many writes (as returned by `_*_stmts` methods) in a single transaction. """
+        self._execute(stmts)
+
+    def _execute(self, stmts):
+        if JBoxSQLiteWriter.enabled():
+            JBoxSQLiteWriter.write(stmts)
+            return
+        conn = JBoxSQLite3.conn()
+        c = conn.cursor()
+        try:
+            for (stmt, values) in stmts:
+                # self.log_debug("SQL: %s", stmt)
+                c.execute(stmt, values)
+        except:
+            conn.rollback()
+            raise
+        finally:
+            c.close()
         self.commit()
 
     @staticmethod
@@ -163,11 +325,105 @@ class JBoxSQLiteTable(LoggerMixin):
         JBoxSQLite3.conn().commit()
 
 
+class JBoxSQLiteWriter(LoggerMixin):
+    """ Writes to a file backed database, from a single thread with its own connection.
+
+    A write is queued as the list of statements it is made of, and the thread that queued it waits till it is
+    committed. Writes queued within `GROUP_COMMIT_SECS` of each other are committed in one transaction, which costs a
+    single fsync. Each write runs within a savepoint, so a write that fails is rolled back without affecting others
+    in the group. With the database in WAL mode, readers on other connections are not blocked by the writer.
+    """
+    GROUP_COMMIT_SECS = 0.005
+
+    LOCK = threading.Condition()
+    # list of [statements, done event, exception]
+    QUEUE = []
+    THREAD = None
+
+    @staticmethod
+    def enabled():
+        return JBoxSQLiteWriter.THREAD is not None
+
+    @staticmethod
+    def start():
+        if JBoxSQLiteWriter.THREAD is not None:
+            return
+        JBoxSQLiteWriter.THREAD = threading.Thread(target=JBoxSQLiteWriter._write_periodically,
+                                                   name='sqlite_writer')
+        JBoxSQLiteWriter.THREAD.daemon = True
+        JBoxSQLiteWriter.THREAD.start()
+
+    @staticmethod
+    def write(stmts):
+        op = [stmts, threading.Event(), None]
+        with JBoxSQLiteWriter.LOCK:
+            JBoxSQLiteWriter.QUEUE.append(op)
+            JBoxSQLiteWriter.LOCK.notify()
+        op[1].wait()
+        if op[2] is not None:
+            raise op[2]
+
+    @staticmethod
+    def _write_periodically():
+        # transactions are managed explicitly
+        conn = JBoxSQLite3.connect(isolation_level=None)
+        while True:
+            with JBoxSQLiteWriter.LOCK:
+                while len(JBoxSQLiteWriter.QUEUE) == 0:
+                    JBoxSQLiteWriter.LOCK.wait()
+            # let more writes gather, to be committed together
+            time.sleep(JBoxSQLiteWriter.GROUP_COMMIT_SECS)
+            with JBoxSQLiteWriter.LOCK:
+                ops = JBoxSQLiteWriter.QUEUE
+                JBoxSQLiteWriter.QUEUE = []
+            JBoxSQLiteWriter._commit(conn, ops)
+
+    @staticmethod
+    def _commit(conn, ops):
+        c = conn.cursor()
+        try:
+            c.execute('begin immediate')
+            for op in ops:
+                c.execute('savepoint write')
+                try:
+                    for (stmt, values) in op[0]:
+                        c.execute(stmt, values)
+                except Exception as ex:
+                    op[2] = ex
+                    c.execute('rollback to write')
+                c.execute('release write')
+            c.execute('commit')
+        except Exception as ex:
+            JBoxSQLiteWriter.log_exception("Exception committing %d writes", len(ops))
+            try:
+                c.execute('rollback')
+            except sqlite3.Error:
+                pass
+            for op in ops:
+                if op[2] is None:
+                    op[2] = ex
+        finally:
+            c.close()
+            for op in ops:
+                op[1].set()
+
+
 class JBoxSQLite3(JBPluginDB):
     provides = [JBPluginDB.JBP_DB, JBPluginDB.JBP_DB_RDBMS]
 
     threadlocal = threading.local()
     CONNECT_STR = ":memory:" # default to an in-memory database
+    WAL = True
+    # with WAL, fsync at checkpoints only. committed transactions survive a crash of the process, but the latest may
+    # be lost with a crash of the host.
+    SYNCHRONOUS = 'normal'
+    BUSY_TIMEOUT_SECS = 10
+    STATEMENT_CACHE = 200
+    SCAN_PAGE_SIZE = 1000
+    # statement -> steps of its query plan that scan a whole table
+    TABLE_SCANS = {}
+    # "insert ... on conflict do update" is supported from sqlite 3.24
+    HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
 
     @staticmethod
     def configure():
@@ -185,20 +441,45 @@ class JBoxSQLite3(JBPluginDB):
 
         dbconf = JBoxCfg.get("db")
         JBoxSQLite3.log_debug("db_conf: %r", dbconf)
-        if dbconf is not None and 'connect_str' in dbconf:
-            JBoxSQLite3.CONNECT_STR = dbconf['connect_str']
+        if dbconf is None:
+            dbconf = dict()
+        JBoxSQLite3.CONNECT_STR = dbconf.get('connect_str', JBoxSQLite3.CONNECT_STR)
+        JBoxSQLite3.WAL = dbconf.get('sqlite_wal', JBoxSQLite3.WAL)
+        JBoxSQLite3.SYNCHRONOUS = dbconf.get('sqlite_synchronous', JBoxSQLite3.SYNCHRONOUS)
+        JBoxSQLite3.BUSY_TIMEOUT_SECS = dbconf.get('sqlite_busy_timeout_secs', JBoxSQLite3.BUSY_TIMEOUT_SECS)
+        JBoxSQLite3.STATEMENT_CACHE = dbconf.get('sqlite_statement_cache', JBoxSQLite3.STATEMENT_CACHE)
+        JBoxSQLite3.SCAN_PAGE_SIZE = dbconf.get('scan_page_size', JBoxSQLite3.SCAN_PAGE_SIZE)
+        JBoxSQLiteWriter.GROUP_COMMIT_SECS = dbconf.get('sqlite_group_commit_secs', JBoxSQLiteWriter.GROUP_COMMIT_SECS)
+
+        # an in-memory database is private to its connection, and must be written to from the thread that reads it
+        if JBoxSQLite3.CONNECT_STR != ":memory:":
+            if JBoxSQLite3.WAL:
+                conn = JBoxSQLite3.connect()
+                mode = conn.execute('pragma journal_mode=wal').fetchone()[0]
+                conn.close()
+                JBoxSQLite3.log_info("sqlite journal mode: %s", mode)
+            if JBoxSQLiteWriter.GROUP_COMMIT_SECS is not None:
+                JBoxSQLiteWriter.start()
+
+    @staticmethod
+    def connect(isolation_level=''):
+        JBoxSQLite3.log_debug("connecting with %s", JBoxSQLite3.CONNECT_STR)
+        c = sqlite3.connect(JBoxSQLite3.CONNECT_STR, timeout=JBoxSQLite3.BUSY_TIMEOUT_SECS,
+                            isolation_level=isolation_level, cached_statements=JBoxSQLite3.STATEMENT_CACHE)
+        if JBoxSQLite3.WAL:
+            c.execute('pragma synchronous=' + JBoxSQLite3.SYNCHRONOUS)
+        return c
 
     @staticmethod
     def conn():
         c = getattr(JBoxSQLite3.threadlocal, 'sqlite_conn', None)
         if c is None:
-            JBoxSQLite3.log_debug("connecting with %s", JBoxSQLite3.CONNECT_STR)
-            JBoxSQLite3.threadlocal.sqlite_conn = c = sqlite3.connect(JBoxSQLite3.CONNECT_STR)
+            JBoxSQLite3.threadlocal.sqlite_conn = c = JBoxSQLite3.connect()
         return c
 
     @staticmethod
-    def table_open(tablename):
-        return JBoxSQLiteTable(tablename)
+    def table_open(tablename, indexes=None):
+        return JBoxSQLiteTable(tablename, indexes)
 
     @staticmethod
     def record_create(table, data):
@@ -212,9 +493,13 @@ class JBoxSQLite3(JBPluginDB):
     def record_scan(table, **kwargs):
         return table.scan(**kwargs)
 
+    @staticmethod
+    def record_scan_page(table, page_size=None, start_key=None, **kwargs):
+        return table.scan_page(page_size=page_size, start_key=start_key, **kwargs)
+
     @staticmethod
     def record_query(table, **kwargs):
-        return table.scan(**kwargs)
+        return table.query(**kwargs)
 
     @staticmethod
     def record_count(table, **kwargs):
@@ -224,6 +509,26 @@ class JBoxSQLite3(JBPluginDB):
     def record_save(table, record):
         table.update(record)
 
+    @staticmethod
+    def record_upsert(table, keys, values):
+        table.upsert(keys, values)
+
     @staticmethod
     def record_delete(table, record):
-        table.delete(record)
\ No newline at end of file
+        table.delete(record)
+
+    @staticmethod
+    def record_batch_create(table, records):
+        table.batch([stmt for record in records for stmt in table._insert_stmts(record)])
+
+    @staticmethod
+    def record_batch_save(table, records):
+        table.batch([stmt for record in records for stmt in table._update_stmts(record)])
+
+    @staticmethod
+    def record_batch_upsert(table, records):
+        table.batch([stmt for (keys, values) in records for stmt in table._upsert_stmts(keys, values)])
+
+    @staticmethod
+    def record_batch_delete(table, records):
+        table.batch([stmt for record in records for stmt in table._delete_stmts(record)])
\ No newline at end of file
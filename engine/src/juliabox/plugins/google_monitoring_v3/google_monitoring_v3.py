@@ -6,7 +6,7 @@ import time
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from juliabox.cloud import JBPluginCloud
+from juliabox.cloud import JBPluginCloud, MetricsPublisher
 from oauth2client.client import GoogleCredentials
 
 from juliabox.jbox_util import JBoxCfg, retry_on_errors
@@ -22,6 +22,9 @@ class GoogleMonitoringV3(JBPluginCloud):
     ALLOWED_EC2_VALUE_TYPES = ['Percent', 'Count']
     CUSTOM_METRIC_DOMAIN = 'custom.googleapis.com/'
     SELF_STATS = dict()
+    # install_id -> MetricsPublisher. Up to 200 timeseries, with one point each, are accepted in a call.
+    PUBLISHERS = dict()
+    MAX_PUBLISH_BATCH = 200
 
     @staticmethod
     def _connect_google_monitoring():
@@ -100,6 +103,19 @@ class GoogleMonitoringV3(JBPluginCloud):
             else:
                 raise
 
+    @staticmethod
+    def _series_key(ts):
+        return (ts['metric']['type'], tuple(sorted(ts['metric']['labels'].items())))
+
+    @staticmethod
+    def _publisher(install_id):
+        publisher = GoogleMonitoringV3.PUBLISHERS.get(install_id)
+        if publisher is None:
+            publisher = GoogleMonitoringV3.PUBLISHERS[install_id] = MetricsPublisher(
+                'monitoring_publisher', lambda timeseries: GoogleMonitoringV3._timeseries_write(timeseries, install_id),
+                GoogleMonitoringV3.MAX_PUBLISH_BATCH, key=GoogleMonitoringV3._series_key)
+        return publisher
+
     @staticmethod
     def publish_stats_multi(stats, instance_id, this_id, install_id,
                             autoscale_group, zone):
@@ -118,7 +134,7 @@ class GoogleMonitoringV3(JBPluginCloud):
                                                         stat_value, stat_unit,
                                                         timenow, instance_id,
                                                         zone))
-        GoogleMonitoringV3._timeseries_write(timeseries, install_id)
+        GoogleMonitoringV3._publisher(install_id).put(timeseries)
 
     @staticmethod
     def _list_metric(project, metric_name, instance_id, group_id):
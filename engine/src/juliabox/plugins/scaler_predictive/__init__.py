@@ -0,0 +1,3 @@
+__author__ = 'tan'
+
+from impl_predictive import PredictiveScaler
@@ -0,0 +1,215 @@
+import math
+import time
+
+from juliabox.cloud import JBPluginCloud, Compute
+from juliabox.jbox_util import JBoxCfg
+from juliabox.db import JBoxDB, JBoxDynConfig
+
+__author__ = 'tan'
+
+
+class PredictiveScaler(JBPluginCloud):
+    """ Scales the cluster ahead of expected load, using a history of load by hour of the week.
+
+    Cluster demand (average load x number of machines, in percent of a machine) is modelled as a level plus a seasonal
+    component for each hour of the week. The level is an exponentially weighted moving average of demand with the
+    seasonal component removed. The seasonal component of an hour is an exponentially weighted moving average of
+    demand over the level, observed at that hour in past weeks. The container manager of the cluster leader adds a
+    sample to the model every `SAMPLE_SECS` (see `sample`). The model is kept as a stat in `JBoxDynConfig`, shared by
+    all instances and across restarts.
+
+    Machines are added when current demand, or forecast demand within the next `LEAD_HOURS`, needs more machines than
+    are active at `SCALE_UP_AT_LOAD`. One machine is removed at a time, and only when current demand and forecast
+    demand within the next `HOLD_HOURS` fit in fewer machines at `SCALE_DOWN_AT_LOAD`.
+
+    The forecast and the reasons for the decision at the latest sample are published as the `stat_scaler` stat.
+    """
+    provides = [JBPluginCloud.JBP_SCALER, JBPluginCloud.JBP_SCALER_PREDICTIVE]
+
+    NAME = 'predictive'
+    STAT_NAME = 'stat_scaler'
+    HISTORY_STAT_NAME = 'scaler_history'
+    HOURS_IN_WEEK = 7 * 24
+
+    SCALE_UP_AT_LOAD = 80
+    SCALE_DOWN_AT_LOAD = 40
+    LEAD_HOURS = 1
+    HOLD_HOURS = 2
+    MAX_STEP = 4
+    SAMPLE_SECS = 300
+    LEVEL_ALPHA = 0.05
+    SEASON_ALPHA = 0.2
+    # hours with fewer samples than this are forecast at the level
+    MIN_SEASON_SAMPLES = 3
+
+    HISTORY = None
+    HISTORY_READ_AT = 0
+    LAST_DECISION = None
+
+    @staticmethod
+    def configure():
+        cfg = JBoxCfg.get('predictive_scaler', dict())
+        PredictiveScaler.SCALE_UP_AT_LOAD = cfg.get('scale_up_at_load',
+                                                    JBoxCfg.get('cloud_host.scale_up_at_load',
+                                                                PredictiveScaler.SCALE_UP_AT_LOAD))
+        PredictiveScaler.SCALE_DOWN_AT_LOAD = cfg.get('scale_down_at_load', PredictiveScaler.SCALE_DOWN_AT_LOAD)
+        PredictiveScaler.LEAD_HOURS = cfg.get('lead_hours', PredictiveScaler.LEAD_HOURS)
+        PredictiveScaler.HOLD_HOURS = cfg.get('hold_hours', PredictiveScaler.HOLD_HOURS)
+        PredictiveScaler.MAX_STEP = cfg.get('max_step', PredictiveScaler.MAX_STEP)
+        PredictiveScaler.SAMPLE_SECS = cfg.get('sample_secs', PredictiveScaler.SAMPLE_SECS)
+        PredictiveScaler.LEVEL_ALPHA = cfg.get('level_alpha', PredictiveScaler.LEVEL_ALPHA)
+        PredictiveScaler.SEASON_ALPHA = cfg.get('season_alpha', PredictiveScaler.SEASON_ALPHA)
+
+    @staticmethod
+    def get_name():
+        return PredictiveScaler.NAME
+
+    @staticmethod
+    def _hour_of_week(ts):
+        t = time.gmtime(ts)
+        return t.tm_wday * 24 + t.tm_hour
+
+    @staticmethod
+    def _empty_history():
+        return {
+            'level': None,
+            'season': [0.0] * PredictiveScaler.HOURS_IN_WEEK,
+            'samples': [0] * PredictiveScaler.HOURS_IN_WEEK
+        }
+
+    @staticmethod
+    def _history(tnow, fresh=False):
+        # re-read every sample interval to pick up samples added by the cluster leader.
+        # `fresh` reads from the database, bypassing the dynamic configuration cache, before the history is updated.
+        if fresh or (PredictiveScaler.HISTORY is None) or \
+                (tnow - PredictiveScaler.HISTORY_READ_AT >= PredictiveScaler.SAMPLE_SECS):
+            cluster = Compute.get_install_id()
+            if fresh:
+                JBoxDynConfig.invalidate([JBoxDB.qual(cluster, PredictiveScaler.HISTORY_STAT_NAME)])
+            history = JBoxDynConfig.get_stat(cluster, PredictiveScaler.HISTORY_STAT_NAME)
+            PredictiveScaler.HISTORY = history if history is not None else PredictiveScaler._empty_history()
+            PredictiveScaler.HISTORY_READ_AT = tnow
+        return PredictiveScaler.HISTORY
+
+    @staticmethod
+    def record(demand, tnow):
+        """ Add a sample of cluster demand to the model. """
+        history = PredictiveScaler._history(tnow)
+        hour = PredictiveScaler._hour_of_week(tnow)
+        season = history['season'][hour]
+        if history['level'] is None:
+            history['level'] = demand - season
+        else:
+            alpha = PredictiveScaler.LEVEL_ALPHA
+            history['level'] = alpha * (demand - season) + (1 - alpha) * history['level']
+            alpha = PredictiveScaler.SEASON_ALPHA
+            history['season'][hour] = alpha * (demand - history['level']) + (1 - alpha) * season
+            history['samples'][hour] += 1
+        history['sampled_at'] = tnow
+        JBoxDynConfig.set_stat(Compute.get_install_id(), PredictiveScaler.HISTORY_STAT_NAME, history)
+
+    @staticmethod
+    def sample(ctx):
+        """ Add a sample of current cluster demand to the model, and publish the decision for it.
+
+        Called by the cluster leader on every housekeeping run. A run within `SAMPLE_SECS` of the last sample (with
+        some slack, as housekeeping runs at about that interval) is skipped, so that an interval is sampled once even
+        if the leader changes. `ctx` has the current `avg_load` and `num_active_machines` of the cluster.
+        """
+        tnow = time.time()
+        avg_load = ctx.get('avg_load')
+        nmachines = ctx.get('num_active_machines', 0)
+        if (avg_load is None) or (nmachines == 0):
+            return
+
+        # read afresh, to see the latest sample even if taken by another instance
+        history = PredictiveScaler._history(tnow, fresh=True)
+        if tnow - history.get('sampled_at', 0) < PredictiveScaler.SAMPLE_SECS * 0.9:
+            PredictiveScaler.log_debug("Not sampling. Last sample was taken %ds ago.",
+                                       int(tnow - history['sampled_at']))
+            return
+        PredictiveScaler.record(avg_load * nmachines, tnow)
+        _add, _reason, decision = PredictiveScaler._decide(avg_load, nmachines, tnow)
+        JBoxDynConfig.set_stat(Compute.get_install_id(), PredictiveScaler.STAT_NAME, decision)
+
+    @staticmethod
+    def forecast(hours, tnow=None):
+        """ Forecast demand for the current and the next `hours` hours, as a list of (hour start time, demand). """
+        if tnow is None:
+            tnow = time.time()
+        history = PredictiveScaler._history(tnow)
+        hour_start = tnow - (tnow % 3600)
+        result = []
+        for idx in range(hours + 1):
+            ts = hour_start + idx * 3600
+            if history['level'] is None:
+                demand = None
+            else:
+                hour = PredictiveScaler._hour_of_week(ts)
+                demand = history['level']
+                if history['samples'][hour] >= PredictiveScaler.MIN_SEASON_SAMPLES:
+                    demand += history['season'][hour]
+                demand = max(0, demand)
+            result.append((ts, demand))
+        return result
+
+    @staticmethod
+    def _machines_for(demand, load):
+        return int(math.ceil(float(demand) / load))
+
+    @staticmethod
+    def _decide(avg_load, nmachines, tnow):
+        demand = avg_load * nmachines
+        forecast = PredictiveScaler.forecast(max(PredictiveScaler.LEAD_HOURS, PredictiveScaler.HOLD_HOURS), tnow)
+        peak_up = max([demand] + [d for (_ts, d) in forecast[:PredictiveScaler.LEAD_HOURS + 1] if d is not None])
+        need_up = PredictiveScaler._machines_for(peak_up, PredictiveScaler.SCALE_UP_AT_LOAD)
+        if need_up > nmachines:
+            add = min(need_up - nmachines, PredictiveScaler.MAX_STEP)
+            reason = "demand %.0f, peak %.0f forecast within %d hours, needs %d machines at %r%% load" % \
+                     (demand, peak_up, PredictiveScaler.LEAD_HOURS, need_up, PredictiveScaler.SCALE_UP_AT_LOAD)
+        else:
+            peak_down = max([demand] + [d for (_ts, d) in forecast[:PredictiveScaler.HOLD_HOURS + 1]
+                                        if d is not None])
+            need_down = max(1, PredictiveScaler._machines_for(peak_down, PredictiveScaler.SCALE_DOWN_AT_LOAD))
+            if need_down < nmachines:
+                add = -1
+                reason = "demand %.0f, peak %.0f forecast within %d hours, fits %d machines at %r%% load" % \
+                         (demand, peak_down, PredictiveScaler.HOLD_HOURS, need_down,
+                          PredictiveScaler.SCALE_DOWN_AT_LOAD)
+            else:
+                add = 0
+                reason = "demand %.0f, peak %.0f forecast within %d hours, needs %d machines" % \
+                         (demand, peak_up, PredictiveScaler.LEAD_HOURS, need_up)
+
+        decision = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime(tnow)),
+            'average load': avg_load,
+            'active machines': nmachines,
+            'machines to add': add,
+            'reason': reason,
+            'forecast': dict((time.strftime('%a %H:00 UTC', time.gmtime(ts)), d) for (ts, d) in forecast)
+        }
+        return add, reason, decision
+
+    @staticmethod
+    def machines_to_add(ctx):
+        """ Number of machines to add (or remove, if negative) to the cluster.
+
+        `ctx` has the current `avg_load` and `num_active_machines` of the cluster. The model is only read here.
+        Samples are added by `sample`.
+        """
+        tnow = time.time()
+        avg_load = ctx.get('avg_load')
+        nmachines = ctx.get('num_active_machines', 0)
+        if (avg_load is None) or (nmachines == 0):
+            PredictiveScaler.log_debug("No load statistics yet. Not scaling.")
+            return 0
+
+        add, reason, decision = PredictiveScaler._decide(avg_load, nmachines, tnow)
+        PredictiveScaler.LAST_DECISION = decision
+
+        if add != 0:
+            PredictiveScaler.log_info("Scale by %d machines: %s", add, reason)
+        else:
+            PredictiveScaler.log_debug("Not scaling: %s", reason)
+        return add
@@ -46,6 +46,13 @@ class JBoxAccountingV2(JBPluginDB):
     _stats_cache = {}
 
     def __init__(self, container_id, image_id, start_time, stop_time=None):
+        data = JBoxAccountingV2._make_record(container_id, image_id, start_time, stop_time)
+        self.create(data)
+        self.item = self.fetch(stop_date=data['stop_date'], stop_time=data['stop_time'])
+        self.is_new = True
+
+    @staticmethod
+    def _make_record(container_id, image_id, start_time, stop_time=None):
         if None == stop_time:
             stop_datetime = datetime.datetime.now(pytz.utc)
         else:
@@ -61,9 +68,7 @@ class JBoxAccountingV2(JBPluginDB):
             'start_time': JBoxAccountingV2.datetime_to_epoch_secs(start_time),
             'start_date': JBoxAccountingV2.datetime_to_yyyymmdd(start_time)
         }
-        self.create(data)
-        self.item = self.fetch(stop_date=stop_date, stop_time=stop_time)
-        self.is_new = True
+        return data
 
     @staticmethod
     def _query_stats_date(date):
@@ -136,9 +141,8 @@ class JBoxAccountingV2(JBPluginDB):
                 finish_time = time_finished
                 if retry > 1:
                     finish_time += datetime.timedelta(microseconds=random.randint(1, 100))
-                acct = JBoxAccountingV2(container_name, json.dumps(images_used),
-                                        start_time, stop_time=finish_time)
-                acct.save()
+                JBoxAccountingV2.create(JBoxAccountingV2._make_record(container_name, json.dumps(images_used),
+                                                                      start_time, stop_time=finish_time))
                 break
             except:
                 if retry == 10:
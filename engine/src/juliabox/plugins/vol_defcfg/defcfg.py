@@ -1,4 +1,6 @@
 import os
+import threading
+import uuid
 
 from juliabox.jbox_util import ensure_delete, make_sure_path_exists, unique_sessname, JBoxCfg
 from juliabox.vol import JBoxVol
@@ -8,19 +10,27 @@ class JBoxDefaultConfigVol(JBoxVol):
     provides = [JBoxVol.JBP_CONFIG]
 
     FS_LOC = None
+    # config folders unpacked in advance (from PREPARED_IMG), to be moved into place at login
+    PREPARED_LOC = None
+    NUM_PREPARED = 0
+    PREPARED = []
+    PREPARED_IMG = None
+    LOCK = threading.Lock()
 
     @staticmethod
     def configure():
         cfg_location = os.path.expanduser(JBoxCfg.get('cfg_location'))
         make_sure_path_exists(cfg_location)
         JBoxDefaultConfigVol.FS_LOC = cfg_location
+        JBoxDefaultConfigVol.PREPARED_LOC = os.path.join(cfg_location, '.prepared')
+        JBoxDefaultConfigVol.NUM_PREPARED = JBoxCfg.get('numdisksprepared', 5)
 
     @staticmethod
     def _get_config_mounts_used(cid):
         used = []
-        props = JBoxDefaultConfigVol.dckr().inspect_container(cid)
+        mounts = JBoxVol.get_mounts(cid)
         try:
-            for _cpath, hpath in JBoxVol.extract_mounts(props):
+            for _cpath, hpath in mounts:
                 if hpath.startswith(JBoxDefaultConfigVol.FS_LOC):
                     used.append(hpath.split('/')[-1])
         except:
@@ -40,9 +50,61 @@ class JBoxDefaultConfigVol(JBoxVol):
 
         disk_path = os.path.join(JBoxDefaultConfigVol.FS_LOC, unique_sessname(user_email))
         cfgvol = JBoxDefaultConfigVol(disk_path, user_email=user_email)
-        cfgvol._unpack_config()
+        if not cfgvol._use_prepared_config():
+            cfgvol._unpack_config()
         return cfgvol
 
+    @staticmethod
+    def get_blank_disk(sessname):
+        JBoxDefaultConfigVol.log_debug("creating configs disk for %s", sessname)
+        if JBoxDefaultConfigVol.FS_LOC is None:
+            JBoxDefaultConfigVol.configure()
+
+        # config files are not user specific, so the disk can be used as is once the container is claimed
+        disk_path = os.path.join(JBoxDefaultConfigVol.FS_LOC, sessname)
+        cfgvol = JBoxDefaultConfigVol(disk_path, sessname=sessname)
+        if not cfgvol._use_prepared_config():
+            cfgvol._unpack_config()
+        return cfgvol
+
+    @staticmethod
+    def prepare_disks():
+        user_home_img = JBoxVol.USER_HOME_IMG
+        JBoxDefaultConfigVol.LOCK.acquire()
+        try:
+            if JBoxDefaultConfigVol.PREPARED_IMG != user_home_img:
+                if JBoxDefaultConfigVol.PREPARED_IMG is None:
+                    # left over from an earlier run, may be incomplete
+                    if os.path.exists(JBoxDefaultConfigVol.PREPARED_LOC):
+                        ensure_delete(JBoxDefaultConfigVol.PREPARED_LOC, include_itself=True)
+                    make_sure_path_exists(JBoxDefaultConfigVol.PREPARED_LOC)
+                else:
+                    for prepared in JBoxDefaultConfigVol.PREPARED:
+                        ensure_delete(prepared, include_itself=True)
+                JBoxDefaultConfigVol.PREPARED = []
+                JBoxDefaultConfigVol.PREPARED_IMG = user_home_img
+            nprepare = JBoxDefaultConfigVol.NUM_PREPARED - len(JBoxDefaultConfigVol.PREPARED)
+        finally:
+            JBoxDefaultConfigVol.LOCK.release()
+
+        for _idx in range(0, nprepare):
+            cfgvol = JBoxDefaultConfigVol(os.path.join(JBoxDefaultConfigVol.PREPARED_LOC, uuid.uuid4().hex))
+            cfgvol._unpack_config()
+            JBoxDefaultConfigVol.LOCK.acquire()
+            try:
+                current = (JBoxDefaultConfigVol.PREPARED_IMG == user_home_img)
+                if current:
+                    JBoxDefaultConfigVol.PREPARED.append(cfgvol.disk_path)
+            finally:
+                JBoxDefaultConfigVol.LOCK.release()
+            if not current:
+                # user home image changed meanwhile
+                ensure_delete(cfgvol.disk_path, include_itself=True)
+                break
+
+        if nprepare > 0:
+            JBoxDefaultConfigVol.log_info("Config folders prepared: %d", len(JBoxDefaultConfigVol.PREPARED))
+
     @staticmethod
     def is_mount_path(fs_path):
         return fs_path.startswith(JBoxDefaultConfigVol.FS_LOC)
@@ -70,6 +132,23 @@ class JBoxDefaultConfigVol(JBoxVol):
     def disk_ids_used_pct():
         return 0
 
+    def _use_prepared_config(self):
+        JBoxDefaultConfigVol.LOCK.acquire()
+        try:
+            if (JBoxDefaultConfigVol.PREPARED_IMG != JBoxVol.USER_HOME_IMG) or \
+                    (len(JBoxDefaultConfigVol.PREPARED) == 0):
+                return False
+            prepared = JBoxDefaultConfigVol.PREPARED.pop()
+        finally:
+            JBoxDefaultConfigVol.LOCK.release()
+
+        if os.path.exists(self.disk_path):
+            JBoxDefaultConfigVol.log_debug("Config folder exists %s. Deleting...", self.disk_path)
+            ensure_delete(self.disk_path, include_itself=True)
+        os.rename(prepared, self.disk_path)
+        JBoxDefaultConfigVol.log_debug("Moved prepared config folder %s to %s", prepared, self.disk_path)
+        return True
+
     def _unpack_config(self):
         if os.path.exists(self.disk_path):
             JBoxDefaultConfigVol.log_debug("Config folder exists %s. Deleting...", self.disk_path)
@@ -28,9 +28,9 @@ class JBoxDefaultPackagesVol(JBoxVol):
     @staticmethod
     def _get_package_mounts_used(cid):
         used = []
-        props = JBoxDefaultPackagesVol.dckr().inspect_container(cid)
+        mounts = JBoxVol.get_mounts(cid)
         try:
-            for _cpath, hpath in JBoxVol.extract_mounts(props):
+            for _cpath, hpath in mounts:
                 if hpath.startswith(JBoxDefaultPackagesVol.FS_LOC):
                     used.append(hpath.split('/')[-1])
         except:
@@ -44,7 +44,9 @@ class JBoxDefaultPackagesVol(JBoxVol):
         bundles = set()
         try:
             if container_id_list is None:
-                container_id_list = [cdesc['Id'] for cdesc in SessContainer.session_containers(allcontainers=True)]
+                containers = SessContainer.session_containers(allcontainers=True) + \
+                    SessContainer.pool_containers(allcontainers=True)
+                container_id_list = [cdesc['Id'] for cdesc in containers]
 
             for cid in container_id_list:
                 mount_points = JBoxDefaultPackagesVol._get_package_mounts_used(cid)
@@ -58,13 +60,21 @@ class JBoxDefaultPackagesVol(JBoxVol):
     @staticmethod
     def get_disk_for_user(user_email):
         JBoxDefaultPackagesVol.log_debug("creating default packages mounted disk for %s", user_email)
+        return JBoxDefaultPackagesVol._get_current_bundle(user_email=user_email)
+
+    @staticmethod
+    def get_blank_disk(sessname):
+        JBoxDefaultPackagesVol.log_debug("creating default packages mounted disk for %s", sessname)
+        return JBoxDefaultPackagesVol._get_current_bundle(sessname=sessname)
+
+    @staticmethod
+    def _get_current_bundle(user_email=None, sessname=None):
         if JBoxDefaultPackagesVol.FS_LOC is None:
             JBoxDefaultPackagesVol.configure()
         if JBoxDefaultPackagesVol.CURRENT_BUNDLE is None:
             JBoxDefaultPackagesVol.refresh_user_home_image()
         disk_path = os.path.join(JBoxDefaultPackagesVol.FS_LOC, JBoxDefaultPackagesVol.CURRENT_BUNDLE)
-        pkgvol = JBoxDefaultPackagesVol(disk_path, user_email=user_email)
-        return pkgvol
+        return JBoxDefaultPackagesVol(disk_path, user_email=user_email, sessname=sessname)
 
     @staticmethod
     def is_mount_path(fs_path):
@@ -1,7 +1,7 @@
 import os
 import psutil
 
-from juliabox.jbox_util import ensure_delete, JBoxCfg, unique_sessname
+from juliabox.jbox_util import ensure_delete, JBoxCfg, LatencyStats, unique_sessname
 from juliabox.vol import JBoxVol
 
 
@@ -26,8 +26,8 @@ class JBoxHostDiskVol(JBoxVol):
     def _get_disk_ids_used(cid):
         used = []
         try:
-            props = JBoxHostDiskVol.dckr().inspect_container(cid)
-            for _cpath, hpath in JBoxVol.extract_mounts(props):
+            mounts = JBoxVol.get_mounts(cid)
+            for _cpath, hpath in mounts:
                 if hpath.startswith(JBoxHostDiskVol.FS_LOC):
                     used.append(hpath.split('/')[-1])
         except:
@@ -50,16 +50,18 @@ class JBoxHostDiskVol(JBoxVol):
     def get_disk_for_user(user_email):
         JBoxHostDiskVol.log_debug("creating host disk for %s", user_email)
 
-        disk_id = unique_sessname(user_email)
-        disk_path = os.path.join(JBoxHostDiskVol.FS_LOC, disk_id)
-        if not os.path.exists(disk_path):
-            os.mkdir(disk_path)
-        hostvol = JBoxHostDiskVol(disk_path, user_email=user_email)
-        hostvol.refresh_disk()
+        with LatencyStats.timed('launch.disk_reserve'):
+            disk_id = unique_sessname(user_email)
+            disk_path = os.path.join(JBoxHostDiskVol.FS_LOC, disk_id)
+            if not os.path.exists(disk_path):
+                os.mkdir(disk_path)
+            hostvol = JBoxHostDiskVol(disk_path, user_email=user_email)
+            hostvol.refresh_disk()
 
         if JBoxVol.BACKUP_LOC is not None:
             JBoxHostDiskVol.log_debug("restoring data for %s", user_email)
-            hostvol.restore()
+            with LatencyStats.timed('launch.restore'):
+                hostvol.restore()
 
         return hostvol
 
@@ -2,7 +2,7 @@ import os
 import threading
 import time
 
-from juliabox.jbox_util import ensure_delete, JBoxCfg
+from juliabox.jbox_util import ensure_delete, JBoxCfg, LatencyStats
 from juliabox.vol import JBoxVol
 from juliabox.interactive import SessContainer
 
@@ -15,6 +15,8 @@ class JBoxLoopbackVol(JBoxVol):
     MAX_DISKS = 0
     DISK_USE_STATUS = {}
     DISK_RESERVE_TIME = {}
+    # free disks known to be blank, ready to be handed out without having to be wiped first
+    DISKS_BLANK = set()
     LOCK = None
 
     @staticmethod
@@ -34,8 +36,8 @@ class JBoxLoopbackVol(JBoxVol):
     def _get_disk_ids_used(cid):
         used = []
         try:
-            props = JBoxLoopbackVol.dckr().inspect_container(cid)
-            for _cpath, hpath in JBoxVol.extract_mounts(props):
+            mounts = JBoxVol.get_mounts(cid)
+            for _cpath, hpath in mounts:
                 if hpath.startswith(JBoxLoopbackVol.FS_LOC):
                     used.append(int(hpath.split('/')[-1]))
         except:
@@ -56,12 +58,15 @@ class JBoxLoopbackVol(JBoxVol):
                     nfree += 1
 
             if container_id_list is None:
-                container_id_list = [cdesc['Id'] for cdesc in SessContainer.session_containers(allcontainers=True)]
+                containers = SessContainer.session_containers(allcontainers=True) + \
+                    SessContainer.pool_containers(allcontainers=True)
+                container_id_list = [cdesc['Id'] for cdesc in containers]
 
             for cid in container_id_list:
                 disk_ids = JBoxLoopbackVol._get_disk_ids_used(cid)
                 for disk_id in disk_ids:
                     JBoxLoopbackVol._mark_disk_used(disk_id)
+                    JBoxLoopbackVol.DISKS_BLANK.discard(disk_id)
                     nfree -= 1
             JBoxLoopbackVol.log_info("Loopback Disk free: " + str(nfree) + "/" + str(JBoxLoopbackVol.MAX_DISKS))
         finally:
@@ -73,9 +78,9 @@ class JBoxLoopbackVol(JBoxVol):
         return min(100, max(0, pct))
 
     @staticmethod
-    def _get_unused_disk_id(begin_idx=0):
+    def _get_unused_disk_id(begin_idx=0, exclude=()):
         for idx in range(begin_idx, JBoxLoopbackVol.MAX_DISKS):
-            if not JBoxLoopbackVol.DISK_USE_STATUS[idx]:
+            if not JBoxLoopbackVol.DISK_USE_STATUS[idx] and (idx not in exclude):
                 return idx
         return -1
 
@@ -95,37 +100,86 @@ class JBoxLoopbackVol(JBoxVol):
                 del JBoxLoopbackVol.DISK_RESERVE_TIME[idx]
 
     @staticmethod
-    def _reserve_disk_id(begin_idx=0):
+    def _reserve_disk_id(begin_idx=0, blank=None):
+        """ Reserve an unused disk. Blank disks are preferred if `blank` is None, or required/excluded as indicated.
+        Returns the disk id (-1 if none available) and whether the disk is blank.
+        """
         JBoxLoopbackVol.LOCK.acquire()
         try:
-            disk_id = JBoxLoopbackVol._get_unused_disk_id(begin_idx=begin_idx)
+            disk_id = -1
+            if blank is not False:
+                for idx in sorted(JBoxLoopbackVol.DISKS_BLANK):
+                    if (idx >= begin_idx) and not JBoxLoopbackVol.DISK_USE_STATUS.get(idx, True):
+                        disk_id = idx
+                        break
+            if (disk_id < 0) and (blank is not True):
+                exclude = JBoxLoopbackVol.DISKS_BLANK if (blank is False) else ()
+                disk_id = JBoxLoopbackVol._get_unused_disk_id(begin_idx=begin_idx, exclude=exclude)
+            is_blank = disk_id in JBoxLoopbackVol.DISKS_BLANK
             if disk_id >= 0:
+                JBoxLoopbackVol.DISKS_BLANK.discard(disk_id)
                 JBoxLoopbackVol._mark_disk_used(disk_id, for_secs=JBoxLoopbackVol.DISK_RESERVE_SECS)
-            return disk_id
+            return disk_id, is_blank
         finally:
             JBoxLoopbackVol.LOCK.release()
 
     @staticmethod
-    def _unreserve_disk_id(idx):
+    def _unreserve_disk_id(idx, blank=False):
         JBoxLoopbackVol.LOCK.acquire()
         try:
             JBoxLoopbackVol._mark_disk_used(idx, used=False)
+            if blank:
+                JBoxLoopbackVol.DISKS_BLANK.add(idx)
         finally:
             JBoxLoopbackVol.LOCK.release()
 
     @staticmethod
     def get_disk_for_user(user_email):
         JBoxLoopbackVol.log_debug("creating loopback mounted disk for %s", user_email)
-        disk_id = JBoxLoopbackVol._reserve_disk_id()
+        with LatencyStats.timed('launch.disk_reserve'):
+            disk_id, is_blank = JBoxLoopbackVol._reserve_disk_id()
+            if disk_id < 0:
+                raise Exception("No free disk available")
+            disk_path = os.path.join(JBoxLoopbackVol.FS_LOC, str(disk_id))
+            loopvol = JBoxLoopbackVol(disk_path, user_email=user_email)
+            if not is_blank:
+                loopvol.refresh_disk()
+        JBoxLoopbackVol.log_debug("restoring data for %s", user_email)
+        with LatencyStats.timed('launch.restore'):
+            loopvol.restore()
+        return loopvol
+
+    @staticmethod
+    def get_blank_disk(sessname):
+        disk_id, is_blank = JBoxLoopbackVol._reserve_disk_id()
         if disk_id < 0:
-            raise Exception("No free disk available")
+            return None
         disk_path = os.path.join(JBoxLoopbackVol.FS_LOC, str(disk_id))
-        loopvol = JBoxLoopbackVol(disk_path, user_email=user_email)
-        loopvol.refresh_disk()
-        JBoxLoopbackVol.log_debug("restoring data for %s", user_email)
-        loopvol.restore()
+        loopvol = JBoxLoopbackVol(disk_path, sessname=sessname)
+        if not is_blank:
+            loopvol.refresh_disk()
         return loopvol
 
+    @staticmethod
+    def prepare_disks():
+        nprepared = 0
+        while True:
+            disk_id, _is_blank = JBoxLoopbackVol._reserve_disk_id(blank=False)
+            if disk_id < 0:
+                break
+            disk_path = os.path.join(JBoxLoopbackVol.FS_LOC, str(disk_id))
+            try:
+                JBoxLoopbackVol(disk_path).refresh_disk()
+            except:
+                JBoxLoopbackVol.log_exception("error blanking out disk at %s", disk_path)
+                JBoxLoopbackVol._unreserve_disk_id(disk_id)
+                break
+            JBoxLoopbackVol._unreserve_disk_id(disk_id, blank=True)
+            nprepared += 1
+        if nprepared > 0:
+            JBoxLoopbackVol.log_info("Loopback disks blanked: %d. Blank disks: %d", nprepared,
+                                     len(JBoxLoopbackVol.DISKS_BLANK))
+
     @staticmethod
     def is_mount_path(fs_path):
         return fs_path.startswith(JBoxLoopbackVol.FS_LOC)
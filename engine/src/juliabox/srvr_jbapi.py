@@ -5,11 +5,12 @@ import signal
 
 import tornado.web
 import tornado.auth
+import tornado.gen
 from zmq.eventloop import ioloop
 
 from cloud import Compute
 import db
-from db import is_cluster_leader
+from db import is_cluster_leader, JBoxDynConfig
 from jbox_tasks import JBoxAsyncJob
 from jbox_util import LoggerMixin, JBoxCfg
 from api import APIContainer
@@ -27,6 +28,8 @@ class JBoxAPI(LoggerMixin):
 
         JBoxAsyncJob.configure()
         JBoxAsyncJob.init(JBoxAsyncJob.MODE_PUB)
+        JBoxAsyncJob.get().follow_invalidations(JBoxDynConfig.invalidate)
+        JBoxDynConfig.ON_CHANGE = staticmethod(JBoxAsyncJob.async_invalidate_dynconfig)
 
         self.application = tornado.web.Application(handlers=[
             (r"^/", APIInfoHandler),
@@ -58,6 +61,7 @@ class JBoxAPI(LoggerMixin):
         JBoxAPI.log_info("Stopped.")
 
     @staticmethod
+    @tornado.gen.coroutine
     def do_housekeeping():
         is_leader = is_cluster_leader()
         if is_leader:
@@ -65,7 +69,7 @@ class JBoxAPI(LoggerMixin):
             terminating = False
         else:
             try:
-                terminating = JBoxAsyncJob.sync_is_terminating()
+                terminating = yield JBoxAsyncJob.rpc_is_terminating()
                 if terminating['code'] == 0:
                     terminating = terminating['data']
                 else:
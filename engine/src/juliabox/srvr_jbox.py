@@ -5,17 +5,18 @@ import os
 
 import tornado.ioloop
 import tornado.web
+import tornado.gen
 import tornado.auth
 from tornado.httpclient import AsyncHTTPClient
 
-from cloud import Compute, JBPluginCloud
+from cloud import Compute, ClusterView, JBPluginCloud
 import db
 from db import JBoxDynConfig, JBoxUserV2, JBoxInstanceProps, is_cluster_leader, JBPluginDB
 from jbox_tasks import JBoxAsyncJob
 from jbox_util import LoggerMixin, JBoxCfg
 from jbox_tasks import JBPluginTask
 from vol import VolMgr, JBoxVol
-from juliabox.interactive import SessContainer
+from juliabox.interactive import SessContainer, LaunchProgress, SessDeadlines
 from handlers import AdminHandler, MainHandler, PingHandler, CorsHandler
 from handlers import JBPluginHandler, JBPluginUI
 
@@ -32,6 +33,9 @@ class JBox(LoggerMixin):
 
         JBoxAsyncJob.configure()
         JBoxAsyncJob.init(JBoxAsyncJob.MODE_PUB)
+        LaunchProgress.follow()
+        JBoxAsyncJob.get().follow_invalidations(JBoxDynConfig.invalidate)
+        JBoxDynConfig.ON_CHANGE = staticmethod(JBoxAsyncJob.async_invalidate_dynconfig)
 
         self.application = tornado.web.Application(handlers=[
             (r"/", MainHandler),
@@ -50,8 +54,10 @@ class JBox(LoggerMixin):
         self.application.listen(JBoxCfg.get('interactive.manager_port'), address='localhost')
 
         self.ioloop = tornado.ioloop.IOLoop.instance()
+        # sessions are cleaned up as their deadlines fall due
+        SessDeadlines.configure(self.ioloop)
 
-        # run container maintainence every 5 minutes
+        # run container maintainence every 5 minutes, as a safety net for session deadlines
         run_interval = 5 * 60 * 1000
         self.log_info("Container maintenance every " + str(run_interval / (60 * 1000)) + " minutes")
         self.ct = tornado.ioloop.PeriodicCallback(JBox.do_housekeeping, run_interval, self.ioloop)
@@ -74,6 +80,7 @@ class JBox(LoggerMixin):
         return feature_providers
 
     def run(self):
+        ClusterView.start()
         JBox.do_update_user_home_image()
         JBoxAsyncJob.async_refresh_disks()
 
@@ -112,9 +119,16 @@ class JBox(LoggerMixin):
                 JBoxAsyncJob.async_schedule_activations()
 
     @staticmethod
+    @tornado.gen.coroutine
     def update_juliabox_status():
         in_error = len(JBoxInstanceProps.get_stale_instances(Compute.get_install_id()))
-        instance_status = JBoxInstanceProps.get_instance_status(Compute.get_install_id())
+        instance_status, failed = yield JBoxAsyncJob.rpc_cluster_api_status()
+        if len(failed) > 0:
+            # fall back to the last published status of instances that did not respond
+            published = JBoxInstanceProps.get_instance_status(Compute.get_install_id())
+            for iid in failed:
+                if iid in published:
+                    instance_status[iid] = published[iid]
 
         HTML = "<html><body><center><pre>\nJuliaBox is Up.\n\nLast updated: " + datetime.datetime.now().isoformat() + " UTC\n\nLoads: "
         for iid in instance_status:
@@ -135,21 +149,23 @@ class JBox(LoggerMixin):
         else:
             JBox.log_debug("Status: %s", HTML)
 
-        return None
+        return
 
     @staticmethod
+    @tornado.gen.coroutine
     def do_housekeeping():
         terminating = False
         server_delete_timeout = JBoxCfg.get('interactive.expire')
         inactive_timeout = JBoxCfg.get('interactive.inactivity_timeout')
         SessContainer.maintain(max_timeout=server_delete_timeout, inactive_timeout=inactive_timeout)
+        LaunchProgress.purge()
         is_leader = is_cluster_leader()
 
         if is_leader:
             terminating = False
         else:
             try:
-                terminating = JBoxAsyncJob.sync_is_terminating()
+                terminating = yield JBoxAsyncJob.rpc_is_terminating()
                 if terminating['code'] == 0:
                     terminating = terminating['data']
                 else:
@@ -161,7 +177,7 @@ class JBox(LoggerMixin):
 
         if is_leader:
             JBox.log_info("I am the cluster leader")
-            JBox.update_juliabox_status()
+            yield JBox.update_juliabox_status()
             JBox.monitor_registrations()
             if not JBoxDynConfig.is_stat_collected_within(Compute.get_install_id(), 1):
                 JBoxAsyncJob.async_collect_stats()
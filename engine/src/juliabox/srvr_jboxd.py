@@ -6,14 +6,21 @@ import signal
 import sys
 import psutil
 import socket
+import select
+import errno
+import collections
+import heapq
+import itertools
 
 from cloud import JBPluginCloud
-from cloud import Compute
+from cloud import Compute, ClusterView
 import db
 from db import JBoxUserV2, JBoxDynConfig, JBoxSessionProps, JBoxInstanceProps, is_proposed_cluster_leader
 from jbox_tasks import JBoxAsyncJob, JBPluginTask
-from jbox_util import LoggerMixin, JBoxCfg, retry
-from juliabox.interactive import SessContainer
+from jbox_journal import JBoxCmdJournal
+from jbox_perf import JBoxPerfCounters
+from jbox_util import LoggerMixin, JBoxCfg, LatencyStats, retry
+from juliabox.interactive import SessContainer, LaunchProgress
 from api import APIContainer
 from jbox_container import BaseContainer
 from vol import VolMgr
@@ -26,8 +33,6 @@ def jboxd_method(f):
         except:
             JBoxd.log_exception("Exception in jboxd_method %s", f.func_name)
             time.sleep(2)
-        finally:
-            JBoxd.finish_thread()
 
     wrapper.__name__ = 'jboxd_method_' + f.func_name
     return wrapper
@@ -45,6 +50,51 @@ class JBoxd(LoggerMixin):
     ACTIVATION_SENDER = None
     QUEUE = None
 
+    # commands are run by a fixed set of worker threads, with a limit on concurrent commands of each class.
+    # when a worker is free, classes are looked at in the order of priority listed here.
+    WORKER_CLASSES = ('respond', 'launch', 'cleanup', 'maintenance')
+    WORKER_LIMITS = {'respond': 1, 'launch': 10, 'cleanup': 4, 'maintenance': 2}
+    CMD_CLASSES = {
+        JBoxAsyncJob.CMD_REQ_RESP: 'respond',
+        JBoxAsyncJob.CMD_LAUNCH_SESSION: 'launch',
+        JBoxAsyncJob.CMD_BACKUP_CLEANUP: 'cleanup'
+    }
+    WORK_AVAILABLE = threading.Condition(LOCK)
+    PENDING = {}
+    RUNNING = {}
+    WORKERS = []
+
+    # Coalescing rules. A command with a debounce period waits that many seconds before it is run, and the same
+    # command received meanwhile is merged into it. With follow_up set, the same command received while it is running
+    # is merged into a single run after the current one (state may have changed after the current run began).
+    # Other commands received while the same command is queued or running are dropped.
+    COALESCE = {
+        JBoxAsyncJob.CMD_REFRESH_DISKS: {'debounce': 5, 'follow_up': True},
+        JBoxAsyncJob.CMD_COLLECT_STATS: {'debounce': 30, 'follow_up': False},
+        JBoxAsyncJob.CMD_UPDATE_USER_HOME_IMAGE: {'debounce': 10, 'follow_up': True},
+        JBoxAsyncJob.CMD_PREPARE_DISKS: {'debounce': 2, 'follow_up': True},
+        JBoxAsyncJob.CMD_REFILL_POOL: {'debounce': 1, 'follow_up': True},
+        JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG: {'debounce': 0, 'follow_up': True}
+    }
+    # (due time, sequence, worker class, command) of debounced commands
+    DEFERRED = []
+    DEFERRED_SEQ = itertools.count()
+    RUNNING_SIGNS = set()
+    FOLLOW_UP = set()
+
+    # results of calls shared among concurrent callers
+    SHARED = {}
+    SHARED_LOCK = threading.Lock()
+
+    # commands recorded in the journal, to be replayed if lost in a restart.
+    # launches received longer ago than the stale limit are not replayed, as the user would have given up waiting.
+    JOURNALED_CMDS = (JBoxAsyncJob.CMD_BACKUP_CLEANUP, JBoxAsyncJob.CMD_LAUNCH_SESSION)
+    JOURNAL_STALE_SECS = {JBoxAsyncJob.CMD_LAUNCH_SESSION: 180}
+
+    # seconds to wait for container services to come up, and the interval between probes of a port
+    PORT_WAIT_SECS = 10
+    PORT_PROBE_INTERVAL = 0.1
+
     def __init__(self):
         LoggerMixin.configure()
         db.configure()
@@ -58,6 +108,7 @@ class JBoxd(LoggerMixin):
 
         self.log_debug("Container manager listening on ports: %s", repr(JBoxCfg.get('container_manager_ports')))
         JBoxd.QUEUE = JBoxAsyncJob.get()
+        JBoxDynConfig.ON_CHANGE = staticmethod(JBoxd.notify_dynconfig_changed)
 
         JBoxd.MAX_ACTIVATIONS_PER_SEC = JBoxCfg.get('user_activation.max_activations_per_sec')
         JBoxd.MAX_AUTO_ACTIVATIONS_PER_RUN = JBoxCfg.get('user_activation.max_activations_per_run')
@@ -65,34 +116,157 @@ class JBoxd(LoggerMixin):
         JBoxd.ACTIVATION_BODY = JBoxCfg.get('user_activation.mail_body')
         JBoxd.ACTIVATION_SENDER = JBoxCfg.get('user_activation.sender')
 
+        JBoxd.WORKER_LIMITS.update(JBoxCfg.get('jboxd_workers', {}))
+        JBoxCmdJournal.configure()
+        JBoxPerfCounters.configure(JBoxd.sample_perf_counters)
+        JBoxd.start_workers()
+
     @staticmethod
     def is_duplicate(sign):
         return sign in JBoxd.ACTIVE
 
     @staticmethod
-    def schedule_thread(cmd, target, args):
-        sign = json.dumps({'cmd': cmd, 'args': args})
-        JBoxd.log_debug("received command " + sign)
+    def start_workers():
+        for cls in JBoxd.WORKER_CLASSES:
+            JBoxd.PENDING[cls] = collections.deque()
+            JBoxd.RUNNING[cls] = 0
+        for idx in range(sum([JBoxd.WORKER_LIMITS[cls] for cls in JBoxd.WORKER_CLASSES])):
+            t = threading.Thread(target=JBoxd._worker, name='jboxd_worker_' + str(idx))
+            t.daemon = True
+            JBoxd.WORKERS.append(t)
+            t.start()
+        JBoxd.log_info("Started %d workers. Limits: %r", len(JBoxd.WORKERS), JBoxd.WORKER_LIMITS)
 
-        JBoxd.LOCK.acquire()
-        if JBoxd.is_duplicate(sign):
-            JBoxd.log_debug("already processing command " + sign)
-            JBoxd.LOCK.release()
-            return
+    @staticmethod
+    def _enqueue(cls, sign, cmd, target, args):
+        # must be called with LOCK held
+        debounce = JBoxd.COALESCE.get(cmd, {}).get('debounce', 0)
+        if debounce > 0:
+            heapq.heappush(JBoxd.DEFERRED, (time.time() + debounce, next(JBoxd.DEFERRED_SEQ), cls,
+                                            (sign, cmd, target, args)))
+        else:
+            JBoxd.PENDING[cls].append((sign, cmd, target, args, time.time()))
+        JBoxd.WORK_AVAILABLE.notify_all()
 
-        t = threading.Thread(target=target, args=args, name=sign)
-        JBoxd.ACTIVE[sign] = t
-        JBoxd.LOCK.release()
-        JBoxd.log_debug("scheduled " + sign)
-        t.start()
+    @staticmethod
+    def _next_command():
+        # must be called with LOCK held
+        tnow = time.time()
+        while (len(JBoxd.DEFERRED) > 0) and (JBoxd.DEFERRED[0][0] <= tnow):
+            _due, _seq, cls, work = heapq.heappop(JBoxd.DEFERRED)
+            JBoxd.PENDING[cls].append(work + (tnow,))
+
+        for cls in JBoxd.WORKER_CLASSES:
+            if (len(JBoxd.PENDING[cls]) > 0) and (JBoxd.RUNNING[cls] < JBoxd.WORKER_LIMITS[cls]):
+                JBoxd.RUNNING[cls] += 1
+                work = JBoxd.PENDING[cls].popleft()
+                JBoxd.RUNNING_SIGNS.add(work[0])
+                return cls, work
+        return None, None
 
     @staticmethod
-    def finish_thread():
-        JBoxd.LOCK.acquire()
-        sign = threading.current_thread().name
-        del JBoxd.ACTIVE[sign]
-        JBoxd.LOCK.release()
-        JBoxd.log_debug("finished " + sign)
+    def _next_deferred_wait():
+        # must be called with LOCK held
+        if len(JBoxd.DEFERRED) == 0:
+            return None
+        return max(0.01, JBoxd.DEFERRED[0][0] - time.time())
+
+    @staticmethod
+    def _worker():
+        worker_name = threading.current_thread().name
+        while True:
+            with JBoxd.WORK_AVAILABLE:
+                cls, work = JBoxd._next_command()
+                while work is None:
+                    JBoxd.WORK_AVAILABLE.wait(JBoxd._next_deferred_wait())
+                    cls, work = JBoxd._next_command()
+
+            sign, cmd, target, args, tqueued = work
+            LatencyStats.record('jboxd.queue_wait.' + cls, time.time() - tqueued)
+            threading.current_thread().name = sign
+            try:
+                target(*args)
+            except:
+                JBoxd.log_exception("Exception running %s", sign)
+            finally:
+                JBoxCmdJournal.done(sign)
+                threading.current_thread().name = worker_name
+                with JBoxd.WORK_AVAILABLE:
+                    JBoxd.RUNNING[cls] -= 1
+                    JBoxd.RUNNING_SIGNS.discard(sign)
+                    if sign in JBoxd.FOLLOW_UP:
+                        JBoxd.FOLLOW_UP.discard(sign)
+                        JBoxd.log_debug("running again for requests received meanwhile " + sign)
+                        JBoxd._enqueue(cls, sign, cmd, target, args)
+                    else:
+                        del JBoxd.ACTIVE[sign]
+                    JBoxd.WORK_AVAILABLE.notify_all()
+                JBoxd.log_debug("finished " + sign)
+
+    @staticmethod
+    def worker_stats():
+        with JBoxd.LOCK:
+            stats = dict((cls, {
+                'queued': len(JBoxd.PENDING[cls]),
+                'deferred': 0,
+                'running': JBoxd.RUNNING[cls],
+                'limit': JBoxd.WORKER_LIMITS[cls]
+            }) for cls in JBoxd.WORKER_CLASSES)
+            for (_due, _seq, cls, _work) in JBoxd.DEFERRED:
+                stats[cls]['deferred'] += 1
+            return stats
+
+    @staticmethod
+    def _shared(name, fn, ttl=0):
+        """ Runs `fn` once for all concurrent callers using the same `name`, and returns its result to all of them.
+        A result obtained within the last `ttl` seconds is returned without running `fn` again.
+        """
+        with JBoxd.SHARED_LOCK:
+            call = JBoxd.SHARED.get(name)
+            if (call is not None) and call['done'].is_set() and ((time.time() - call['time']) > ttl):
+                call = None
+            leader = (call is None)
+            if leader:
+                call = JBoxd.SHARED[name] = {'done': threading.Event(), 'result': None, 'error': None, 'time': None}
+
+        if leader:
+            try:
+                call['result'] = fn()
+            except Exception as ex:
+                call['error'] = ex
+                with JBoxd.SHARED_LOCK:
+                    if JBoxd.SHARED.get(name) is call:
+                        del JBoxd.SHARED[name]
+            call['time'] = time.time()
+            call['done'].set()
+        else:
+            call['done'].wait()
+
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+    @staticmethod
+    def _signature(cmd, args):
+        return json.dumps({'cmd': cmd, 'args': args})
+
+    @staticmethod
+    def schedule_thread(cmd, target, args):
+        sign = JBoxd._signature(cmd, args)
+        JBoxd.log_debug("received command " + sign)
+
+        cls = JBoxd.CMD_CLASSES.get(cmd, 'maintenance')
+        with JBoxd.WORK_AVAILABLE:
+            if JBoxd.is_duplicate(sign):
+                if JBoxd.COALESCE.get(cmd, {}).get('follow_up', False) and (sign in JBoxd.RUNNING_SIGNS):
+                    JBoxd.FOLLOW_UP.add(sign)
+                    JBoxd.log_debug("will run again after current run " + sign)
+                else:
+                    JBoxd.log_debug("already processing command " + sign)
+                return
+            JBoxd.ACTIVE[sign] = cls
+            JBoxd._enqueue(cls, sign, cmd, target, args)
+        JBoxd.log_debug("scheduled %s as %s", sign, cls)
 
     @staticmethod
     @retry(7, 1, backoff=1.1)
@@ -100,18 +274,62 @@ class JBoxd(LoggerMixin):
         return cont.is_running()
 
     @staticmethod
-    @retry(7, 1, backoff=1.1)
-    def _wait_for_port(port):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    def _wait_for_ports(ports, timeout=None):
+        """ Wait for services to start listening on `ports`.
+        All ports are probed together with non-blocking connects, till all of them are up or `timeout` seconds pass.
+        Returns a dict of port to the seconds it took to be ready (None for ports that were not ready in time).
+        """
+        if timeout is None:
+            timeout = JBoxd.PORT_WAIT_SECS
+        tstart = time.time()
+        ready = dict((int(port), None) for port in ports)
+        next_probe = dict((port, tstart) for port in ready)
+        probes = {}
         try:
-            result = sock.connect_ex(('127.0.0.1', int(port)))
-            if result == 0:
-                return True
-        except:
-            JBoxd.log_exception("exception while checking port")
+            while True:
+                tnow = time.time()
+                waiting = [port for port in ready if ready[port] is None]
+                if (len(waiting) == 0) or ((tnow - tstart) >= timeout):
+                    break
+
+                probing = set(probes.values())
+                for port in waiting:
+                    if (port in probing) or (next_probe[port] > tnow):
+                        continue
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    sock.setblocking(0)
+                    result = sock.connect_ex(('127.0.0.1', port))
+                    if result == 0:
+                        sock.close()
+                        ready[port] = tnow - tstart
+                    elif result in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                        probes[sock] = port
+                    else:
+                        sock.close()
+                        next_probe[port] = tnow + JBoxd.PORT_PROBE_INTERVAL
+
+                probing = set(probes.values())
+                wait_secs = [timeout - (tnow - tstart)]
+                wait_secs.extend([next_probe[port] - tnow for port in ready
+                                  if (ready[port] is None) and (port not in probing)])
+                wait_secs = max(0, min(wait_secs))
+                if len(probes) == 0:
+                    time.sleep(wait_secs)
+                    continue
+
+                _r, connected, _x = select.select([], probes.keys(), [], wait_secs)
+                for sock in connected:
+                    port = probes.pop(sock)
+                    result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    sock.close()
+                    if result == 0:
+                        ready[port] = time.time() - tstart
+                    else:
+                        next_probe[port] = time.time() + JBoxd.PORT_PROBE_INTERVAL
         finally:
-            sock.close()
-        return False
+            for sock in probes.keys():
+                sock.close()
+        return ready
 
     @staticmethod
     @jboxd_method
@@ -122,10 +340,12 @@ class JBoxd(LoggerMixin):
         JBoxSessionProps.detach_instance(Compute.get_install_id(), cont.get_name(), Compute.get_instance_id())
         JBoxd.publish_perf_counters()
         JBoxd.publish_anticipated_load()
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_PREPARE_DISKS, JBoxd.prepare_disks, ())
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_REFILL_POOL, JBoxd.refill_pool, ())
 
     @staticmethod
     def _is_scheduled(cmd, args):
-        sign = json.dumps({'cmd': cmd, 'args': args})
+        sign = JBoxd._signature(cmd, args)
         JBoxd.LOCK.acquire()
         ret = JBoxd.is_duplicate(sign)
         JBoxd.LOCK.release()
@@ -141,32 +361,83 @@ class JBoxd(LoggerMixin):
         return True
 
     @staticmethod
-    @retry(2, 1, backoff=1.1)
-    def _launch_session(name, email, reuse):
-        cont = SessContainer.launch_by_name(name, email, reuse=reuse)
-        JBoxd.publish_perf_counters()
+    def _wait_for_services(cont):
         if not JBoxd._wait_for_container_start(cont):
             JBoxd.log_error("did not start: %s", cont.debug_str())
-            BaseContainer.DCKR.kill(cont.dockid)
             return False
         # wait for services to start
-        for port in cont.get_host_ports():
-            if not JBoxd._wait_for_port(port):
+        ready = JBoxd._wait_for_ports(cont.get_host_ports())
+        for port, secs in ready.iteritems():
+            if secs is None:
                 JBoxd.log_error("port %s did not start: %s", port, cont.debug_str())
-                BaseContainer.DCKR.kill(cont.dockid)
-                return False
             else:
-                JBoxd.log_debug("port %s active: %s", port, cont.debug_str())
+                JBoxd.log_debug("port %s active in %.3f s: %s", port, secs, cont.debug_str())
+        if None in ready.values():
+            return False
         JBoxd.log_info("passed connectivity check: %s", cont.debug_str())
         return True
 
+    @staticmethod
+    @retry(2, 1, backoff=1.1)
+    def _launch_session(name, email, reuse):
+        cont = SessContainer.launch_by_name(name, email, reuse=reuse)
+        JBoxd.publish_perf_counters()
+        tstart = time.time()
+        if not JBoxd._wait_for_services(cont):
+            BaseContainer.DCKR.kill(cont.dockid)
+            return False
+        LatencyStats.record('launch.services_ready', time.time() - tstart)
+        SessContainer.publish_progress(name, LaunchProgress.STAGE_READY)
+        return True
+
     @staticmethod
     @jboxd_method
     def launch_session(name, email, reuse=True):
-        JBoxd.publish_anticipated_load(name)
-        JBoxd._wait_for_session_backup(name)
-        VolMgr.refresh_disk_use_status()
-        JBoxd._launch_session(name, email, reuse)
+        launched = False
+        tstart = time.time()
+        try:
+            JBoxd.publish_anticipated_load(name)
+            with LatencyStats.timed('launch.backup_wait'):
+                JBoxd._wait_for_session_backup(name)
+            VolMgr.refresh_disk_use_status()
+            launched = JBoxd._launch_session(name, email, reuse)
+        finally:
+            if not launched:
+                SessContainer.publish_progress(name, LaunchProgress.STAGE_FAILED)
+        if launched:
+            LatencyStats.record('launch.total', time.time() - tstart)
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_REFILL_POOL, JBoxd.refill_pool, ())
+
+    @staticmethod
+    def _pool_target_size():
+        if SessContainer.POOL_SIZE <= 0:
+            return 0
+        # pooled containers are not counted as active, and do not add to the load considered here
+        nactive = BaseContainer.num_active(BaseContainer.SFX_INT)
+        cont_load_pct = min(100, max(0, nactive * 100 / SessContainer.MAX_CONTAINERS))
+        load_pct = max(cont_load_pct, JBoxPerfCounters.latest("MemUsed", 0))
+        if load_pct >= SessContainer.POOL_MAX_LOAD:
+            return 0
+        return max(0, min(SessContainer.POOL_SIZE, SessContainer.MAX_CONTAINERS - nactive))
+
+    @staticmethod
+    @jboxd_method
+    def refill_pool():
+        target = JBoxd._pool_target_size()
+        npooled = SessContainer.shrink_pool(target)
+        if npooled < target:
+            JBoxd.log_info("Refilling container pool. pooled: %d, target: %d", npooled, target)
+        while npooled < target:
+            cont = SessContainer.create_pool_container()
+            if cont is None:
+                JBoxd.log_info("Could not create pooled container. pooled: %d, target: %d", npooled, target)
+                break
+            if not JBoxd._wait_for_services(cont):
+                cont.delete()
+                break
+            npooled += 1
+            # sessions may have been launched meanwhile
+            target = JBoxd._pool_target_size()
 
     @staticmethod
     @jboxd_method
@@ -207,6 +478,10 @@ class JBoxd(LoggerMixin):
     def update_user_home_image():
         VolMgr.update_user_home_image(fetch=True)
         VolMgr.refresh_user_home_image()
+        # pooled containers and prepared disks were set up with the older images
+        SessContainer.shrink_pool(0)
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_PREPARE_DISKS, JBoxd.prepare_disks, ())
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_REFILL_POOL, JBoxd.refill_pool, ())
 
     @staticmethod
     @jboxd_method
@@ -214,6 +489,13 @@ class JBoxd(LoggerMixin):
         if JBoxd._is_scheduled(JBoxAsyncJob.CMD_UPDATE_USER_HOME_IMAGE, ()):
             return
         VolMgr.refresh_user_home_image()
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_PREPARE_DISKS, JBoxd.prepare_disks, ())
+
+    @staticmethod
+    @jboxd_method
+    def prepare_disks():
+        VolMgr.refresh_disk_use_status()
+        VolMgr.prepare_disks()
 
     @staticmethod
     @jboxd_method
@@ -222,6 +504,11 @@ class JBoxd(LoggerMixin):
         db.publish_stats()
         JBoxDynConfig.set_stat_collected_date(Compute.get_install_id())
 
+    @staticmethod
+    @jboxd_method
+    def sample_cluster_load():
+        Compute.sample_cluster_load()
+
     @staticmethod
     @jboxd_method
     def publish_container_stats():
@@ -238,7 +525,7 @@ class JBoxd(LoggerMixin):
             JBoxSessionProps.attach_instance(Compute.get_install_id(), session_name, iid, "Preparing")
             nactive = BaseContainer.num_active(BaseContainer.SFX_INT) + 1
         cont_load_pct = min(100, max(0, nactive * 100 / SessContainer.MAX_CONTAINERS))
-        self_load = max(Compute.get_instance_stats(iid, 'Load'), cont_load_pct)
+        self_load = max(JBoxd._self_load(), cont_load_pct)
         Compute.publish_stats("Load", "Percent", self_load)
         accept = Compute.should_accept_session(is_proposed_cluster_leader())
         JBoxInstanceProps.set_props(Compute.get_install_id(), iid, load=self_load, accept=accept)
@@ -246,12 +533,13 @@ class JBoxd(LoggerMixin):
     @staticmethod
     def publish_sessions():
         iid = Compute.get_instance_id()
+        sessions = dict()
         for c in SessContainer.session_containers(allcontainers=True):
             if ('Names' in c) and (c['Names'] is not None):
                 sessname = SessContainer(c['Id']).get_name()
                 if sessname:
-                    JBoxSessionProps.attach_instance(Compute.get_install_id(),
-                                                     sessname, iid, c["Status"])
+                    sessions[sessname] = c["Status"]
+        JBoxSessionProps.attach_instances(Compute.get_install_id(), sessions, iid)
 
     @staticmethod
     def publish_instance_state():
@@ -264,14 +552,28 @@ class JBoxd(LoggerMixin):
                 continue
             cnt = api_status.get(api_name, 0)
             api_status[api_name] = cnt + 1
-        self_load = Compute.get_instance_stats(iid, 'Load')
+        self_load = JBoxd._self_load()
         accept = Compute.should_accept_session(is_proposed_cluster_leader())
 
         JBoxInstanceProps.set_props(Compute.get_install_id(), iid, load=self_load, accept=accept, api_status=api_status)
 
+    @staticmethod
+    def _self_load():
+        load = JBoxPerfCounters.latest("Load")
+        if load is None:
+            load = Compute.get_instance_stats(Compute.get_instance_id(), 'Load')
+        return load
+
     @staticmethod
     def publish_perf_counters():
-        """ Publish performance counters. Used for status monitoring and auto scaling. """
+        """ Ask for performance counters to be sampled soon. Used after events that change them significantly.
+        Counters are sampled and published periodically by `JBoxPerfCounters`.
+        """
+        JBoxPerfCounters.request_sample()
+
+    @staticmethod
+    def sample_perf_counters():
+        """ Sample performance counters. Used for status monitoring and auto scaling. """
         VolMgr.refresh_disk_use_status()
         
         nactive = BaseContainer.num_active(BaseContainer.SFX_INT)
@@ -308,11 +610,15 @@ class JBoxd(LoggerMixin):
         api_cont_load_pct = min(100, max(0, nactive_api * 100 / APIContainer.MAX_CONTAINERS))
         stats.append(("APIContainersUsed", "Percent", api_cont_load_pct))
 
+        worker_stats = JBoxd.worker_stats()
+        stats.append(("CommandsQueued", "Count", sum([w['queued'] for w in worker_stats.values()])))
+        stats.append(("LaunchesQueued", "Count", worker_stats['launch']['queued']))
+
         stats.append(("DiskIdsUsed", "Percent", VolMgr.used_pct()))
 
         overall_load_pct = max(cont_load_pct, api_cont_load_pct, disk_used_pct, mem_used_pct, cpu_used_pct, VolMgr.used_pct())
         stats.append(("Load", "Percent", overall_load_pct))
-        Compute.publish_stats_multi(stats)
+        return stats
 
     @staticmethod
     def schedule_housekeeping(cmd, is_leader):
@@ -322,8 +628,12 @@ class JBoxd(LoggerMixin):
         features = [JBPluginTask.JBP_NODE]
         if is_leader is True:
             JBoxInstanceProps.purge_stale_instances(Compute.get_install_id())
+            JBoxd.schedule_thread(JBoxAsyncJob.CMD_SAMPLE_CLUSTER_LOAD, JBoxd.sample_cluster_load, ())
             features.append(JBPluginTask.JBP_CLUSTER)
 
+        JBoxCmdJournal.purge()
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_PREPARE_DISKS, JBoxd.prepare_disks, ())
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_REFILL_POOL, JBoxd.refill_pool, ())
         for feature in features:
             for plugin in JBPluginTask.jbox_get_plugins(feature):
                 JBoxd.schedule_thread(cmd, plugin.do_periodic_task, (feature,))
@@ -345,6 +655,23 @@ class JBoxd(LoggerMixin):
     def process_offline(self):
         self.log_debug("processing offline...")
         cmd, data = JBoxd.QUEUE.recv()
+        self.dispatch(cmd, data)
+
+    def replay_journal(self):
+        for (entry_id, sign, cmd, data, received) in JBoxCmdJournal.start():
+            age = time.time() - received
+            if age > JBoxd.JOURNAL_STALE_SECS.get(cmd, age + 1):
+                JBoxd.log_info("Discarding stale journal entry %d, received %d secs ago: %s", entry_id, age, sign)
+                JBoxCmdJournal.discard(entry_id, sign)
+                continue
+            JBoxd.log_info("Replaying journal entry %d, received %d secs ago: %s", entry_id, age, sign)
+            try:
+                self.dispatch(cmd, data, replay=True)
+            except:
+                self.log_exception("Exception replaying journal entry %d", entry_id)
+                JBoxCmdJournal.discard(entry_id, sign)
+
+    def dispatch(self, cmd, data, replay=False):
         args = ()
 
         if cmd == JBoxAsyncJob.CMD_BACKUP_CLEANUP:
@@ -353,6 +680,8 @@ class JBoxd(LoggerMixin):
         elif cmd == JBoxAsyncJob.CMD_LAUNCH_SESSION:
             args = (data[0], data[1], data[2])
             fn = JBoxd.launch_session
+            if (len(data) > 3) and not replay:
+                LatencyStats.record('launch.queue_wait', time.time() - data[3])
         elif cmd == JBoxAsyncJob.CMD_AUTO_ACTIVATE:
             fn = JBoxd.auto_activate
         elif cmd == JBoxAsyncJob.CMD_UPDATE_USER_HOME_IMAGE:
@@ -367,12 +696,49 @@ class JBoxd(LoggerMixin):
         elif cmd == JBoxAsyncJob.CMD_PLUGIN_TASK:
             args = (data[0], data[1], data[2])
             fn = JBoxd.plugin_action
+        elif cmd == JBoxAsyncJob.CMD_REFILL_POOL:
+            fn = JBoxd.refill_pool
+        elif cmd == JBoxAsyncJob.CMD_PREPARE_DISKS:
+            fn = JBoxd.prepare_disks
+        elif cmd == JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG:
+            JBoxd.invalidate_dynconfig(data[0], data[1])
+            return
         else:
             self.log_error("Unknown command " + str(cmd))
             return
 
+        if (cmd in JBoxd.JOURNALED_CMDS) and not replay:
+            JBoxCmdJournal.record(JBoxd._signature(cmd, args), cmd, data)
         JBoxd.schedule_thread(cmd, fn, args)
 
+    @staticmethod
+    def invalidate_dynconfig(keys, forward):
+        """ Drop changed dynamic configuration from the caches of processes on this instance, and of other instances
+        if `forward` is set.
+        """
+        JBoxDynConfig.invalidate(keys)
+        JBoxd.notify_dynconfig_changed(keys, forward)
+
+    @staticmethod
+    def notify_dynconfig_changed(keys, forward=True):
+        JBoxd.QUEUE.publish_invalidation(keys)
+        if forward:
+            # looking up other instances and their addresses may call the cloud. not to be done on the command loop.
+            JBoxd.schedule_thread(JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG, JBoxd.forward_dynconfig_changed, (keys,))
+
+    @staticmethod
+    @jboxd_method
+    def forward_dynconfig_changed(keys):
+        instances = ClusterView.get_instances()
+        if instances is None:
+            instances = Compute.get_all_instances()
+        self_id = Compute.get_instance_id()
+        peers = [inst for inst in instances if inst != self_id]
+        JBoxd.QUEUE.retain_peers(peers)
+        if len(peers) > 0:
+            JBoxd.log_debug("forwarding invalidation of %r to %r", keys, peers)
+            JBoxd.QUEUE.forward(JBoxAsyncJob.CMD_INVALIDATE_DYNCONFIG, [keys, False], peers)
+
     @staticmethod
     def get_session_status():
         ret = {}
@@ -392,7 +758,7 @@ class JBoxd(LoggerMixin):
                 continue
             cnt = api_status.get(api_name, 0)
             api_status[api_name] = cnt + 1
-        self_load = Compute.get_instance_stats(Compute.get_instance_id(), 'Load')
+        self_load = JBoxd._self_load()
         accept = Compute.should_accept_session(is_proposed_cluster_leader())
 
         return {'load': self_load, 'accept': accept, 'api_status': api_status}
@@ -421,11 +787,19 @@ class JBoxd(LoggerMixin):
         def _callback(cmd, data):
             try:
                 if cmd == JBoxAsyncJob.CMD_SESSION_STATUS:
-                    resp = {'code': 0, 'data': JBoxd.get_session_status()}
+                    resp = {'code': 0, 'data': JBoxd._shared('session_status', JBoxd.get_session_status, ttl=1)}
                 elif cmd == JBoxAsyncJob.CMD_API_STATUS:
-                    resp = {'code': 0, 'data': JBoxd.get_api_status()}
+                    resp = {'code': 0, 'data': JBoxd._shared('api_status', JBoxd.get_api_status, ttl=1)}
                 elif cmd == JBoxAsyncJob.CMD_IS_TERMINATING:
                     resp = {'code': 0, 'data': JBoxd.is_terminating()}
+                elif cmd == JBoxAsyncJob.CMD_LAUNCH_STATS:
+                    resp = {'code': 0, 'data': LatencyStats.summary('launch.')}
+                elif cmd == JBoxAsyncJob.CMD_WORKER_STATS:
+                    resp = {'code': 0, 'data': {
+                        'workers': JBoxd.worker_stats(),
+                        'queue_wait': LatencyStats.summary('jboxd.queue_wait.'),
+                        'db_pool_wait': LatencyStats.summary('db.')
+                    }}
                 else:
                     resp = {'code:': -2, 'data': ('unknown command %s' % (repr(cmd,)))}
             except Exception as ex:
@@ -444,7 +818,8 @@ class JBoxd(LoggerMixin):
     def run(self):
         Compute.deregister_instance_dns()
         Compute.register_instance_dns()
-        JBoxd.publish_perf_counters()
+        JBoxPerfCounters.start()
+        ClusterView.start()
         JBoxd.publish_instance_state()
         JBoxd.publish_sessions()
 
@@ -456,6 +831,9 @@ class JBoxd(LoggerMixin):
             VolMgr.update_user_home_image(fetch=False)
             VolMgr.refresh_user_home_image()
 
+        self.replay_journal()
+        JBoxd.schedule_thread(JBoxAsyncJob.CMD_REFILL_POOL, JBoxd.refill_pool, ())
+
         while True:
             self.log_debug("JBox daemon waiting for commands...")
             try:
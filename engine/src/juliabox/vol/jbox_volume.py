@@ -14,6 +14,7 @@ from juliabox.jbox_util import LoggerMixin, JBoxCfg, make_sure_path_exists
 from juliabox.jbox_util import JBoxPluginType
 from juliabox.jbox_util import create_host_mnt_command, create_container_mnt_command
 from juliabox.jbox_crypto import ssh_keygen
+from juliabox.jbox_container import ContainerInventory
 
 
 class JBoxVol(LoggerMixin):
@@ -38,6 +39,12 @@ class JBoxVol(LoggerMixin):
     - `disk_ids_used_pct()`: Percent of configured disks in use (indicates load on the system).
     - `refresh_user_home_image()`: Update any pre-created disk images with a freshly downloaded JuliaBox user home image. Not required for data volumes.
     - `release(backup)`: Release the disk. Backup contents if indicated.
+
+    Volume providers may also implement:
+    - `get_blank_disk(sessname)`: Create and return a disk not yet bound to any user, to be mounted on a pre-created
+        container named `sessname`. Returns `None` (the default) if the provider can not do this.
+    - `prepare_disks()`: Do time consuming disk setup (e.g. blanking out free disks) in advance. Invoked periodically
+        from the container manager, off the login path.
     """
 
     __metaclass__ = JBoxPluginType
@@ -103,9 +110,21 @@ class JBoxVol(LoggerMixin):
 
     @classmethod
     def get_cname(cls, cid):
-        props = JBoxVol.DCKR.inspect_container(cid)
+        props = ContainerInventory.get_props(cid)
         return props['Name'] if ('Name' in props) else None
 
+    @classmethod
+    def get_mounts(cls, cid):
+        return ContainerInventory.get_mounts(cid)
+
+    @staticmethod
+    def get_blank_disk(sessname):
+        return None
+
+    @staticmethod
+    def prepare_disks():
+        pass
+
     @classmethod
     def get_pid(cls, cid):
         props = JBoxVol.DCKR.inspect_container(cid)
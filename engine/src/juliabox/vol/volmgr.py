@@ -3,7 +3,7 @@ import datetime
 import errno
 import pytz
 
-from juliabox.jbox_util import LoggerMixin, unique_sessname
+from juliabox.jbox_util import LoggerMixin, LatencyStats, unique_sessname
 from juliabox.db import JBoxUserV2, JBoxDynConfig
 from jbox_volume import JBoxVol
 from juliabox.cloud import JBPluginCloud, Compute
@@ -151,7 +151,11 @@ class VolMgr(LoggerMixin):
             raise Exception("No plugin found for %s" % (JBoxVol.JBP_USERHOME,))
 
         disk = plugin.get_disk_for_user(email)
+        VolMgr._setup_disk_for_user(disk, email)
+        return disk
 
+    @staticmethod
+    def _setup_disk_for_user(disk, email):
         try:
             disk.setup_tutorial_link()
             disk.gen_ssh_key()
@@ -163,8 +167,50 @@ class VolMgr(LoggerMixin):
             else:
                 raise
 
+    @staticmethod
+    def get_blank_disks(sessname):
+        """ Disks (home, config, packages) for a pre-created container not yet bound to any user.
+        Returns None if any of the volume plugins can not provide a blank disk.
+        """
+        disks = []
+        for disktype in (JBoxVol.JBP_USERHOME, JBoxVol.JBP_CONFIG, JBoxVol.JBP_PKGBUNDLE):
+            plugin = JBoxVol.jbox_get_plugin(disktype)
+            disk = plugin.get_blank_disk(sessname) if plugin is not None else None
+            if disk is None:
+                VolMgr.log_debug("no blank disk of type %s available for %s", disktype, sessname)
+                for allocated in disks:
+                    allocated.release()
+                return None
+            disks.append(disk)
+        return tuple(disks)
+
+    @staticmethod
+    def assign_disk_to_user(cid, email):
+        """ Bind the blank home disk mounted on a pre-created container to a user and restore the user's backup. """
+        VolMgr.log_debug("restoring disk in %s for %s", cid, email)
+
+        plugin = JBoxVol.jbox_get_plugin(JBoxVol.JBP_USERHOME)
+        if plugin is None:
+            raise Exception("No plugin found for %s" % (JBoxVol.JBP_USERHOME,))
+
+        blank_disk = plugin.get_disk_from_container(cid)
+        if blank_disk is None:
+            raise Exception("No %s disk mounted on %s" % (JBoxVol.JBP_USERHOME, cid))
+
+        disk = plugin(blank_disk.disk_path, user_email=email)
+        with LatencyStats.timed('launch.restore'):
+            disk.restore()
+        VolMgr._setup_disk_for_user(disk, email)
         return disk
 
+    @staticmethod
+    def prepare_disks():
+        for plugin in JBoxVol.plugins:
+            try:
+                plugin.prepare_disks()
+            except:
+                VolMgr.log_exception("error preparing disks for %r", plugin)
+
     @staticmethod
     def refresh_disk_use_status(container_id_list=None):
         for plugin in JBoxVol.plugins:
@@ -200,7 +246,7 @@ class VolMgr(LoggerMixin):
             }
         }
 
-        result_set = JBoxUserV2.table().scan(attributes=('user_id',))
+        result_set = JBoxUserV2.scan(attributes=('user_id',))
         for user in result_set:
             VolMgr.calc_stat(user['user_id'])
 
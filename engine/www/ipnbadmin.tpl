@@ -128,6 +128,11 @@
 	    		parent.JuliaBox.show_instance_info('load', 'Instance Loads (percent)');
 	    	});
 
+	    	$('#showscaler').click(function(event){
+	    		event.preventDefault();
+	    		parent.JuliaBox.show_stats('stat_scaler', 'Scaler Forecast');
+	    	});
+
 	    	$('#showsessions').click(function(event){
 	    		event.preventDefault();
 	    		parent.JuliaBox.show_instance_info('sessions', 'Sessions');
@@ -206,6 +211,7 @@ Julia versions and packages: <a href="#" class="showpackages" id="showpackages-0
         <tr><td>Sessions:</td><td><a href="#" id="showsessions">View</a></td></tr>
         <tr><td>API Containers:</td><td><a href="#" id="showapis">View</a></td></tr>
         <tr><td>Instance Loads:</td><td><a href="#" id="showinstanceloads">View</a></td></tr>
+        <tr><td>Scaler Forecast:</td><td><a href="#" id="showscaler">View</a></td></tr>
 {% end %}
     </table>
     <br/><br/>
@@ -2,27 +2,40 @@
 
 {% block head %}
 <script type="text/javascript">
-    var monitor_loading_timer;
+    var loading_stage = '';
+    var loading_messages = {
+        'queued': 'Creating a JuliaBox instance just for you!',
+        'restored': 'Restored your files. Setting up your instance...',
+        'created': 'Setting up your instance...',
+        'started': 'Starting up services...'
+    };
 
+    // the server holds each request till the launch progresses, so poll again right away
     function monitor_loading() {
         $.ajax({
-            url: '/?monitor_loading=yes',
+            url: '/?monitor_loading=yes&stage=' + encodeURIComponent(loading_stage),
             type: 'GET',
             success: function(res) {
                 if(res.code != 0) {
-                    clearInterval(monitor_loading_timer);
                     top.location.href = '/';
+                    return;
+                }
+                if(res.stage) {
+                    loading_stage = res.stage;
+                    if(loading_messages[res.stage]) {
+                        $('#loading_state').text(loading_messages[res.stage]);
+                    }
                 }
+                setTimeout(monitor_loading, 100);
             },
             error: function(res) {
-                clearInterval(monitor_loading_timer);
                 top.location.href = '/';
             }
         });
     };
 
     $(document).ready(function() {
-        monitor_loading_timer = setInterval(monitor_loading, 2000);
+        monitor_loading();
     });
 </script>
 {% end %}
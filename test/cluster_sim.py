@@ -0,0 +1,519 @@
+#! /usr/bin/env python
+""" Discrete event simulation of a JuliaBox cluster, to benchmark placement and scaling policies offline.
+
+Replays a trace of session arrivals through the placement and scaling logic of a compute plugin (CompEC2 or CompGCE)
+and the configured scaler, called via the Compute facade exactly as the session and container managers do.
+Cloud APIs, Docker and the database are replaced with simulated backends, and policies see simulated time,
+so a week of traffic replays in seconds. Scale up decisions, including cooldowns, are the plugin's own; only the
+autoscale group / instance group calls beneath them are simulated. Requires the engine's python packages, but no cloud account or Docker.
+
+A trace is a CSV file of `arrival_secs,duration_secs` lines, with arrivals relative to the start of the trace.
+Traces start on a Monday at 00:00 UTC. Use `generate` to create a synthetic trace with weekday class peaks.
+
+Reports rejected sessions, redirect hops, time to launch and instance hours.
+"""
+__author__ = 'tan'
+
+import sys
+import os
+import csv
+import datetime
+import heapq
+import math
+import random
+import sqlite3
+import time
+import types
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "engine", "src"))
+
+from juliabox.jbox_util import LoggerMixin, JBoxCfg
+from juliabox.cloud import Compute
+from juliabox.db import JBoxDynConfig
+
+
+class SimClock(object):
+    """ Simulated time. Installed as the `time` module of modules whose policies read the clock. """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def gmtime(self, ts=None):
+        return time.gmtime(self.now if ts is None else ts)
+
+    def strftime(self, fmt, t=None):
+        return time.strftime(fmt, self.gmtime() if t is None else t)
+
+
+class SimInstance(object):
+    def __init__(self, instance_id, started):
+        self.instance_id = instance_id
+        self.started = started
+        self.booted = None
+        self.terminated = None
+        self.sessions = 0
+        self.load = 0
+        self.image_version = 1
+
+
+def sim_datetime(clock):
+    """ A `datetime` module whose `datetime.utcnow()` and `datetime.now()` read simulated time. """
+    class SimDatetime(datetime.datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.datetime.utcfromtimestamp(clock.now)
+
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.datetime.fromtimestamp(clock.now, tz)
+
+    mod = types.ModuleType('datetime')
+    mod.__dict__.update(datetime.__dict__)
+    mod.datetime = SimDatetime
+    return mod
+
+
+class SimAutoscaleGroup(object):
+    def __init__(self, desired_capacity, max_size):
+        self.desired_capacity = desired_capacity
+        self.max_size = max_size
+
+
+class SimAutoscale(object):
+    """ The EC2 autoscale connection. Scaling activities honor the group cooldown, as AWS does when asked to. """
+    COOLDOWN_SECS = 300
+    # instances added by the scale up policy
+    POLICY_ADJUSTMENT = 1
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.last_activity = None
+
+    def _in_cooldown(self):
+        return (self.last_activity is not None) and \
+            (self.sim.clock.now < self.last_activity + SimAutoscale.COOLDOWN_SECS)
+
+    def _scale(self, capacity, honor_cooldown):
+        # AWS rejects an activity requested during cooldown, and the request is lost
+        if honor_cooldown and self._in_cooldown():
+            return
+        self.last_activity = self.sim.clock.now
+        self.sim._set_capacity(capacity)
+
+    def get_all_groups(self, names=None):
+        return [SimAutoscaleGroup(self.sim.capacity, ClusterSim.MAX_INSTANCES)]
+
+    def set_desired_capacity(self, group_name, desired_capacity, honor_cooldown=False):
+        self._scale(desired_capacity, honor_cooldown)
+
+    def execute_policy(self, policy_name, as_group=None, honor_cooldown=None):
+        self._scale(self.sim.capacity + SimAutoscale.POLICY_ADJUSTMENT, honor_cooldown == 'true')
+
+
+class SimRequest(object):
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+class SimGCE(object):
+    """ The GCE compute API, just the instance group manager calls used to scale up. """
+    def __init__(self, sim):
+        self.sim = sim
+
+    def instanceGroupManagers(self):
+        return self
+
+    def get(self, project, zone, instanceGroupManager):
+        return SimRequest(lambda: {'targetSize': self.sim.capacity})
+
+    def resize(self, project, zone, instanceGroupManager, size):
+        return SimRequest(lambda: self.sim._set_capacity(size))
+
+
+class SimScaleUpStore(object):
+    """ The `scale_up_time` table of the CloudSQL database, in SQLite. Cursors return row counts like MySQLdb. """
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute('CREATE TABLE scale_up_time (scale_up_time INT, last_increment INT)')
+        self.db.execute('INSERT INTO scale_up_time VALUES (0, 0)')
+
+    def conn(self):
+        return self
+
+    def cursor(self):
+        return SimScaleUpStore.Cursor(self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+
+    class Cursor(object):
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        def execute(self, sql):
+            return self.cursor.execute(sql).rowcount
+
+        def fetchone(self):
+            return self.cursor.fetchone()
+
+        def close(self):
+            self.cursor.close()
+
+
+class ClusterSim(LoggerMixin):
+    # 2015-01-05 00:00 UTC, a Monday
+    TRACE_START = 1420416000
+
+    CONFIG = {
+        'root_log_level': logging.ERROR,
+        'jbox_log_level': logging.ERROR,
+        'numhopmax': 10,
+        'cloud_host': {
+            'install_id': 'JuliaBoxSim',
+            'autoscale_group': 'juliabox-sim',
+            'scale_down': True,
+            'scale_up_at_load': 70,
+            'scale_up_policy': 'addinstance',
+            'min_uptime': 50,
+        },
+        'predictive_scaler': {
+            'sample_secs': 300
+        }
+    }
+
+    # sessions per instance (interactive.numlocalmax)
+    MAX_SESSIONS = 30
+    INITIAL_INSTANCES = 2
+    MAX_INSTANCES = 100
+    BOOT_SECS = 300
+    LAUNCH_SECS = 10
+    HOP_SECS = 1
+    PUBLISH_SECS = 60
+    HOUSEKEEPING_SECS = 300
+
+    def __init__(self, plugin_name, scaler_name=None):
+        JBoxCfg.nv = ClusterSim.CONFIG
+        LoggerMixin.configure()
+        self.numhopmax = JBoxCfg.get('numhopmax')
+
+        self.clock = SimClock(ClusterSim.TRACE_START)
+        self.events = []
+        self.seq = 0
+        self.instances = {}
+        self.current = None
+        self.stats = {}
+        self.capacity = 0
+        self.plugin_name = plugin_name
+
+        if scaler_name == 'predictive':
+            from juliabox.plugins.scaler_predictive import impl_predictive
+            impl_predictive.time = self.clock
+        elif scaler_name is not None:
+            raise Exception("unknown scaler %s" % (scaler_name,))
+
+        if plugin_name == 'ec2':
+            from juliabox.plugins.compute_ec2 import CompEC2
+            self.plugin = CompEC2
+        elif plugin_name == 'gce':
+            from juliabox.plugins.compute_gce import CompGCE
+            self.plugin = CompGCE
+        else:
+            raise Exception("unknown compute plugin %s" % (plugin_name,))
+
+        self._install_backends()
+        self.plugin.configure()
+        Compute.impl = self.plugin
+        Compute.SCALE = JBoxCfg.get('cloud_host.scale_down')
+
+    def _install_backends(self):
+        sim = self
+        dynconfig = {}
+
+        def get_instance_id():
+            return sim.current.instance_id
+
+        def get_all_instances(gname=None):
+            return sorted(sim._running().keys())
+
+        def get_instance_stats(instance, stat_name, namespace=None):
+            inst = sim.instances.get(instance)
+            return inst.load if (stat_name == 'Load') and (inst is not None) else None
+
+        def get_cluster_stats(stat_name, namespace=None):
+            if stat_name != 'Load':
+                return {}
+            return dict((iid, inst.load) for (iid, inst) in sim._running().iteritems())
+
+        def image_version(inst_id):
+            return sim.instances[inst_id].image_version
+
+        def uptime_minutes(instance_id=None):
+            inst = sim.current if instance_id is None else sim.instances[instance_id]
+            return int((sim.clock.now - inst.booted) / 60)
+
+        def terminate_instance(instance=None):
+            sim._terminate(sim.current if instance is None else sim.instances[instance])
+
+        def publish_stats(stat_name, stat_unit, stat_value):
+            if stat_name == 'Load':
+                sim.current.load = stat_value
+
+        def publish_stats_multi(stats):
+            for (stat_name, stat_unit, stat_value) in stats:
+                publish_stats(stat_name, stat_unit, stat_value)
+
+        for (name, fn) in (('get_instance_id', get_instance_id),
+                           ('get_all_instances', get_all_instances),
+                           ('get_instance_stats', get_instance_stats),
+                           ('get_cluster_stats', get_cluster_stats),
+                           ('_image_version', image_version),
+                           ('_uptime_minutes', uptime_minutes),
+                           ('terminate_instance', terminate_instance),
+                           ('publish_stats', publish_stats),
+                           ('publish_stats_multi', publish_stats_multi)):
+            setattr(self.plugin, name, staticmethod(fn))
+
+        # scale up goes through the plugin's own _add_instance, only the cloud APIs it calls are simulated
+        if self.plugin_name == 'ec2':
+            from juliabox.plugins.compute_ec2 import impl_ec2
+            impl_ec2.datetime = sim_datetime(self.clock)
+            autoscale = SimAutoscale(self)
+            self.plugin.LAST_SCALE_UP_TIME = None
+            self.plugin._connect_autoscale = staticmethod(lambda: autoscale)
+        else:
+            from juliabox.plugins.compute_gce import impl_gce
+            impl_gce.time = self.clock
+            gce = SimGCE(self)
+            store = SimScaleUpStore()
+            self.plugin.ZONE = 'sim-zone'
+            self.plugin._connect_gce = staticmethod(lambda: gce)
+            self.plugin._get_db_plugin = staticmethod(lambda: store)
+
+        JBoxDynConfig.get_stat = staticmethod(lambda cluster, stat_name: dynconfig.get(stat_name))
+        JBoxDynConfig.set_stat = staticmethod(lambda cluster, stat_name, stat: dynconfig.__setitem__(stat_name, stat))
+
+    def _running(self):
+        return dict((iid, inst) for (iid, inst) in self.instances.iteritems()
+                    if (inst.booted is not None) and (inst.terminated is None))
+
+    def _leader(self):
+        running = self._running().values()
+        if len(running) == 0:
+            return None
+        return min(running, key=lambda inst: (inst.started, inst.instance_id))
+
+    def _schedule(self, at, action, *args):
+        self.seq += 1
+        heapq.heappush(self.events, (at, self.seq, action, args))
+
+    def _count(self, name, incr=1):
+        self.stats[name] = self.stats.get(name, 0) + incr
+
+    def _set_capacity(self, capacity, boot_secs=None):
+        # the autoscale / instance group launches instances till it has `capacity` of them
+        self.capacity = min(capacity, ClusterSim.MAX_INSTANCES)
+        live = len([inst for inst in self.instances.values() if inst.terminated is None])
+        for _ in range(self.capacity - live):
+            inst = SimInstance('i-%04d' % (len(self.instances),), self.clock.now)
+            self.instances[inst.instance_id] = inst
+            self._schedule(self.clock.now + (ClusterSim.BOOT_SECS if boot_secs is None else boot_secs),
+                           self._on_boot, inst)
+            self._count('instances started')
+
+    def _terminate(self, inst):
+        # instances are removed from the group along with a decrement of its capacity
+        inst.terminated = self.clock.now
+        self.capacity -= 1
+        self._count('instances terminated')
+
+    def _as_instance(self, inst, fn, *args):
+        self.current = inst
+        try:
+            return fn(*args)
+        finally:
+            self.current = None
+
+    def _is_leader(self, inst):
+        return self._leader() is inst
+
+    def _publish_load(self, inst):
+        load = min(100, max(0, inst.sessions * 100 / ClusterSim.MAX_SESSIONS))
+        self._as_instance(inst, Compute.publish_stats, 'Load', 'Percent', load)
+
+    def _on_boot(self, inst):
+        inst.booted = self.clock.now
+        self._publish_load(inst)
+
+    def _on_publish(self):
+        # container manager: publish load and instance state, which also requests scale up if required
+        for inst in self._running().values():
+            self._publish_load(inst)
+            self._as_instance(inst, Compute.should_accept_session, self._is_leader(inst))
+        self._schedule(self.clock.now + ClusterSim.PUBLISH_SECS, self._on_publish)
+
+    def _on_housekeeping(self):
+        # container manager of the cluster leader: sample cluster load for the predictive scaler
+        leader = self._leader()
+        if leader is not None:
+            self._as_instance(leader, Compute.sample_cluster_load)
+        for inst in self._running().values():
+            if (inst.sessions == 0) and self._as_instance(inst, Compute.can_terminate, self._is_leader(inst)):
+                self._terminate(inst)
+        self._schedule(self.clock.now + ClusterSim.HOUSEKEEPING_SECS, self._on_housekeeping)
+
+    def _on_arrival(self, arrival, duration, hops, inst):
+        running = self._running()
+        if (inst is None) or (inst.instance_id not in running):
+            # load balancer
+            inst = running[random.choice(sorted(running.keys()))]
+
+        if hops > self.numhopmax:
+            self_load = self._as_instance(inst, Compute.get_instance_stats, inst.instance_id, 'Load')
+            accept = self_load < 100
+        else:
+            accept = self._as_instance(inst, Compute.should_accept_session, self._is_leader(inst))
+
+        if accept:
+            inst.sessions += 1
+            self._publish_load(inst)
+            launched = self.clock.now + ClusterSim.LAUNCH_SECS
+            self._schedule(launched + duration, self._on_departure, inst)
+            self.launch_times.append(launched - arrival)
+            self.hops.append(hops)
+            self._count('sessions launched')
+        elif hops > self.numhopmax:
+            self._count('sessions rejected')
+        else:
+            redirect = self._as_instance(inst, Compute.get_redirect_instance_id)
+            self._schedule(self.clock.now + ClusterSim.HOP_SECS, self._on_arrival, arrival, duration, hops + 1,
+                           self.instances.get(redirect))
+
+    def _on_departure(self, inst):
+        inst.sessions -= 1
+        self._publish_load(inst)
+
+    def run(self, trace):
+        """ Replay `trace`, a list of (arrival_secs, duration_secs). Returns a report as a dict. """
+        random.seed(0)
+        self.launch_times = []
+        self.hops = []
+
+        self.current = None
+        self._set_capacity(ClusterSim.INITIAL_INSTANCES, boot_secs=0)
+        end = ClusterSim.TRACE_START
+        for (arrival, duration) in trace:
+            self._schedule(ClusterSim.TRACE_START + arrival, self._on_arrival, ClusterSim.TRACE_START + arrival,
+                           duration, 0, None)
+            end = max(end, ClusterSim.TRACE_START + arrival + duration)
+        self._schedule(ClusterSim.TRACE_START, self._on_publish)
+        self._schedule(ClusterSim.TRACE_START, self._on_housekeeping)
+
+        max_running = 0
+        while len(self.events) > 0:
+            at, _seq, action, args = heapq.heappop(self.events)
+            if at > end:
+                break
+            self.clock.now = at
+            action(*args)
+            max_running = max(max_running, len(self._running()))
+
+        return self._report(end, max_running)
+
+    @staticmethod
+    def _percentile(vals, pct):
+        if len(vals) == 0:
+            return None
+        vals = sorted(vals)
+        return vals[min(len(vals) - 1, int(math.ceil(pct * len(vals) / 100.0)) - 1)]
+
+    def _report(self, end, max_running):
+        instance_secs = 0
+        for inst in self.instances.values():
+            if inst.booted is not None:
+                # billed from start of boot
+                instance_secs += (end if inst.terminated is None else inst.terminated) - inst.started
+
+        launched = self.stats.get('sessions launched', 0)
+        rejected = self.stats.get('sessions rejected', 0)
+        report = {
+            'simulated hours': (end - ClusterSim.TRACE_START) / 3600.0,
+            'sessions': launched + rejected,
+            'sessions launched': launched,
+            'sessions rejected': rejected,
+            'rejected percent': (100.0 * rejected / (launched + rejected)) if (launched + rejected) > 0 else 0,
+            'sessions redirected': len([h for h in self.hops if h > 0]),
+            'redirect hops mean': (float(sum(self.hops)) / len(self.hops)) if len(self.hops) > 0 else 0,
+            'redirect hops max': max(self.hops) if len(self.hops) > 0 else 0,
+            'time to launch p50 secs': ClusterSim._percentile(self.launch_times, 50),
+            'time to launch p95 secs': ClusterSim._percentile(self.launch_times, 95),
+            'time to launch p99 secs': ClusterSim._percentile(self.launch_times, 99),
+            'instance hours': instance_secs / 3600.0,
+            'instances max': max_running,
+            'instances started': self.stats.get('instances started', 0),
+            'instances terminated': self.stats.get('instances terminated', 0),
+        }
+        return report
+
+
+def read_trace(filename):
+    trace = []
+    with open(filename) as f:
+        for row in csv.reader(f):
+            if (len(row) < 2) or row[0].startswith('#'):
+                continue
+            trace.append((float(row[0]), float(row[1])))
+    trace.sort()
+    return trace
+
+
+def generate_trace(filename, days, base_per_hour=20, class_size=150):
+    """ Poisson arrivals at a diurnal rate, with a class of `class_size` logging in at 10:00 UTC every weekday. """
+    random.seed(0)
+    with open(filename, 'w') as f:
+        out = csv.writer(f)
+        out.writerow(['# arrival_secs', 'duration_secs'])
+        for hour in range(int(days * 24)):
+            hour_of_day = hour % 24
+            rate = base_per_hour * (0.5 + 0.5 * math.sin(math.pi * (hour_of_day - 6) / 12.0) + 0.25)
+            t = hour * 3600 + random.expovariate(rate / 3600.0)
+            while t < (hour + 1) * 3600:
+                out.writerow([int(t), int(random.expovariate(1.0 / 1800))])
+                t += random.expovariate(rate / 3600.0)
+            if (hour_of_day == 10) and ((hour / 24) % 7 < 5):
+                for _ in range(class_size):
+                    out.writerow([hour * 3600 + random.randint(0, 600), random.randint(3000, 4200)])
+
+
+def process_args(argv):
+    if len(argv) < 3:
+        print("Usage:")
+        print("\t%s run <trace.csv> [ec2|gce] [predictive]" % (argv[0],))
+        print("\t%s generate <trace.csv> <days> [base_sessions_per_hour] [class_size]" % (argv[0],))
+        exit(1)
+    cmd = argv[1]
+    if cmd == 'run':
+        plugin_name = argv[3] if len(argv) > 3 else 'ec2'
+        scaler_name = argv[4] if len(argv) > 4 else None
+        sim = ClusterSim(plugin_name, scaler_name)
+        tstart = time.time()
+        report = sim.run(read_trace(argv[2]))
+        for name in sorted(report.keys()):
+            print("%-28s %r" % (name, report[name]))
+        print("%-28s %.1f" % ('wall clock secs', time.time() - tstart))
+    elif cmd == 'generate':
+        days = float(argv[3]) if len(argv) > 3 else 7
+        base = float(argv[4]) if len(argv) > 4 else 20
+        class_size = int(argv[5]) if len(argv) > 5 else 150
+        generate_trace(argv[2], days, base, class_size)
+
+    print("Done")
+
+
+if __name__ == "__main__":
+    process_args(sys.argv)
@@ -1,10 +1,13 @@
 import datetime
 import os
+import time
 import docker
+import pytz
 
 from jbox_util import JBoxCfg, LoggerMixin, unique_sessname
 from juliabox import db
-from juliabox.db import JBoxDynConfig, JBoxSessionProps, JBoxUserV2
+from juliabox.db import JBoxDB, JBoxDynConfig, JBoxSessionProps, JBoxUserV2, JBoxDBItemNotFound
+from juliabox.interactive import SessContainer, SessDeadlines
 from juliabox.cloud import JBPluginCloud
 from juliabox.cloud import Compute
 
@@ -62,6 +65,73 @@ class TestDBTables(LoggerMixin):
         count_created = JBoxUserV2.count_created(48)
         TestDBTables.log_debug("accounts created in last 1 hour: %d", count_created)
 
+        TestDBTables.test_writes()
+        TestDBTables.test_paging()
+
+    @staticmethod
+    def test_writes():
+        name = JBoxDB.qual(TESTCLSTR, 'test_upsert')
+        JBoxDynConfig.upsert({'name': name}, {'value': 'created'})
+        assert JBoxDynConfig(name).get_value() == 'created'
+        JBoxDynConfig.upsert({'name': name}, {'value': 'updated'})
+        assert JBoxDynConfig(name).get_value() == 'updated'
+        JBoxDynConfig(name).delete()
+
+        records = [{'name': JBoxDB.qual(TESTCLSTR, 'test_batch_%d' % (idx,)), 'value': str(idx)}
+                   for idx in range(3)]
+        JBoxDynConfig.batch_create(records)
+        for record in records:
+            assert JBoxDynConfig(record['name']).get_value() == record['value']
+        JBoxDynConfig.batch_delete(records)
+        for record in records:
+            try:
+                JBoxDynConfig(record['name'])
+                assert False
+            except JBoxDBItemNotFound:
+                pass
+
+    @staticmethod
+    def test_paging():
+        prefix = JBoxDB.qual(TESTCLSTR, 'test_page_')
+        records = [{'name': prefix + str(idx), 'value': str(idx)} for idx in range(5)]
+        JBoxDynConfig.batch_create(records)
+        try:
+            names = []
+            start_key = None
+            npages = 0
+            while True:
+                page, start_key = JBoxDynConfig.scan_page(page_size=2, start_key=start_key, name__beginswith=prefix,
+                                                          attributes=('name',))
+                names.extend([record['name'] for record in page])
+                npages += 1
+                if start_key is None:
+                    break
+            assert sorted(names) == sorted([record['name'] for record in records])
+            assert npages >= 3
+            TestDBTables.log_debug("scanned %d records in %d pages", len(names), npages)
+
+            names = [record['name'] for record in JBoxDynConfig.scan(max_page_size=2, name__beginswith=prefix)]
+            assert sorted(names) == sorted([record['name'] for record in records])
+        finally:
+            JBoxDynConfig.batch_delete(records)
+
+
+class TestSessContainer(LoggerMixin):
+    @staticmethod
+    def test():
+        # usage of a session in a container claimed from the pool is recorded from the claim
+        cname = '/' + unique_sessname('tanmaykm@gmail.com')
+        created = datetime.datetime.now(pytz.utc) - datetime.timedelta(hours=1)
+        cont = SessContainer('testcontainer')
+        cont.props = {'Name': cname, 'Created': created.isoformat()}
+        assert cont.time_session_started() == created
+
+        claimed_at = time.time()
+        SessDeadlines.record_claim(cname, claimed_at)
+        assert cont.time_session_started() >= datetime.datetime.fromtimestamp(claimed_at, pytz.utc)
+        SessDeadlines.forget(cname)
+        assert cont.time_session_started() == created
+
 
 class TestSES(LoggerMixin):
     @staticmethod
@@ -78,4 +148,5 @@ class TestSES(LoggerMixin):
 
 if __name__ == "__main__":
     TestDBTables.test()
+    TestSessContainer.test()
     TestSES.test()
\ No newline at end of file